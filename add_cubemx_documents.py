@@ -15,6 +15,7 @@ sys.path.insert(0, current_dir)
 
 from app.services.document_processor import DocumentProcessor
 from app.models.simple_vector_db import SimpleVectorDatabase
+from app.services.ingestion_manifest import sync_files
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -69,49 +70,44 @@ def main():
         logger.error("CubeMX関連ファイルが見つかりません")
         return
     
-    # ドキュメントを処理
+    # ドキュメントを処理（変更のないファイルは飛ばし、ページ単位でストリーミングしながら追加）
     try:
-        documents = doc_processor.create_documents(existing_files, "NUCLEO-F767ZI")
-        logger.info(f"作成されたCubeMX関連チャンク数: {len(documents)}")
+        def set_category(doc):
+            """カテゴリをCubeMXに設定"""
+            if "cubemx" in doc.metadata.get("filename", "").lower() or "cube" in doc.metadata.get("filename", "").lower():
+                doc.metadata["category"] = "cubemx_tool"
+            elif "nucleo" in doc.metadata.get("filename", "").lower():
+                doc.metadata["category"] = "hardware"
         
-        if documents:
-            # カテゴリをCubeMXに設定
-            for doc in documents:
-                if "cubemx" in doc.metadata.get("filename", "").lower() or "cube" in doc.metadata.get("filename", "").lower():
-                    doc.metadata["category"] = "cubemx_tool"
-                elif "nucleo" in doc.metadata.get("filename", "").lower():
-                    doc.metadata["category"] = "hardware"
+        summary = sync_files(vector_db, existing_files, "NUCLEO-F767ZI",
+                             processor=doc_processor, on_document=set_category)
+        logger.info(f"作成されたCubeMX関連チャンク数: {summary['chunks']}（変更のないファイル: {summary['unchanged']}）")
+        
+        if summary["chunks"] or summary["unchanged"]:
+            logger.info("CubeMX関連ドキュメントの追加完了！")
+            
+            # 更新後の統計情報を表示
+            updated_stats = vector_db.get_collection_stats()
+            logger.info(f"更新後のドキュメント統計: {updated_stats}")
             
-            # ベクトルDBに追加
-            success = vector_db.add_documents(documents, "NUCLEO-F767ZI")
+            # CubeMX関連のテスト検索
+            logger.info("\\n=== CubeMXテスト検索 ===")
+            test_queries = [
+                "CubeMX",
+                "STM32CubeMX",
+                "プロジェクト作成",
+                "ピン設定",
+                "コード生成",
+            ]
             
-            if success:
-                logger.info("CubeMX関連ドキュメントの追加完了！")
-                
-                # 更新後の統計情報を表示
-                updated_stats = vector_db.get_collection_stats()
-                logger.info(f"更新後のドキュメント統計: {updated_stats}")
-                
-                # CubeMX関連のテスト検索
-                logger.info("\\n=== CubeMXテスト検索 ===")
-                test_queries = [
-                    "CubeMX",
-                    "STM32CubeMX",
-                    "プロジェクト作成",
-                    "ピン設定",
-                    "コード生成",
-                ]
-                
-                for query in test_queries:
-                    results = vector_db.search_similar_documents(query, k=3, score_threshold=0.05)
-                    logger.info(f"クエリ: '{query}' -> {len(results)}件の結果")
-                    for i, (doc, score) in enumerate(results):
-                        source = doc.metadata.get("filename", "不明")
-                        category = doc.metadata.get("category", "一般")
-                        logger.info(f"  {i+1}. {source} ({category}) - スコア: {score:.3f}")
-                        
-            else:
-                logger.error("ベクトルDBへの追加に失敗しました")
+            for query in test_queries:
+                results = vector_db.search_similar_documents(query, k=3, score_threshold=0.05)
+                logger.info(f"クエリ: '{query}' -> {len(results)}件の結果")
+                for i, (doc, score) in enumerate(results):
+                    source = doc.metadata.get("filename", "不明")
+                    category = doc.metadata.get("category", "一般")
+                    logger.info(f"  {i+1}. {source} ({category}) - スコア: {score:.3f}")
+                    
         else:
             logger.error("ドキュメントの処理に失敗しました")
             
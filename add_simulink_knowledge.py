@@ -19,15 +19,9 @@ from langchain.schema import Document
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def add_simulink_knowledge():
-    """Simulink関連ナレッジをベクトルDBに追加"""
-    logger.info("Simulink関連ナレッジを追加中...")
-    
-    # ベクトルDBを初期化
-    vector_db = SimpleVectorDatabase()
-    
-    # Simulink関連のドキュメントを作成
-    simulink_docs = [
+def build_simulink_documents():
+    """Simulink関連のドキュメントを作成"""
+    return [
         Document(
             page_content="""
 STM32 NUCLEO-F767ZIでのSimulink開発環境セットアップ
@@ -206,6 +200,16 @@ Simulinkサンプルアプリケーション集
             }
         )
     ]
+
+def add_simulink_knowledge():
+    """Simulink関連ナレッジをベクトルDBに追加"""
+    logger.info("Simulink関連ナレッジを追加中...")
+    
+    # ベクトルDBを初期化
+    vector_db = SimpleVectorDatabase()
+    
+    # Simulink関連のドキュメントを作成
+    simulink_docs = build_simulink_documents()
     
     logger.info(f"作成されたSimulinkドキュメント数: {len(simulink_docs)}")
     
@@ -237,7 +241,7 @@ Simulinkサンプルアプリケーション集
                 source = doc.metadata.get("filename", "不明")
                 category = doc.metadata.get("category", "一般")
                 logger.info(f"  {i+1}. {source} ({category}) - スコア: {score:.3f}")
-                
+    
     else:
         logger.error("ベクトルDBへの追加に失敗しました")
 
@@ -13,7 +13,6 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(current_dir)
 
 from models.simple_vector_db import SimpleVectorDatabase
-from models.document_processor import DocumentProcessor
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -24,7 +23,7 @@ class OnlineDocumentBootstrap:
     def __init__(self, vector_db=None):
         self.vector_db = vector_db or SimpleVectorDatabase()
         try:
-            from models.document_processor import DocumentProcessor
+            from services.document_processor import DocumentProcessor
             self.doc_processor = DocumentProcessor()
         except:
             self.doc_processor = None
@@ -157,7 +156,7 @@ Ctrl+B でコード生成・フラッシュ書き込み実行
     def is_bootstrap_needed(self) -> bool:
         """ブートストラップが必要かチェック"""
         try:
-            doc_count = len(self.vector_db.documents)
+            doc_count = self.vector_db.count_documents()
             return doc_count < 5  # 基本文書数未満の場合
         except:
             return True
@@ -59,6 +59,28 @@ class Config:
     VECTOR_DB_PATH = "../data/vector_store"
     CHUNK_SIZE = 1000
     CHUNK_OVERLAP = 200
+    INGESTION_WORKERS = 0  # PDFのテキスト抽出を並列に行うプロセス数（0でCPU数、1で逐次）
+    PDF_PAGES_PER_TASK = 16  # 並列抽出で1タスクが受け持つPDFのページ数
+    INGESTION_BATCH_SIZE = 512  # ストリーミング取り込みで1回に索引へ登録するチャンク数
+    INGESTION_QUEUE_SIZE = 32  # ストリーミング取り込みの段の間のキューの長さ（ページ・チャンク数）
+    CONTEXT_TOKEN_BUDGET = 2000  # 回答生成のプロンプトに含めるチャンクのトークン数の上限
+    CODE_CONTEXT_TOKEN_BUDGET = 1000  # コード生成のプロンプトに含めるチャンクのトークン数の上限
+    
+    # シンプルインデックス（TF-IDF）のセグメント設定
+    SIMPLE_INDEX_MAX_SEGMENTS = 8  # これを超えたらバックグラウンドでコンパクション
+    SIMPLE_INDEX_MAX_DELETED_RATIO = 0.2  # 削除済みチャンクの割合がこれを超えたらコンパクション
+    SIMPLE_INDEX_RANKING = "tfidf"  # 既定の順位付け: tfidf / bm25 / bm25+
+    BM25_K1 = 1.2  # TFの飽和の強さ
+    BM25_B = 0.75  # 文書長による正規化の強さ（0で正規化なし）
+    BM25_PLUS_DELTA = 1.0  # BM25+で出現語に加算する下限値
+    SIMPLE_INDEX_TOKEN_CACHE_MAX_MB = 256  # チャンク本文 → トークンIDキャッシュの上限（超えたら作り直す）
+    QUERY_CACHE_MAX_ENTRIES = 1024  # 検索結果キャッシュの件数上限（0で無効）
+    QUERY_CACHE_TTL_SECONDS = 600  # 検索結果キャッシュの有効期限（秒）
+    ANSWER_CACHE_MAX_ENTRIES = 500  # OpenAI回答キャッシュの件数上限（0で無効）
+    ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.9  # 類似質問とみなす質問ベクトルのコサイン類似度
+    ASYNC_RETRIEVAL_WORKERS = 4  # 非同期エンジンで検索を実行するスレッド数
+    ASYNC_MAX_CONCURRENCY = 16  # 非同期エンジンで同時に回答する質問数の上限
+    ASYNC_REQUEST_TIMEOUT = 60  # 非同期エンジンのOpenAI呼び出しのタイムアウト（秒）
     
     # 埋め込みモデル設定（OpenAI Embeddings使用）
     EMBEDDING_MODEL = "text-embedding-3-small"
@@ -67,6 +89,14 @@ class Config:
     LLM_MODEL = "gpt-3.5-turbo"
     LLM_TEMPERATURE = 0.7
     MAX_TOKENS = 2000
+    OPENAI_MAX_CONNECTIONS = 20  # 共通HTTPクライアントの同時接続数
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS = 10  # keep-aliveで保持する接続数
+    OPENAI_REQUEST_TIMEOUT = 60  # 1リクエストのタイムアウト（秒）
+    OPENAI_MAX_RETRIES = 3  # 429/5xx・接続エラーの再試行回数
+    OPENAI_BACKOFF_BASE = 0.5  # 再試行の待ち時間の初期値（秒、試行ごとに倍）
+    OPENAI_BACKOFF_MAX = 8.0  # 再試行の待ち時間の上限（秒）
+    OPENAI_CIRCUIT_FAILURE_THRESHOLD = 5  # 連続失敗がこれに達したらAPI呼び出しを止める
+    OPENAI_CIRCUIT_RESET_SECONDS = 30  # 止めてから再び試すまでの秒数
     
     # ドキュメント設定
     DOCUMENT_PATH = "../data/documents"
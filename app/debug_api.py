@@ -74,7 +74,7 @@ def debug_openai_api():
             from config import Config
             
             vector_db = SimpleVectorDatabase()
-            doc_count = len(vector_db.documents)
+            doc_count = vector_db.count_documents()
             
             st.write(f"**ドキュメント数**: {doc_count}")
             st.write(f"**ベクターDB パス**: {Config.get_vector_db_path()}")
@@ -103,7 +103,7 @@ def debug_openai_api():
                     success = bootstrap.bootstrap_documents()
                     st.write(f"初期化結果: {success}")
                     if success:
-                        new_count = len(vector_db.documents) 
+                        new_count = vector_db.count_documents() 
                         st.success(f"✅ {new_count}個の文書を追加しました！")
                     else:
                         st.error("❌ 初期化に失敗しました")
@@ -4,6 +4,7 @@ STマイクロマイコン RAGシステム メインアプリケーション
 import streamlit as st
 import os
 import sys
+import time
 import logging
 from typing import Dict, List, Optional
 
@@ -15,11 +16,9 @@ sys.path.insert(0, parent_dir)
 
 # プロジェクトのモジュールをインポート
 from config import Config
-from models.simple_rag_engine import SimpleRAGEngine
-from models.simple_vector_db import SimpleVectorDatabase
 from services.document_processor import DocumentProcessor
-from services.microcontroller_selector import MicrocontrollerSelector
-from services.code_generator import CodeGenerator
+from services.ingestion_manifest import sync_files
+from services.shared_resources import get_app_resources
 from services.auth import AuthService
 from ui.components import *
 
@@ -60,27 +59,28 @@ class STMicroRAGApp:
             st.session_state.messages = []
     
     def initialize_components(self):
-        """システムコンポーネントの初期化"""
+        """システムコンポーネントの初期化（インデックス・エンジンは全セッションで共有）"""
         try:
-            # コンポーネントの初期化
-            self.microcontroller_selector = MicrocontrollerSelector()
-            self.code_generator = CodeGenerator()
+            start = time.perf_counter()
+            self.resources = get_app_resources()
+            
+            # 別プロセスでインデックスが更新されていれば読み直す
+            self.resources.reload_if_index_changed()
+            
+            # この再実行の間は同じエンジン・インデックスを使う（読み直しで差し替わっても影響しない）
+            self.rag_engine = self.resources.rag_engine
+            self.vector_db = self.rag_engine.vector_db
+            self.microcontroller_selector = self.resources.microcontroller_selector
+            self.code_generator = self.resources.code_generator
             self.document_processor = DocumentProcessor()
             
-            # ベクトルデータベースの初期化（シンプル版）
-            if not st.session_state.vector_db_ready:
-                self.vector_db = SimpleVectorDatabase()
-                self.rag_engine = SimpleRAGEngine(self.vector_db)
-                
-                # ドキュメントブートストラップ
+            # ドキュメントブートストラップ（プロセスで1回）
+            if not self.resources.bootstrapped:
                 self.bootstrap_documents_if_needed()
-                
-                st.session_state.vector_db_ready = True
-            else:
-                self.vector_db = SimpleVectorDatabase()
-                self.rag_engine = SimpleRAGEngine(self.vector_db)
             
+            st.session_state.vector_db_ready = True
             st.session_state.initialized = True
+            st.session_state.last_init_ms = (time.perf_counter() - start) * 1000
             
         except Exception as e:
             logger.error(f"Component initialization failed: {e}")
@@ -91,16 +91,21 @@ class STMicroRAGApp:
         """必要に応じて基本文書をブートストラップ"""
         try:
             from bootstrap_docs import OnlineDocumentBootstrap
-            bootstrap = OnlineDocumentBootstrap(self.vector_db)
-            
-            if bootstrap.is_bootstrap_needed():
-                with st.spinner("📚 基本文書を初期化しています..."):
-                    success = bootstrap.bootstrap_documents()
-                    if success:
-                        logger.info("Documents bootstrapped successfully")
-                        st.success("基本文書の初期化が完了しました！")
-                    else:
-                        logger.warning("Bootstrap partially failed")
+            with self.resources.ingestion() as vector_db:
+                # 他のセッションが先に実行した場合は何もしない
+                if self.resources.bootstrapped:
+                    return
+                bootstrap = OnlineDocumentBootstrap(vector_db)
+                
+                if bootstrap.is_bootstrap_needed():
+                    with st.spinner("📚 基本文書を初期化しています..."):
+                        success = bootstrap.bootstrap_documents()
+                        if success:
+                            logger.info("Documents bootstrapped successfully")
+                            st.success("基本文書の初期化が完了しました！")
+                        else:
+                            logger.warning("Bootstrap partially failed")
+                self.resources.bootstrapped = True
                         
         except Exception as e:
             logger.error(f"Bootstrap failed: {e}")
@@ -151,21 +156,18 @@ class STMicroRAGApp:
                         document_files.append(os.path.join(an_folder, file))
             
             if document_files:
-                # ドキュメントを処理
-                documents = self.document_processor.create_documents(
-                    document_files, 
-                    "NUCLEO-F767ZI"
-                )
+                # 変更のないファイルは飛ばし、ページ単位でストリーミング処理しながら
+                # 共有のベクトルデータベースに追加（他セッションの取り込みと直列化）
+                with self.resources.ingestion() as vector_db:
+                    summary = sync_files(vector_db, document_files, "NUCLEO-F767ZI",
+                                         processor=self.document_processor)
                 
-                if documents:
-                    # ベクトルデータベースに追加
-                    success = self.vector_db.add_documents(documents, "NUCLEO-F767ZI")
-                    
-                    if success:
-                        st.success(f"✅ {len(documents)}個のドキュメントチャンクを処理しました")
-                        logger.info(f"Processed {len(document_files)} files into {len(documents)} chunks")
-                    else:
-                        st.warning("ドキュメントの登録に一部失敗しました")
+                if summary["chunks"]:
+                    st.success(f"✅ {summary['chunks']}個のドキュメントチャンクを処理しました"
+                               f"（変更のない{summary['unchanged']}ファイルはスキップ）")
+                    logger.info(f"Processed {len(document_files)} files into {summary['chunks']} chunks")
+                elif summary["unchanged"]:
+                    st.info("ドキュメントに変更はありません")
                 else:
                     st.warning("ドキュメントからテキストを抽出できませんでした")
             else:
@@ -183,8 +185,8 @@ class STMicroRAGApp:
         selected_mc = render_sidebar_microcontroller_selector(available_mcs, current_mc)
         
         if selected_mc != current_mc:
+            # 選択はセッションごとに保持する（共有のMicrocontrollerSelectorは書き換えない）
             st.session_state.current_microcontroller = selected_mc
-            self.microcontroller_selector.set_current_microcontroller(selected_mc)
             st.rerun()
         
         return selected_mc
@@ -199,8 +201,16 @@ class STMicroRAGApp:
         
         # システム状態表示
         status = self.rag_engine.get_system_status()
+        status["last_rerun_ms"] = st.session_state.get("last_rerun_ms")
+        status["last_init_ms"] = st.session_state.get("last_init_ms")
         render_system_status(status)
         
+        # 別プロセスで取り込んだ後などに、共有インデックスを明示的に読み直す
+        if st.sidebar.button("🔄 インデックスを再読み込み"):
+            with st.spinner("インデックスを読み込んでいます..."):
+                self.resources.reload()
+            st.rerun()
+        
         # 開発Tipsの表示
         tips = self.microcontroller_selector.get_development_tips(selected_mc)
         render_tips_panel(tips)
@@ -238,36 +248,37 @@ class STMicroRAGApp:
             with st.chat_message("user"):
                 st.markdown(user_input)
             
-            # RAGエンジンで回答生成
+            # RAGエンジンで回答生成（参考資料・信頼度を先に受け取り、回答は生成された順に表示）
             with st.chat_message("assistant"):
-                with st.spinner("回答を生成しています..."):
-                    try:
-                        answer_result = self.rag_engine.answer_question(
-                            user_input, 
-                            microcontroller
-                        )
-                        
-                        # 回答を表示
-                        answer = answer_result.get("answer", "申し訳ございません。回答を生成できませんでした。")
-                        st.markdown(answer)
-                        
-                        # パフォーマンス指標を表示
-                        render_performance_metrics(answer_result)
-                        
-                        # 参考資料を表示
-                        sources = answer_result.get("sources", [])
-                        if sources:
-                            with st.expander(f"📚 参考資料 ({len(sources)}件)"):
-                                for i, source in enumerate(sources, 1):
-                                    st.write(f"**{i}.** {source.get('filename', '不明')} ({source.get('category', '一般')})")
-                        
-                        # アシスタントメッセージを追加
-                        st.session_state.messages.append({"role": "assistant", "content": answer})
-                        
-                    except Exception as e:
-                        error_msg = f"回答生成中にエラーが発生しました: {e}"
-                        st.error(error_msg)
-                        st.session_state.messages.append({"role": "assistant", "content": error_msg})
+                try:
+                    answer_events = self.rag_engine.answer_question_stream(
+                        user_input, 
+                        microcontroller
+                    )
+                    with st.spinner("関連資料を検索しています..."):
+                        answer_metadata = next(answer_events)
+                    
+                    # 参考資料を表示
+                    sources = answer_metadata.get("sources", [])
+                    if sources:
+                        with st.expander(f"📚 参考資料 ({len(sources)}件)"):
+                            for i, source in enumerate(sources, 1):
+                                st.write(f"**{i}.** {source.get('filename', '不明')} ({source.get('category', '一般')})")
+                    
+                    # 回答を表示
+                    answer = st.write_stream(event["text"] for event in answer_events)
+                    answer = answer or "申し訳ございません。回答を生成できませんでした。"
+                    
+                    # パフォーマンス指標を表示
+                    render_performance_metrics(answer_metadata)
+                    
+                    # アシスタントメッセージを追加
+                    st.session_state.messages.append({"role": "assistant", "content": answer})
+                    
+                except Exception as e:
+                    error_msg = f"回答生成中にエラーが発生しました: {e}"
+                    st.error(error_msg)
+                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
     
     def render_code_generation_tab(self, microcontroller: str):
         """コード生成タブのレンダリング"""
@@ -369,13 +380,18 @@ class STMicroRAGApp:
             st.info("ページを再読み込みしてみてください")
 
 def main():
-    """メイン関数"""
+    """メイン関数（再実行ごとの所要時間を記録）"""
+    start = time.perf_counter()
     try:
         app = STMicroRAGApp()
         app.run()
     except Exception as e:
         st.error(f"アプリケーションの起動に失敗しました: {e}")
         st.info("システム管理者に連絡してください")
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        st.session_state.last_rerun_ms = elapsed_ms
+        logger.info(f"Rerun finished in {elapsed_ms:.1f} ms")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,212 @@
+"""
+LLM回答のキャッシュ（ローカルディスクに保存）
+1段目は正規化した質問・マイコン・検索されたチャンクの完全一致、
+2段目は同じマイコン・同じチャンクで質問のTF-IDFベクトルのコサイン類似度が閾値以上のものを使う
+
+保存は1エントリ1行のJSON Linesの追記で、登録のたびにファイル全体を書き直さない。
+同じキー・破棄済みのエントリの行は読み込み時に後の行で上書き・破棄し、
+行数が件数上限のLOG_COMPACTION_RATIO倍を超えたら現在のエントリだけで書き直す
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from langchain.schema import Document
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 質問末尾の句読点（「？」の有無だけが違う質問を同じものとして扱う）
+TRAILING_PUNCTUATION = "?？!！.。、 "
+# 追記ログの行数が件数上限の何倍を超えたら書き直すか
+LOG_COMPACTION_RATIO = 2
+
+def normalize_question(question: str) -> str:
+    """質問の正規化（全角半角・大文字小文字・空白の違いと末尾の句読点を無視）"""
+    question = unicodedata.normalize("NFKC", question).lower()
+    return " ".join(question.split()).rstrip(TRAILING_PUNCTUATION)
+
+def context_key(relevant_docs: List[Tuple[Document, float]]) -> str:
+    """検索されたチャンクの識別子（chunk_idと本文のハッシュ、順序は無視）"""
+    chunk_keys = sorted(
+        doc.metadata.get("chunk_id", "") + ":" + hashlib.blake2b(doc.page_content.encode("utf-8"), digest_size=8).hexdigest()
+        for doc, _ in relevant_docs
+    )
+    return hashlib.blake2b("\n".join(chunk_keys).encode("utf-8"), digest_size=16).hexdigest()
+
+def cosine_similarity(vector1: Dict[str, float], vector2: Dict[str, float]) -> float:
+    """L2正規化済みの疎ベクトル同士のコサイン類似度"""
+    if len(vector1) > len(vector2):
+        vector1, vector2 = vector2, vector1
+    return sum(weight * vector2.get(token, 0.0) for token, weight in vector1.items())
+
+class AnswerCache:
+    """件数上限付きのLRU回答キャッシュ（JSON Linesの追記ログに保存）"""
+    
+    def __init__(self, cache_file: str, max_entries: int, similarity_threshold: float,
+                 vectorize: Callable[[str], Dict[str, float]]):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.vectorize = vectorize  # 質問 → L2正規化済みのTF-IDFベクトル（トークン → 重み）
+        self._entries = OrderedDict()  # 完全一致キー → エントリ（古く使われた順）
+        self._by_context = {}  # (マイコン, チャンク識別子) → 完全一致キーの集合
+        self._lock = threading.Lock()  # メモリ上のエントリの参照・更新で保持
+        self._file_lock = threading.Lock()  # ファイルへの追記・書き直しで保持
+        self._log_lines = 0  # 追記ログの行数
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._load()
+    
+    @staticmethod
+    def _exact_key(question: str, microcontroller: str, context: str) -> str:
+        """1段目（完全一致）のキー"""
+        key = "\0".join([normalize_question(question), microcontroller, context])
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+    
+    def _add_entry(self, key: str, entry: Dict):
+        """エントリを登録（上限を超えたら最も古く使われたものを破棄）"""
+        if key in self._entries:
+            self._remove_entry(key)
+        self._entries[key] = entry
+        self._by_context.setdefault((entry["microcontroller"], entry["context"]), set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove_entry(next(iter(self._entries)))
+    
+    def _remove_entry(self, key: str):
+        """エントリを削除"""
+        entry = self._entries.pop(key)
+        bucket = self._by_context[(entry["microcontroller"], entry["context"])]
+        bucket.discard(key)
+        if not bucket:
+            del self._by_context[(entry["microcontroller"], entry["context"])]
+    
+    def get(self, question: str, microcontroller: str, relevant_docs: List[Tuple[Document, float]]) -> Optional[str]:
+        """キャッシュ済みの回答（完全一致 → 類似質問の順に探す、なければNone）"""
+        context = context_key(relevant_docs)
+        key = self._exact_key(question, microcontroller, context)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return self._entries[key]["answer"]
+            candidates = list(self._by_context.get((microcontroller, context), ()))
+        
+        # 2段目：同じチャンクから回答した質問のうち最も似ているもの
+        if candidates:
+            vector = self.vectorize(question)
+            with self._lock:
+                scored = [(cosine_similarity(vector, self._entries[candidate]["vector"]), candidate)
+                          for candidate in candidates if candidate in self._entries]
+                if scored:
+                    similarity, best = max(scored)
+                    if similarity >= self.similarity_threshold:
+                        self._entries.move_to_end(best)
+                        self.similar_hits += 1
+                        logger.info(f"Answer cache hit for similar question (similarity {similarity:.2f})")
+                        return self._entries[best]["answer"]
+        
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def put(self, question: str, microcontroller: str, relevant_docs: List[Tuple[Document, float]], answer: str):
+        """回答を登録してファイルに追記（_lockを保持するのはメモリ上の登録の間だけ）"""
+        if self.max_entries <= 0:
+            return
+        context = context_key(relevant_docs)
+        entry = {
+            "question": question,
+            "microcontroller": microcontroller,
+            "context": context,
+            "vector": self.vectorize(question),
+            "answer": answer
+        }
+        with self._lock:
+            self._add_entry(self._exact_key(question, microcontroller, context), entry)
+        self._append(entry)
+    
+    def _append(self, entry: Dict):
+        """エントリを1行追記（行数が上限を超える場合は代わりに現在のエントリで書き直す）"""
+        with self._file_lock:
+            try:
+                if self._log_lines >= LOG_COMPACTION_RATIO * self.max_entries:
+                    self._rewrite()
+                    return
+                os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+                with open(self.cache_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                self._log_lines += 1
+            
+            except Exception as e:
+                logger.warning(f"Failed to save answer cache: {e}")
+    
+    def _rewrite(self):
+        """現在のエントリを古く使われた順に一時ファイル経由で書き直す（_file_lockを保持して呼ぶ）"""
+        with self._lock:
+            entries = list(self._entries.values())
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        with open(self.cache_file + ".tmp", "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+        os.replace(self.cache_file + ".tmp", self.cache_file)
+        self._log_lines = len(entries)
+    
+    def _load(self):
+        """追記ログを先頭から読み込み（読めなければ空のキャッシュで始める）
+        
+        書きかけの行は無視する。書きかけの行や旧形式（全エントリのJSON配列1つ）を読んだ場合は、
+        続く追記が壊れないよう現在のエントリで書き直す
+        """
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            needs_rewrite = False
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    self._log_lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        needs_rewrite = True
+                        continue
+                    if not line.endswith("\n") or isinstance(record, list):
+                        needs_rewrite = True
+                    for entry in record if isinstance(record, list) else [record]:
+                        self._add_entry(self._exact_key(entry["question"], entry["microcontroller"], entry["context"]),
+                                        entry)
+            if needs_rewrite:
+                self._rewrite()
+            logger.info(f"Loaded {len(self._entries)} cached answers")
+        
+        except Exception as e:
+            logger.warning(f"Failed to load answer cache: {e}")
+            self._entries = OrderedDict()
+            self._by_context = {}
+            self._log_lines = 0
+    
+    def clear(self):
+        """全エントリを破棄"""
+        with self._file_lock:
+            with self._lock:
+                self._entries = OrderedDict()
+                self._by_context = {}
+            try:
+                self._rewrite()
+            except Exception as e:
+                logger.warning(f"Failed to save answer cache: {e}")
+    
+    def stats(self) -> Dict[str, int]:
+        """完全一致・類似質問のヒット数、ミス数、登録数"""
+        with self._lock:
+            return {
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "entries": len(self._entries)
+            }
@@ -0,0 +1,213 @@
+"""
+asyncio版のシンプルRAGエンジン
+検索はスレッドプールで、回答生成は非同期OpenAIクライアントで待つため、
+1つのイベントループで複数の質問に同時に回答できる（遅いOpenAI呼び出しがワーカースレッドを塞がない）
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from langchain.schema import Document
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from models.simple_vector_db import SimpleVectorDatabase
+from models.simple_rag_engine import SimpleRAGEngine, NO_DOCUMENTS_ANSWER, INTERRUPTED_ANSWER_NOTE
+
+try:
+    from openai import AsyncOpenAI
+    ASYNC_OPENAI_AVAILABLE = True
+except ImportError:
+    ASYNC_OPENAI_AVAILABLE = False
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class AsyncSimpleRAGEngine(SimpleRAGEngine):
+    """asyncio版のシンプルなRAGエンジン
+    
+    answer_question はコルーチン、answer_question_stream は非同期ジェネレータになる。
+    timeoutを超えたOpenAI呼び出しはテンプレート回答に切り替え、
+    タスクのキャンセルは検索・API呼び出しの待ちをそのまま中断する
+    """
+    
+    def __init__(self, vector_db: SimpleVectorDatabase = None, use_openai: bool = True,
+                 async_openai_client=None, max_workers: int = None):
+        super().__init__(vector_db, use_openai=use_openai and async_openai_client is None)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or Config.ASYNC_RETRIEVAL_WORKERS,
+                                           thread_name_prefix="rag-retrieval")
+        
+        # 非同期OpenAIクライアントの初期化（指定されたクライアントを優先）
+        self.async_openai_client = async_openai_client
+        if self.async_openai_client is None and self.use_openai and ASYNC_OPENAI_AVAILABLE:
+            try:
+                self.async_openai_client = AsyncOpenAI(api_key=Config.get_openai_api_key())
+                logger.info("Async OpenAI client initialized successfully")
+            except Exception as e:
+                logger.error(f"Failed to initialize async OpenAI client: {e}")
+        self.use_openai = self.async_openai_client is not None
+    
+    async def _run_in_executor(self, function, *args):
+        """同期処理をスレッドプールで実行して待つ"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(function, *args))
+    
+    async def answer_question(self,
+                              question: str,
+                              microcontroller: str = "NUCLEO-F767ZI",
+                              num_docs: int = 5,
+                              timeout: float = None) -> Dict:
+        """質問に対してRAGベースで回答を生成（非同期版）"""
+        try:
+            # 1. 関連ドキュメントを検索（スレッドプールで実行）
+            relevant_docs = await self._run_in_executor(self._retrieve_documents, question, microcontroller, num_docs)
+            
+            if not relevant_docs:
+                return {
+                    "answer": NO_DOCUMENTS_ANSWER,
+                    "sources": [],
+                    "confidence": 0.0,
+                    "microcontroller": microcontroller
+                }
+            
+            # 2. 回答生成
+            answer = await self._agenerate_answer(question, relevant_docs, microcontroller, timeout)
+            
+            return {
+                "answer": answer,
+                "sources": self._extract_sources(relevant_docs),
+                "confidence": self._calculate_confidence(relevant_docs),
+                "microcontroller": microcontroller,
+                "num_sources": len(relevant_docs)
+            }
+        
+        except Exception as e:
+            logger.error(f"Failed to answer question: {e}")
+            return {
+                "answer": f"エラーが発生しました: {str(e)}",
+                "sources": [],
+                "confidence": 0.0,
+                "microcontroller": microcontroller
+            }
+    
+    async def answer_questions(self,
+                               questions: List[str],
+                               microcontroller: str = "NUCLEO-F767ZI",
+                               num_docs: int = 5,
+                               timeout: float = None,
+                               max_concurrency: int = None) -> List[Dict]:
+        """複数の質問に同時に回答（同時実行数はmax_concurrencyまで、結果は質問の順）"""
+        semaphore = asyncio.Semaphore(max_concurrency or Config.ASYNC_MAX_CONCURRENCY)
+        
+        async def answer(question: str) -> Dict:
+            async with semaphore:
+                return await self.answer_question(question, microcontroller, num_docs, timeout)
+        
+        return await asyncio.gather(*(answer(question) for question in questions))
+    
+    async def answer_question_stream(self,
+                                     question: str,
+                                     microcontroller: str = "NUCLEO-F767ZI",
+                                     num_docs: int = 5,
+                                     timeout: float = None) -> AsyncIterator[Dict]:
+        """質問に対する回答をストリーミングで生成（非同期版、イベントの形式は同期版と同じ）"""
+        relevant_docs = await self._run_in_executor(self._retrieve_documents, question, microcontroller, num_docs)
+        yield {
+            "type": "metadata",
+            "sources": self._extract_sources(relevant_docs),
+            "confidence": self._calculate_confidence(relevant_docs),
+            "microcontroller": microcontroller,
+            "num_sources": len(relevant_docs)
+        }
+        
+        if not relevant_docs:
+            yield {"type": "token", "text": NO_DOCUMENTS_ANSWER}
+            return
+        async for text in self._astream_answer(question, relevant_docs, microcontroller, timeout):
+            yield {"type": "token", "text": text}
+    
+    async def _agenerate_answer(self, question: str, relevant_docs: List[Tuple[Document, float]],
+                                microcontroller: str, timeout: Optional[float]) -> str:
+        """回答生成（非同期版、タイムアウト・失敗時はテンプレート回答）"""
+        source_str = self._source_string(relevant_docs)
+        
+        if self.use_openai and self.async_openai_client:
+            cached_answer = await self._run_in_executor(self.answer_cache.get, question, microcontroller, relevant_docs)
+            if cached_answer is not None:
+                return cached_answer
+            try:
+                answer = await asyncio.wait_for(
+                    self._agenerate_openai_answer(question, relevant_docs, microcontroller, source_str),
+                    timeout or Config.ASYNC_REQUEST_TIMEOUT
+                )
+                await self._run_in_executor(self.answer_cache.put, question, microcontroller, relevant_docs, answer)
+                return answer
+            except asyncio.TimeoutError:
+                logger.warning(f"OpenAI API call timed out after {timeout or Config.ASYNC_REQUEST_TIMEOUT} seconds")
+                logger.info("Falling back to template-based response")
+            except Exception as e:
+                logger.error(f"OpenAI API call failed: {e}")
+                logger.info("Falling back to template-based response")
+        
+        return self._generate_template_answer(question, relevant_docs, microcontroller, source_str)
+    
+    async def _agenerate_openai_answer(self, question: str, relevant_docs: List[Tuple[Document, float]],
+                                       microcontroller: str, source_str: str) -> str:
+        """非同期OpenAIクライアントを使用した回答生成"""
+        response = await self.async_openai_client.chat.completions.create(
+            model=Config.LLM_MODEL,
+            messages=self._build_openai_messages(question, relevant_docs, microcontroller, source_str),
+            temperature=Config.LLM_TEMPERATURE,
+            max_tokens=Config.MAX_TOKENS
+        )
+        logger.info("Generated answer using async OpenAI API")
+        return response.choices[0].message.content
+    
+    async def _astream_answer(self, question: str, relevant_docs: List[Tuple[Document, float]],
+                              microcontroller: str, timeout: Optional[float]) -> AsyncIterator[str]:
+        """回答の断片を生成された順に返す（timeoutは最初の応答までの待ち時間に適用）"""
+        source_str = self._source_string(relevant_docs)
+        
+        if self.use_openai and self.async_openai_client:
+            cached_answer = await self._run_in_executor(self.answer_cache.get, question, microcontroller, relevant_docs)
+            if cached_answer is not None:
+                yield cached_answer
+                return
+            
+            parts = []
+            try:
+                stream = await asyncio.wait_for(
+                    self.async_openai_client.chat.completions.create(
+                        model=Config.LLM_MODEL,
+                        messages=self._build_openai_messages(question, relevant_docs, microcontroller, source_str),
+                        temperature=Config.LLM_TEMPERATURE,
+                        max_tokens=Config.MAX_TOKENS,
+                        stream=True
+                    ),
+                    timeout or Config.ASYNC_REQUEST_TIMEOUT
+                )
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+                await self._run_in_executor(self.answer_cache.put, question, microcontroller, relevant_docs, "".join(parts))
+                return
+            except Exception as e:
+                logger.error(f"OpenAI API call failed: {e}")
+                # 表示済みの断片は取り消せないため、途中で失敗した場合は中断を知らせる
+                if parts:
+                    yield INTERRUPTED_ANSWER_NOTE
+                    return
+                logger.info("Falling back to template-based response")
+        
+        yield self._generate_template_answer(question, relevant_docs, microcontroller, source_str)
+    
+    async def aclose(self):
+        """非同期クライアントとスレッドプールを閉じる"""
+        if self.async_openai_client is not None and hasattr(self.async_openai_client, "close"):
+            await self.async_openai_client.close()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,149 @@
+"""
+プロンプト用コンテキストのパッキング
+チャンクを固定の文字数で切る代わりに、トークン数を数えて予算内に収まるよう
+スコア/トークン数の高い順にチャンクを選ぶ。同じ文書の隣接チャンクが重なる部分
+（テキスト分割のオーバーラップ）は一度だけ含める
+"""
+import hashlib
+import logging
+import re
+from typing import List, Optional, Tuple
+
+from langchain.schema import Document
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# これより短い一致はオーバーラップとみなさない
+MIN_OVERLAP_CHARS = 20
+# トークン数キャッシュの上限（超えたら作り直す）
+MAX_CACHED_COUNTS = 1 << 16
+# 予算に収まらない1件目のチャンクを切り詰めるときの区切り（文末・改行）
+SENTENCE_END_PATTERN = re.compile(r"[。．.!?！？\n]")
+
+def estimate_tokens(text: str) -> int:
+    """tiktokenがない場合のトークン数の見積もり（ASCIIは4文字で1トークン、それ以外は1文字1トークン）"""
+    ascii_chars = sum(1 for char in text if char.isascii())
+    return (ascii_chars + 3) // 4 + len(text) - ascii_chars
+
+def overlap_length(head: str, tail: str, max_overlap: int) -> int:
+    """headの末尾とtailの先頭が一致する最長の文字数（MIN_OVERLAP_CHARS未満なら0）"""
+    if min(len(head), len(tail)) < MIN_OVERLAP_CHARS:
+        return 0
+    probe = tail[:MIN_OVERLAP_CHARS]
+    start = head.find(probe, max(0, len(head) - max_overlap))
+    while start != -1:
+        if tail.startswith(head[start:]):
+            return len(head) - start
+        start = head.find(probe, start + 1)
+    return 0
+
+class ContextPacker:
+    """トークン予算内でチャンクを選ぶコンテキストパッカー
+    
+    チャンクごとのトークン数はchunk_id（なければ内容のハッシュ）をキーにキャッシュする
+    """
+    
+    def __init__(self, model: str = None, max_overlap: int = None):
+        self.max_overlap = max_overlap or Config.CHUNK_OVERLAP
+        self._token_counts = {}  # (チャンクのキー, 開始, 終了) → トークン数
+        self._encoding = None
+        if TIKTOKEN_AVAILABLE:
+            try:
+                self._encoding = tiktoken.encoding_for_model(model or Config.LLM_MODEL)
+            except Exception as e:
+                logger.warning(f"tiktoken encoding unavailable, estimating token counts: {e}")
+    
+    def count_tokens(self, text: str) -> int:
+        """テキストのトークン数"""
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return estimate_tokens(text)
+    
+    def _chunk_key(self, doc: Document) -> str:
+        """トークン数キャッシュのキー"""
+        chunk_id = doc.metadata.get("chunk_id")
+        if chunk_id is not None:
+            return str(chunk_id)
+        return hashlib.blake2b(doc.page_content.encode("utf-8"), digest_size=16).hexdigest()
+    
+    def _cached_count(self, doc: Document, start: int, end: int) -> int:
+        """チャンクの一部（start〜end文字目）のトークン数（キャッシュ付き）"""
+        key = (self._chunk_key(doc), start, end)
+        count = self._token_counts.get(key)
+        if count is None:
+            if len(self._token_counts) >= MAX_CACHED_COUNTS:
+                self._token_counts = {}
+            count = self._token_counts[key] = self.count_tokens(doc.page_content[start:end])
+        return count
+    
+    def _trim_overlaps(self, doc: Document, selected: List[Tuple[Document, int, int]]) -> Optional[Tuple[int, int]]:
+        """選択済みの同じ文書のチャンクと重なる先頭・末尾を除いた範囲（すべて重なるならNone）"""
+        content = doc.page_content
+        start, end = 0, len(content)
+        source = doc.metadata.get("filename", doc.metadata.get("source"))
+        for other, other_start, other_end in selected:
+            if other.metadata.get("filename", other.metadata.get("source")) != source:
+                continue
+            other_content = other.page_content[other_start:other_end]
+            if content[start:end] in other_content:
+                return None
+            start += overlap_length(other_content, content[start:end], self.max_overlap)
+            end -= overlap_length(content[start:end], other_content, self.max_overlap)
+        return (start, end) if content[start:end].strip() else None
+    
+    def _truncate_to_budget(self, text: str, token_budget: int) -> str:
+        """予算に収まるよう文の区切りで切り詰める（区切りがなければ文字単位）"""
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(text[:middle]) <= token_budget:
+                low = middle
+            else:
+                high = middle - 1
+        boundaries = [match.end() for match in SENTENCE_END_PATTERN.finditer(text, 0, low)]
+        return text[:boundaries[-1] if boundaries else low]
+    
+    def pack(self, relevant_docs: List[Tuple[Document, float]], token_budget: int,
+             overhead_tokens: int = 0) -> List[Tuple[Document, str]]:
+        """予算内に収まる（ドキュメント, 含める本文）のリスト（元の順位順）
+        
+        relevant_docsのスコアは距離（1 - 類似度）。overhead_tokensは1件ごとの見出しなどのトークン数
+        """
+        candidates = []
+        for rank, (doc, score) in enumerate(relevant_docs):
+            tokens = self._cached_count(doc, 0, len(doc.page_content)) + overhead_tokens
+            candidates.append((max(1.0 - score, 1e-6) / max(tokens, 1), rank, doc))
+        candidates.sort(key=lambda candidate: (-candidate[0], candidate[1]))
+        
+        selected = []  # （ドキュメント, 開始, 終了, 順位）
+        remaining = token_budget
+        for _, rank, doc in candidates:
+            trimmed = self._trim_overlaps(doc, [(other, start, end) for other, start, end, _ in selected])
+            if trimmed is None:
+                continue
+            tokens = self._cached_count(doc, *trimmed) + overhead_tokens
+            if tokens <= remaining:
+                selected.append((doc, trimmed[0], trimmed[1], rank))
+                remaining -= tokens
+        
+        if not selected and relevant_docs:
+            # 1件も収まらない場合は最上位のチャンクを文の区切りで切り詰めて使う
+            doc = relevant_docs[0][0]
+            text = self._truncate_to_budget(doc.page_content, token_budget - overhead_tokens)
+            return [(doc, text)] if text.strip() else []
+        
+        selected.sort(key=lambda item: item[3])
+        return [(doc, doc.page_content[start:end]) for doc, start, end, _ in selected]
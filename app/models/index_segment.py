@@ -0,0 +1,315 @@
+"""
+TF-IDFインデックスのオンディスク・セグメント形式
+NumPy配列をmmapで開くため、起動時にインデックス全体を読み込む必要がない
+
+セグメントディレクトリの構成（SEGMENT_FORMAT_VERSION = 1）:
+    header.json              ドキュメント数・語彙数などの小さなヘッダ
+    postings_indptr.npy      語彙ID×ドキュメントCSR行列のindptr（int64）
+    postings_doc_ids.npy     ポスティングのドキュメントID（int32）
+    postings_tf.npy          ポスティングの生TF（float32）
+    text.bin                 チャンク本文（UTF-8を連結）
+    text_offsets.npy         本文のバイトオフセット表（int64, num_docs + 1）
+    metadata.jsonl           チャンクのメタデータ（1行1JSON）
+    metadata_offsets.npy     メタデータのバイトオフセット表（int64, num_docs + 1）
+    doc_seqs.npy             全シャード共通の追加順序番号（int64、同点時の並び順に使用）
+    doc_lengths.npy          ドキュメントのトークン数（int32、BM25の文書長正規化に使用）
+    filter_<field>.npy       フィルター用メタデータの値コード（int32, 値なしは-1）
+                             コード → 値の対応はheader.jsonのfilter_valuesに保存
+"""
+import os
+import json
+import mmap
+import shutil
+import logging
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+from langchain.schema import Document
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SEGMENT_FORMAT_VERSION = 1
+HEADER_FILE = "header.json"
+# 検索時のフィルターに使うメタデータ項目（取り込み時に値コード列を書き出す）
+FILTER_FIELDS = ("microcontroller", "category", "file_type", "source")
+
+class IndexSegment:
+    """読み取り専用のインデックスセグメント"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        
+        with open(os.path.join(path, HEADER_FILE), "r", encoding="utf-8") as f:
+            self.header = json.load(f)
+        
+        format_version = self.header.get("format_version")
+        if format_version != SEGMENT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported segment format version: {format_version}")
+        
+        self.num_docs = self.header["num_docs"]
+        self.vocab_size = self.header["vocab_size"]
+        
+        # mmapは開くだけで読み込まない（コンパクションでディレクトリが削除されても参照を保てる）
+        self._tf_matrix = sparse.csr_matrix(
+            (self._load_array("postings_tf.npy"),
+             self._load_array("postings_doc_ids.npy"),
+             self._load_array("postings_indptr.npy")),
+            shape=(self.vocab_size, self.num_docs),
+            copy=False
+        )
+        self._text_offsets = self._load_array("text_offsets.npy")
+        self._metadata_offsets = self._load_array("metadata_offsets.npy")
+        self._text = self._open_blob("text.bin")
+        self._metadata = self._open_blob("metadata.jsonl")
+        self._filter_codes = {}  # フィールド → 値コード列（初回フィルター時に読み込み）
+        if os.path.exists(os.path.join(path, "doc_seqs.npy")):
+            self.doc_seqs = self._load_array("doc_seqs.npy")
+        else:
+            self.doc_seqs = np.arange(self.num_docs, dtype=np.int64)
+        # 文書長のない古いセグメントはNone（シャード側で本文から求める）
+        if os.path.exists(os.path.join(path, "doc_lengths.npy")):
+            self.doc_lengths = self._load_array("doc_lengths.npy")
+        else:
+            self.doc_lengths = None
+    
+    def __len__(self) -> int:
+        return self.num_docs
+    
+    def _load_array(self, name: str) -> np.ndarray:
+        """NumPy配列をmmapで開く"""
+        return np.load(os.path.join(self.path, name), mmap_mode="r")
+    
+    def _open_blob(self, name: str):
+        """本文・メタデータファイルをmmapで開く（空ファイルはbytesで代用）"""
+        blob_path = os.path.join(self.path, name)
+        if os.path.getsize(blob_path) == 0:
+            return b""
+        with open(blob_path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    @property
+    def tf_matrix(self) -> sparse.csr_matrix:
+        """語彙ID×ドキュメントの生TF行列（mmap配列を参照し、コピーしない）"""
+        return self._tf_matrix
+    
+    def get_text(self, doc_id: int) -> str:
+        """チャンク本文を取得"""
+        start, end = self._text_offsets[doc_id], self._text_offsets[doc_id + 1]
+        return self._text[start:end].decode("utf-8")
+    
+    def get_metadata(self, doc_id: int) -> Dict:
+        """チャンクのメタデータを取得"""
+        start, end = self._metadata_offsets[doc_id], self._metadata_offsets[doc_id + 1]
+        return json.loads(self._metadata[start:end].decode("utf-8"))
+    
+    def get_document(self, doc_id: int) -> Document:
+        """Documentオブジェクトを復元"""
+        return Document(page_content=self.get_text(doc_id), metadata=self.get_metadata(doc_id))
+    
+    def _get_filter_codes(self, field: str) -> Tuple[np.ndarray, Dict[str, int]]:
+        """フィルター項目の値コード列と（値 → コード）を取得"""
+        if field not in self._filter_codes:
+            values = self.header.get("filter_values", {}).get(field)
+            if values is not None:
+                codes = self._load_array(f"filter_{field}.npy")
+            else:
+                # 値コード列がない（古い）セグメントはメタデータから一度だけ作成
+                codes, values = _encode_filter_values(self.get_metadata(doc_id).get(field) for doc_id in range(self.num_docs))
+            self._filter_codes[field] = (codes, {value: code for code, value in enumerate(values)})
+        return self._filter_codes[field]
+    
+    def filter_ids(self, field: str, value: str) -> np.ndarray:
+        """メタデータ項目が指定値に一致するセグメント内ID（昇順）"""
+        codes, value_codes = self._get_filter_codes(field)
+        code = value_codes.get(str(value))
+        if code is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(codes == code)
+    
+    def close(self):
+        """mmapを解放"""
+        for blob in (self._text, self._metadata):
+            if isinstance(blob, mmap.mmap):
+                try:
+                    blob.close()
+                except BufferError:
+                    # 参照中のビューが残っている場合はGCに任せる
+                    pass
+        self._tf_matrix = None
+        self._text = None
+        self._metadata = None
+        self._text_offsets = None
+        self._metadata_offsets = None
+        self._filter_codes = {}
+    
+    @classmethod
+    def write(cls,
+              path: str,
+              tf_matrix: sparse.csr_matrix,
+              documents: Iterable[Tuple[str, Dict]],
+              doc_seqs: np.ndarray,
+              doc_lengths: Optional[np.ndarray] = None) -> "IndexSegment":
+        """セグメントを書き出す
+        
+        一時ディレクトリに書き込んでからリネームするため、途中で失敗しても
+        不完全なセグメントが残ることはない
+        """
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        
+        tf_matrix = sparse.csr_matrix(tf_matrix, dtype=np.float32)
+        tf_matrix.sort_indices()
+        np.save(os.path.join(tmp_path, "postings_indptr.npy"), tf_matrix.indptr.astype(np.int64))
+        np.save(os.path.join(tmp_path, "postings_doc_ids.npy"), tf_matrix.indices.astype(np.int32))
+        np.save(os.path.join(tmp_path, "postings_tf.npy"), tf_matrix.data)
+        
+        text_offsets = [0]
+        metadata_offsets = [0]
+        filter_values = {field: [] for field in FILTER_FIELDS}
+        microcontroller_counts = Counter()
+        with open(os.path.join(tmp_path, "text.bin"), "wb") as text_file, \
+                open(os.path.join(tmp_path, "metadata.jsonl"), "wb") as metadata_file:
+            for text, metadata in documents:
+                encoded_text = text.encode("utf-8")
+                text_file.write(encoded_text)
+                text_offsets.append(text_offsets[-1] + len(encoded_text))
+                
+                encoded_metadata = (json.dumps(metadata, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+                metadata_file.write(encoded_metadata)
+                metadata_offsets.append(metadata_offsets[-1] + len(encoded_metadata))
+                
+                microcontroller_counts[metadata.get("microcontroller", "unknown")] += 1
+                for field in FILTER_FIELDS:
+                    filter_values[field].append(metadata.get(field))
+        
+        num_docs = len(text_offsets) - 1
+        if num_docs != tf_matrix.shape[1]:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise ValueError(f"Document count mismatch: {num_docs} != {tf_matrix.shape[1]}")
+        
+        np.save(os.path.join(tmp_path, "text_offsets.npy"), np.array(text_offsets, dtype=np.int64))
+        np.save(os.path.join(tmp_path, "metadata_offsets.npy"), np.array(metadata_offsets, dtype=np.int64))
+        np.save(os.path.join(tmp_path, "doc_seqs.npy"), np.asarray(doc_seqs, dtype=np.int64))
+        if doc_lengths is not None:
+            np.save(os.path.join(tmp_path, "doc_lengths.npy"), np.asarray(doc_lengths, dtype=np.int32))
+        for field in FILTER_FIELDS:
+            codes, filter_values[field] = _encode_filter_values(filter_values[field])
+            np.save(os.path.join(tmp_path, f"filter_{field}.npy"), codes)
+        
+        header = {
+            "format_version": SEGMENT_FORMAT_VERSION,
+            "num_docs": num_docs,
+            "vocab_size": tf_matrix.shape[0],
+            "num_postings": int(tf_matrix.nnz),
+            "microcontroller_counts": dict(microcontroller_counts),
+            "filter_values": filter_values
+        }
+        with open(os.path.join(tmp_path, HEADER_FILE), "w", encoding="utf-8") as f:
+            json.dump(header, f, ensure_ascii=False, indent=2)
+        
+        # 同名の残骸（ヘッダに載らなかった書きかけ等）があれば置き換える
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        return cls(path)
+
+def _encode_filter_values(values: Iterable) -> Tuple[np.ndarray, List[str]]:
+    """メタデータ値の列を（値コード列, 値リスト）に変換（値なしは-1）"""
+    value_codes = {}
+    codes = array("i")
+    for value in values:
+        if value is None:
+            codes.append(-1)
+            continue
+        codes.append(value_codes.setdefault(str(value), len(value_codes)))
+    return np.frombuffer(codes, dtype=np.int32).copy(), list(value_codes)
+
+class SegmentedDocumentList:
+    """複数セグメントと未保存ドキュメントを1つのリストとして扱う
+    
+    本文とメタデータは要素アクセス時にのみセグメントから読み込む
+    """
+    
+    def __init__(self, segments: List[IndexSegment] = None):
+        self.segments = list(segments or [])
+        self.pending = []  # List[Document]（まだセグメントに書き出していないもの）
+        self.segment_starts = []
+        start = 0
+        for segment in self.segments:
+            self.segment_starts.append(start)
+            start += len(segment)
+        self._segment_total = start
+    
+    def __len__(self) -> int:
+        return self._segment_total + len(self.pending)
+    
+    def __bool__(self) -> bool:
+        return len(self) > 0
+    
+    def locate(self, doc_id: int) -> Tuple[IndexSegment, int]:
+        """グローバルIDを（セグメント, セグメント内ID）に変換"""
+        segment_index = bisect_right(self.segment_starts, doc_id) - 1
+        return self.segments[segment_index], doc_id - self.segment_starts[segment_index]
+    
+    def __getitem__(self, doc_id: int) -> Document:
+        doc_id = int(doc_id)
+        if doc_id < 0:
+            doc_id += len(self)
+        if not 0 <= doc_id < len(self):
+            raise IndexError(doc_id)
+        if doc_id >= self._segment_total:
+            return self.pending[doc_id - self._segment_total]
+        segment, local_id = self.locate(doc_id)
+        return segment.get_document(local_id)
+    
+    def __iter__(self) -> Iterator[Document]:
+        for segment in self.segments:
+            for local_id in range(len(segment)):
+                yield segment.get_document(local_id)
+        yield from self.pending
+    
+    def get_metadata(self, doc_id: int) -> Dict:
+        """本文を読まずにメタデータのみ取得"""
+        doc_id = int(doc_id)
+        if doc_id >= self._segment_total:
+            return self.pending[doc_id - self._segment_total].metadata
+        segment, local_id = self.locate(doc_id)
+        return segment.get_metadata(local_id)
+    
+    def iter_text_and_metadata(self) -> Iterator[Tuple[str, Dict]]:
+        """セグメント書き出し用に（本文, メタデータ）を順に返す"""
+        for segment in self.segments:
+            for local_id in range(len(segment)):
+                yield segment.get_text(local_id), segment.get_metadata(local_id)
+        for doc in self.pending:
+            yield doc.page_content, doc.metadata
+    
+    def extend(self, documents: Iterable[Document]):
+        """未保存ドキュメントとして追加"""
+        self.pending.extend(documents)
+    
+    def filter_mask(self, field: str, value: str) -> np.ndarray:
+        """メタデータ項目が指定値に一致するドキュメントのマスク（グローバルID順）"""
+        mask = np.zeros(len(self), dtype=bool)
+        for start, segment in zip(self.segment_starts, self.segments):
+            mask[start + segment.filter_ids(field, value)] = True
+        for offset, doc in enumerate(self.pending):
+            field_value = doc.metadata.get(field)
+            if field_value is not None and str(field_value) == str(value):
+                mask[self._segment_total + offset] = True
+        return mask
+    
+    def microcontroller_counts(self) -> Counter:
+        """マイコン別のドキュメント数（セグメント分はヘッダから取得）"""
+        counts = Counter()
+        for segment in self.segments:
+            counts.update(segment.header.get("microcontroller_counts", {}))
+        for doc in self.pending:
+            counts[doc.metadata.get("microcontroller", "unknown")] += 1
+        return counts
@@ -0,0 +1,498 @@
+"""
+TF-IDFインデックスのシャード（マイコンごとのセグメント群）
+シャードは検索・追加で必要になるまでセグメントを開かないため、
+あるマイコンの検索が他のマイコンのデータやメモリを消費することはない
+順位付けはTF-IDFコサイン類似度とBM25/BM25+を同じ転置インデックス上で切り替えられる
+"""
+import os
+import shutil
+import logging
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Tuple, Iterable, Callable
+
+import numpy as np
+from scipy import sparse
+from langchain.schema import Document
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.index_segment import IndexSegment, SegmentedDocumentList
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# どのマイコンの検索にも含める共通シャード
+COMMON_SHARD = "common"
+
+@dataclass(frozen=True)
+class BM25Parameters:
+    """BM25の検索パラメータ（delta > 0でBM25+）"""
+    k1: float
+    b: float
+    delta: float
+    average_length: float  # 全シャード共通の平均文書長（トークン数）
+
+def merge_tf_blocks(tf_blocks: List[sparse.csr_matrix], vocab_size: int) -> sparse.csr_matrix:
+    """TFブロックを1つの語彙ID×ドキュメント行列に結合"""
+    blocks = []
+    for tf_block in tf_blocks:
+        tf_block = tf_block.copy()
+        tf_block.resize((vocab_size, tf_block.shape[1]))
+        blocks.append(tf_block)
+    
+    if not blocks:
+        return sparse.csr_matrix((vocab_size, 0), dtype=np.float32)
+    return sparse.hstack(blocks, format="csr", dtype=np.float32)
+
+class IndexShard:
+    """1つのマイコン（または共通）のセグメント群と検索用キャッシュ
+    
+    ドキュメントIDはシャード内の通し番号。文書頻度・IDFは全シャード共通のものを
+    use_idfで受け取り、ノルム等のキャッシュはIDFが変わった時のみ作り直す
+    """
+    
+    def __init__(self,
+                 name: str,
+                 index_directory: str,
+                 segment_names: List[str] = None,
+                 tombstones: Dict[str, Iterable[int]] = None,
+                 num_docs: int = 0,
+                 tokenize: Callable[[str], List[str]] = None):
+        self.name = name
+        self.index_directory = index_directory
+        self.segment_names = list(segment_names or [])
+        # セグメント名 → 削除済み（トゥームストーン）のセグメント内ID
+        # コンパクションで物理的に取り除かれるまで検索対象から除外する
+        self.tombstones = {segment_name: set(local_ids) for segment_name, local_ids in (tombstones or {}).items()}
+        self._num_segment_docs = num_docs  # 読み込み前のドキュメント数（インデックスヘッダの値）
+        self._tokenize = tokenize  # 文書長を保存していない古いセグメント用
+        
+        # セグメントは初回アクセス時に開く
+        self._documents = None  # SegmentedDocumentList
+        self._tf_blocks = None  # List[sparse.csr_matrix]（語彙ID×ドキュメントの生TF）
+        self._doc_seqs = None  # List[np.ndarray]（ブロックごとの追加順序番号）
+        self._doc_lengths = None  # List[Optional[np.ndarray]]（ブロックごとの文書長）
+        
+        self._idf = None
+        self._idf_version = None
+        self._invalidate_caches()
+    
+    def __len__(self) -> int:
+        if self._documents is None:
+            return self._num_segment_docs
+        return len(self._documents)
+    
+    @property
+    def is_loaded(self) -> bool:
+        return self._documents is not None
+    
+    def load(self):
+        """セグメントをmmapで開く（本文・メタデータは参照時に読み込む）"""
+        if self._documents is not None:
+            return
+        segments = [IndexSegment(os.path.join(self.index_directory, name)) for name in self.segment_names]
+        self._documents = SegmentedDocumentList(segments)
+        self._tf_blocks = [segment.tf_matrix for segment in segments]
+        self._doc_seqs = [segment.doc_seqs for segment in segments]
+        self._doc_lengths = [segment.doc_lengths for segment in segments]
+        self._invalidate_caches()
+        logger.info(f"Loaded shard {self.name}: {len(self._documents)} documents")
+    
+    @property
+    def documents(self) -> SegmentedDocumentList:
+        self.load()
+        return self._documents
+    
+    @property
+    def tf_blocks(self) -> List[sparse.csr_matrix]:
+        self.load()
+        return self._tf_blocks
+    
+    def _invalidate_caches(self):
+        """ドキュメント配置に依存するキャッシュを破棄"""
+        self._doc_norms = None
+        self._term_upper_bounds = {}  # 語彙ID → max(tf / ||d||)（枝刈り用）
+        self._live_mask = None
+        self._filter_masks = {}  # (メタデータ項目, 値) → フィルターマスク
+        self._doc_seq_array = None
+        self._doc_length_array = None
+        self._bm25_parameters = None
+        self._bm25_upper_bounds = {}  # 語彙ID → BM25の飽和TFの最大値（枝刈り用）
+    
+    def use_idf(self, idf: np.ndarray, idf_version: int):
+        """全シャード共通のIDFを設定（変化した場合のみノルム・上限を破棄）"""
+        if idf_version != self._idf_version:
+            self._idf = idf
+            self._idf_version = idf_version
+            self._doc_norms = None
+            self._term_upper_bounds = {}
+    
+    def num_deleted(self) -> int:
+        """トゥームストーン済みのドキュメント数"""
+        return sum(len(local_ids) for local_ids in self.tombstones.values())
+    
+    def num_live(self) -> int:
+        """削除されていないドキュメント数"""
+        return len(self) - self.num_deleted()
+    
+    def get_doc_seqs(self) -> np.ndarray:
+        """シャード内ドキュメントIDごとの追加順序番号"""
+        if self._doc_seq_array is None:
+            self.load()
+            self._doc_seq_array = (np.concatenate(self._doc_seqs) if self._doc_seqs
+                                   else np.zeros(0, dtype=np.int64))
+        return self._doc_seq_array
+    
+    def get_doc_lengths(self) -> np.ndarray:
+        """シャード内ドキュメントIDごとの文書長（トークン数）
+        
+        文書長を保存していない古いセグメントは本文を再トークン化して求める
+        """
+        if self._doc_length_array is None:
+            self.load()
+            for i, block_lengths in enumerate(self._doc_lengths):
+                if block_lengths is None:
+                    segment = self._documents.segments[i]
+                    self._doc_lengths[i] = np.array(
+                        [len(self._tokenize(segment.get_text(local_id))) for local_id in range(len(segment))],
+                        dtype=np.int32
+                    )
+            self._doc_length_array = (np.concatenate(self._doc_lengths).astype(np.float64) if self._doc_lengths
+                                      else np.zeros(0, dtype=np.float64))
+        return self._doc_length_array
+    
+    def get_live_mask(self) -> np.ndarray:
+        """ドキュメントごとの有効フラグ（トゥームストーン変化時のみ再作成）"""
+        if self._live_mask is None:
+            live_mask = np.ones(len(self.documents), dtype=bool)
+            for start, segment in zip(self.documents.segment_starts, self.documents.segments):
+                local_ids = self.tombstones.get(segment.name)
+                if local_ids:
+                    live_mask[start + np.fromiter(local_ids, dtype=np.int64)] = False
+            self._live_mask = live_mask
+        
+        return self._live_mask
+    
+    def get_filter_mask(self, field: str, value: str) -> np.ndarray:
+        """メタデータ項目の値ごとのドキュメントマスク（セグメントの値コード列から作成してキャッシュ）"""
+        key = (field, value)
+        if key not in self._filter_masks:
+            self._filter_masks[key] = self.documents.filter_mask(field, value)
+        return self._filter_masks[key]
+    
+    def get_allowed_mask(self, filters: Dict[str, str]) -> np.ndarray:
+        """有効かつ全フィルター条件に一致するドキュメントのマスク"""
+        allowed = self.get_live_mask()
+        for field, value in filters.items():
+            if value:
+                allowed = allowed & self.get_filter_mask(field, value)
+        return allowed
+    
+    def get_doc_norms(self) -> np.ndarray:
+        """ドキュメントのL2ノルムベクトルを取得（IDF変化時のみ再計算）
+        
+        ||d||^2 = Σ (tf × idf)^2 をブロックごとに疎行列×ベクトル積で計算する
+        """
+        if self._doc_norms is None:
+            idf_squared = self._idf ** 2
+            norms = [
+                np.sqrt(tf_block.multiply(tf_block).T @ idf_squared[:tf_block.shape[0]])
+                for tf_block in self.tf_blocks
+            ]
+            self._doc_norms = np.concatenate(norms) if norms else np.zeros(0, dtype=np.float64)
+        
+        return self._doc_norms
+    
+    def get_postings(self, token_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """トークンのポスティング（ドキュメントID昇順, 生TF）を全ブロックから取得"""
+        doc_ids = []
+        tfs = []
+        offset = 0
+        for tf_block in self.tf_blocks:
+            if token_id < tf_block.shape[0]:
+                start, end = tf_block.indptr[token_id], tf_block.indptr[token_id + 1]
+                if end > start:
+                    doc_ids.append(tf_block.indices[start:end].astype(np.int64) + offset)
+                    tfs.append(tf_block.data[start:end].astype(np.float64))
+            offset += tf_block.shape[1]
+        
+        if not doc_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        return np.concatenate(doc_ids), np.concatenate(tfs)
+    
+    def probe_postings(self, token_id: int, doc_ids: np.ndarray) -> np.ndarray:
+        """昇順のドキュメントIDについてのみTFを引く（ポスティングは二分探索で飛ばし読み）"""
+        tfs = np.zeros(len(doc_ids), dtype=np.float64)
+        offset = 0
+        for tf_block in self.tf_blocks:
+            block_size = tf_block.shape[1]
+            lo, hi = np.searchsorted(doc_ids, [offset, offset + block_size])
+            if hi > lo and token_id < tf_block.shape[0]:
+                start, end = tf_block.indptr[token_id], tf_block.indptr[token_id + 1]
+                row_ids = tf_block.indices[start:end]
+                local_ids = doc_ids[lo:hi] - offset
+                positions = np.minimum(np.searchsorted(row_ids, local_ids), max(end - start - 1, 0))
+                if end > start:
+                    hit = row_ids[positions] == local_ids
+                    tfs[lo:hi][hit] = tf_block.data[start:end][positions[hit]]
+            offset += block_size
+        
+        return tfs
+    
+    def get_term_upper_bound(self, token_id: int) -> float:
+        """トークン1つがコサイン類似度に寄与しうる上限（重み・クエリノルムを除いた max(tf / ||d||)）"""
+        upper_bound = self._term_upper_bounds.get(token_id)
+        if upper_bound is None:
+            doc_ids, tfs = self.get_postings(token_id)
+            doc_norms = self.get_doc_norms()[doc_ids]
+            ratios = tfs[doc_norms > 0] / doc_norms[doc_norms > 0]
+            # 丸め誤差で正しい候補を落とさないよう、わずかに緩めておく
+            upper_bound = float(ratios.max()) * (1 + 1e-9) if len(ratios) else 0.0
+            self._term_upper_bounds[token_id] = upper_bound
+        
+        return upper_bound
+    
+    def bm25_term_weights(self, doc_ids: np.ndarray, tfs: np.ndarray, bm25: BM25Parameters) -> np.ndarray:
+        """正規化TF（出現回数 / 文書長）をBM25の飽和TFに変換（BM25+では出現時にdeltaを加算）"""
+        doc_lengths = self.get_doc_lengths()[doc_ids]
+        counts = np.rint(tfs * doc_lengths)
+        length_norms = bm25.k1 * (1 - bm25.b + bm25.b * doc_lengths / bm25.average_length)
+        weights = np.divide(counts * (bm25.k1 + 1), counts + length_norms,
+                            out=np.zeros(len(counts), dtype=np.float64), where=counts > 0)
+        return weights + bm25.delta * (counts > 0)
+    
+    def get_bm25_upper_bound(self, token_id: int, bm25: BM25Parameters) -> float:
+        """トークン1つがBM25スコアに寄与しうる上限（重みを除いた飽和TFの最大値）"""
+        if bm25 != self._bm25_parameters:
+            self._bm25_parameters = bm25
+            self._bm25_upper_bounds = {}
+        upper_bound = self._bm25_upper_bounds.get(token_id)
+        if upper_bound is None:
+            doc_ids, tfs = self.get_postings(token_id)
+            weights = self.bm25_term_weights(doc_ids, tfs, bm25)
+            upper_bound = float(weights.max()) * (1 + 1e-9) if len(weights) else 0.0
+            self._bm25_upper_bounds[token_id] = upper_bound
+        
+        return upper_bound
+    
+    def rank(self,
+             query_ids: np.ndarray,
+             query_weights: np.ndarray,
+             query_norm: float,
+             k: Optional[int],
+             score_threshold: float,
+             allowed: np.ndarray,
+             theta: float = None,
+             bm25: BM25Parameters = None) -> Tuple[np.ndarray, np.ndarray]:
+        """類似度が正かつ閾値以上のドキュメントを（類似度降順・ドキュメント順）で返す
+        
+        bm25を渡すとBM25で採点する（query_normにはクエリで到達しうる最大スコアを渡し、
+        スコアを0〜1に正規化する）。省略時はTF-IDFのコサイン類似度。
+        
+        MaxScore方式で、寄与上限の大きいトークンから順にポスティングを処理する。
+        残りのトークンの上限合計が現時点のk位のスコアに届かなくなったら新規候補の追加をやめ、
+        以降は既存候補についてのみポスティングを二分探索で引く。
+        thetaには他シャードで確定済みのk位のスコアを渡せる（枝刈りにのみ使用）。
+        k=Noneの場合は枝刈りせず、閾値以上の全ドキュメントを返す。
+        """
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+        if not len(query_ids) or (k is not None and k <= 0):
+            return empty
+        
+        if bm25 is None:
+            doc_norms = self.get_doc_norms()
+            scorable = doc_norms > 0
+            term_bounds = [self.get_term_upper_bound(token_id) for token_id in query_ids]
+            
+            def term_weights(doc_ids, tfs):
+                return tfs
+            
+            def partial_scores(doc_ids, dot_products):
+                return dot_products / (query_norm * doc_norms[doc_ids])
+        else:
+            scorable = self.get_doc_lengths() > 0
+            term_bounds = [self.get_bm25_upper_bound(token_id, bm25) for token_id in query_ids]
+            
+            def term_weights(doc_ids, tfs):
+                return self.bm25_term_weights(doc_ids, tfs, bm25)
+            
+            def partial_scores(doc_ids, dot_products):
+                return dot_products / query_norm
+        
+        upper_bounds = np.array(term_bounds) * query_weights / query_norm
+        order = np.argsort(-upper_bounds, kind="stable")
+        remaining_bounds = np.cumsum(upper_bounds[order][::-1])[::-1]
+        
+        candidate_ids, candidate_dots = empty
+        theta = score_threshold if theta is None or k is None else max(theta, score_threshold)
+        for position, term_index in enumerate(order):
+            token_id, weight = query_ids[term_index], query_weights[term_index]
+            if remaining_bounds[position] >= theta:
+                # まだ新しいドキュメントがk位以内に入りうる：ポスティングを全て読む
+                doc_ids, tfs = self.get_postings(token_id)
+                keep = allowed[doc_ids] & scorable[doc_ids]
+                doc_ids, tfs = doc_ids[keep], tfs[keep]
+                dots = np.concatenate([candidate_dots, weight * term_weights(doc_ids, tfs)])
+                doc_ids = np.concatenate([candidate_ids, doc_ids])
+                candidate_ids, inverse = np.unique(doc_ids, return_inverse=True)
+                candidate_dots = np.bincount(inverse, weights=dots, minlength=len(candidate_ids))
+            else:
+                # 残りのトークンでは新規候補は届かない：届かない既存候補も除いてから飛ばし読み
+                keep = partial_scores(candidate_ids, candidate_dots) + remaining_bounds[position] >= theta
+                candidate_ids, candidate_dots = candidate_ids[keep], candidate_dots[keep]
+                candidate_dots = candidate_dots + weight * term_weights(
+                    candidate_ids, self.probe_postings(token_id, candidate_ids)
+                )
+            
+            if k is not None and len(candidate_ids) >= k:
+                scores = partial_scores(candidate_ids, candidate_dots)
+                theta = max(theta, np.partition(scores, len(scores) - k)[len(scores) - k])
+        
+        scores = partial_scores(candidate_ids, candidate_dots)
+        matched = scores >= score_threshold
+        candidate_ids, scores = candidate_ids[matched], scores[matched]
+        
+        # argpartitionで上位k件を選択（境界の同点はドキュメント順を優先）
+        if k is not None and k < len(candidate_ids):
+            kth_score = scores[np.argpartition(-scores, k - 1)[:k]].min()
+            top = scores >= kth_score
+            candidate_ids, scores = candidate_ids[top], scores[top]
+        order = np.lexsort((candidate_ids, -scores))[:k]
+        return candidate_ids[order], scores[order]
+    
+    def append(self,
+               documents: List[Document],
+               tf_block: sparse.csr_matrix,
+               doc_seqs: np.ndarray,
+               doc_lengths: np.ndarray):
+        """未保存ドキュメントとTFブロックを追加"""
+        self.documents.extend(documents)
+        self._tf_blocks.append(tf_block)
+        self._doc_seqs.append(doc_seqs)
+        self._doc_lengths.append(doc_lengths)
+        self._invalidate_caches()
+    
+    def write_pending_segment(self, segment_name: str, vocab_size: int) -> bool:
+        """未保存分のみを新しいセグメントとして書き出す（既存セグメントは書き換えない）"""
+        if self._documents is None or not self._documents.pending:
+            return False
+        
+        num_segments = len(self._documents.segments)
+        segment = IndexSegment.write(
+            os.path.join(self.index_directory, segment_name),
+            merge_tf_blocks(self._tf_blocks[num_segments:], vocab_size),
+            ((doc.page_content, doc.metadata) for doc in self._documents.pending),
+            np.concatenate(self._doc_seqs[num_segments:]),
+            np.concatenate(self._doc_lengths[num_segments:])
+        )
+        
+        # 以降は書き出したセグメントをmmapで参照（内容は同じためキャッシュはそのまま）
+        self._documents = SegmentedDocumentList(self._documents.segments + [segment])
+        self._tf_blocks = self._tf_blocks[:num_segments] + [segment.tf_matrix]
+        self._doc_seqs = self._doc_seqs[:num_segments] + [segment.doc_seqs]
+        self._doc_lengths = self._doc_lengths[:num_segments] + [segment.doc_lengths]
+        self.segment_names.append(segment.name)
+        return True
+    
+    def tombstone(self, doc_ids: Iterable[int]) -> List[Tuple[IndexSegment, int]]:
+        """保存済みのチャンクを削除済みにし、新たに削除した（セグメント, セグメント内ID）を返す"""
+        live_mask = self.get_live_mask()
+        num_segment_docs = len(self.documents) - len(self.documents.pending)
+        deleted = []
+        for doc_id in sorted(set(int(doc_id) for doc_id in doc_ids)):
+            if doc_id >= num_segment_docs or not live_mask[doc_id]:
+                continue
+            segment, local_id = self.documents.locate(doc_id)
+            self.tombstones.setdefault(segment.name, set()).add(local_id)
+            deleted.append((segment, local_id))
+        
+        if deleted:
+            self._live_mask = None
+        return deleted
+    
+    def needs_compaction(self, max_segments: int, max_deleted_ratio: float) -> bool:
+        """セグメント数または削除済みチャンクの割合が閾値を超えているか"""
+        if len(self.segment_names) > max_segments:
+            return True
+        if len(self) and self.num_deleted() / len(self) > max_deleted_ratio:
+            return True
+        return False
+    
+    def compact(self, next_segment_name: Callable[[], str], lock, on_swap: Callable[[], None]) -> bool:
+        """セグメントを1つに統合し、トゥームストーン済みのチャンクを物理削除
+        
+        統合セグメントの書き出しはロック外で行うため、その間も検索・追加できる
+        （コンパクション中に追加されたセグメントは統合対象外として後ろに残る）。
+        切り替え後、ロックを保持したままon_swapでインデックスヘッダを書き換える
+        """
+        with lock:
+            segments = list(self.documents.segments)
+            tombstones = {segment.name: set(self.tombstones.get(segment.name, ())) for segment in segments}
+            if len(segments) <= 1 and not any(tombstones.values()):
+                return False
+            segment_name = next_segment_name()
+        
+        # 有効なチャンクのみを統合（セグメントは不変のためロック不要）
+        live_ids = [
+            np.setdiff1d(np.arange(len(segment), dtype=np.int64),
+                         np.fromiter(tombstones[segment.name], dtype=np.int64))
+            for segment in segments
+        ]
+        merged_tf = merge_tf_blocks(
+            [segment.tf_matrix[:, ids] for segment, ids in zip(segments, live_ids)],
+            max(segment.tf_matrix.shape[0] for segment in segments)
+        )
+        merged_segments = []
+        if merged_tf.shape[1]:
+            merged_segments.append(IndexSegment.write(
+                os.path.join(self.index_directory, segment_name),
+                merged_tf,
+                ((segment.get_text(local_id), segment.get_metadata(local_id))
+                 for segment, ids in zip(segments, live_ids) for local_id in ids),
+                np.concatenate([segment.doc_seqs[ids] for segment, ids in zip(segments, live_ids)]),
+                # 文書長のない古いセグメントを含む場合は統合後も検索時に求める
+                None if any(segment.doc_lengths is None for segment in segments)
+                else np.concatenate([segment.doc_lengths[ids] for segment, ids in zip(segments, live_ids)])
+            ))
+        
+        with lock:
+            # コンパクション中に削除されたチャンクは統合セグメント内のIDに付け替える
+            new_tombstones = {}
+            offset = 0
+            for segment, ids in zip(segments, live_ids):
+                deleted = self.tombstones.get(segment.name, set()) - tombstones[segment.name]
+                if deleted:
+                    merged_ids = offset + np.searchsorted(ids, sorted(deleted))
+                    new_tombstones.setdefault(segment_name, set()).update(int(i) for i in merged_ids)
+                offset += len(ids)
+            remaining = self._documents.segments[len(segments):]
+            for segment in remaining:
+                if self.tombstones.get(segment.name):
+                    new_tombstones[segment.name] = self.tombstones[segment.name]
+            
+            documents = SegmentedDocumentList(merged_segments + remaining)
+            documents.pending = self._documents.pending
+            self._documents = documents
+            self._tf_blocks = [segment.tf_matrix for segment in merged_segments] + self._tf_blocks[len(segments):]
+            self._doc_seqs = [segment.doc_seqs for segment in merged_segments] + self._doc_seqs[len(segments):]
+            self._doc_lengths = [segment.doc_lengths for segment in merged_segments] + self._doc_lengths[len(segments):]
+            self.segment_names = [segment.name for segment in documents.segments]
+            self.tombstones = new_tombstones
+            self._invalidate_caches()
+            on_swap()
+        
+        # 古いセグメントを削除（参照中の検索はmmapを保持しているため影響しない）
+        for segment in segments:
+            segment.close()
+            shutil.rmtree(segment.path, ignore_errors=True)
+        
+        logger.info(f"Compacted shard {self.name}: {len(segments)} segments into {len(merged_segments)} "
+                    f"({sum(len(ids) for ids in live_ids)} documents)")
+        return True
+    
+    def close(self):
+        """開いているセグメントのmmapを解放"""
+        if self._documents is not None:
+            for segment in self._documents.segments:
+                segment.close()
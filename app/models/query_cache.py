@@ -0,0 +1,62 @@
+"""
+検索結果のLRU/TTLキャッシュ
+同じ質問（正規化したクエリトークン・検索条件が同じもの）の検索を省略する
+
+各エントリには作成時のコーパスバージョンを記録し、ドキュメントの追加・削除で
+バージョンが進んだ後のエントリはミスとして扱って破棄する
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+class QueryCache:
+    """件数上限付きのLRUキャッシュ（有効期限・コーパスバージョンで無効化）"""
+    
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # キー → (コーパスバージョン, 作成時刻, 値)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: Hashable, version: int) -> Optional[Any]:
+        """キャッシュ済みの値（期限切れ・古いバージョンならNone）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_version, created_at, value = entry
+                if entry_version == version and time.monotonic() - created_at <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+    
+    def put(self, key: Hashable, version: int, value: Any):
+        """値を登録（上限を超えたら最も古く使われたエントリを破棄）"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (version, time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        """全エントリを破棄"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """ヒット数・ミス数・ヒット率・登録数"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries)
+            }
@@ -1,8 +1,9 @@
 """
 シンプルなRAGエンジン（TF-IDF + テンプレートベース回答生成 + OpenAI統合）
 """
+import copy
 import logging
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, Iterator
 from langchain.schema import Document
 from langchain.prompts import PromptTemplate
 
@@ -12,18 +13,20 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config import Config
 from models.simple_vector_db import SimpleVectorDatabase
-
-# OpenAI統合のためのインポート
-try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
-    logger.warning("OpenAI not available. Install with: pip install openai")
+from models.answer_cache import AnswerCache, normalize_question
+from models.context_packer import ContextPacker
+from models.single_flight import SingleFlight
+from services.openai_client import OPENAI_AVAILABLE, CircuitOpenError, get_shared_openai_client
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+ANSWER_CACHE_FILE = "answer_cache.json"
+NO_DOCUMENTS_ANSWER = "申し訳ございませんが、関連する情報が見つかりませんでした。質問を言い換えてお試しください。"
+INTERRUPTED_ANSWER_NOTE = "\n\n（回答の生成が途中で中断されました。もう一度お試しください）"
+# コンテキスト1件ごとの見出し（文書名・区切り線）に見込むトークン数
+CONTEXT_ENTRY_OVERHEAD_TOKENS = 16
+
 class SimpleRAGEngine:
     """シンプルなRAGエンジン"""
     
@@ -31,13 +34,25 @@ class SimpleRAGEngine:
         self.vector_db = vector_db or SimpleVectorDatabase()
         self.use_openai = use_openai and OPENAI_AVAILABLE
         self.openai_client = None
+        # OpenAIの回答キャッシュ（同じ・よく似た質問はAPIを呼ばずに返す）
+        self.answer_cache = AnswerCache(
+            os.path.join(self.vector_db.persist_directory, ANSWER_CACHE_FILE),
+            Config.ANSWER_CACHE_MAX_ENTRIES,
+            Config.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+            self.vector_db.get_query_vector
+        )
+        # プロンプトに含めるチャンクをトークン予算内で選ぶ
+        self.context_packer = ContextPacker()
+        # 同時に届いた同じ質問は1回だけ検索・回答し、結果を共有する
+        self.single_flight = SingleFlight()
         
         # OpenAI クライアントの初期化
         if self.use_openai:
             api_key = Config.get_openai_api_key()
             if api_key:
                 try:
-                    self.openai_client = OpenAI(api_key=api_key)
+                    # プロセス共通のクライアント（接続プール・再試行・サーキットブレーカー付き）
+                    self.openai_client = get_shared_openai_client(api_key)
                     logger.info("OpenAI client initialized successfully")
                 except Exception as e:
                     logger.error(f"Failed to initialize OpenAI client: {e}")
@@ -586,19 +601,20 @@ CubeMX使用時の注意点:
                        question: str, 
                        microcontroller: str = "NUCLEO-F767ZI",
                        num_docs: int = 5) -> Dict:
-        """質問に対してRAGベースで回答を生成"""
+        """質問に対してRAGベースで回答を生成（同じ質問を処理中ならその結果を共有）"""
+        key = (normalize_question(question), microcontroller, num_docs)
+        result, shared = self.single_flight.do(key, self._answer_question, question, microcontroller, num_docs)
+        return copy.deepcopy(result) if shared else result
+    
+    def _answer_question(self, question: str, microcontroller: str, num_docs: int) -> Dict:
+        """質問に対してRAGベースで回答を生成（answer_questionの本体）"""
         try:
             # 1. 関連ドキュメントを検索
-            relevant_docs = self.vector_db.search_similar_documents(
-                query=question,
-                k=num_docs,
-                microcontroller=microcontroller,
-                score_threshold=0.05  # より緩い閾値
-            )
+            relevant_docs = self._retrieve_documents(question, microcontroller, num_docs)
             
             if not relevant_docs:
                 return {
-                    "answer": "申し訳ございませんが、関連する情報が見つかりませんでした。質問を言い換えてお試しください。",
+                    "answer": NO_DOCUMENTS_ANSWER,
                     "sources": [],
                     "confidence": 0.0,
                     "microcontroller": microcontroller
@@ -630,17 +646,67 @@ CubeMX使用時の注意点:
                 "microcontroller": microcontroller
             }
     
+    def answer_question_stream(self,
+                               question: str,
+                               microcontroller: str = "NUCLEO-F767ZI",
+                               num_docs: int = 5) -> Iterator[Dict]:
+        """質問に対する回答をストリーミングで生成
+        
+        最初に参考資料・信頼度を{"type": "metadata", ...}として返し、
+        続けて回答の断片を{"type": "token", "text": ...}として生成された順に返す。
+        同じ質問を配信中なら、そのイベント列を最初から共有する
+        """
+        key = (normalize_question(question), microcontroller, num_docs)
+        return self.single_flight.stream(key, self._answer_question_stream, question, microcontroller, num_docs)
+    
+    def _answer_question_stream(self, question: str, microcontroller: str, num_docs: int) -> Iterator[Dict]:
+        """質問に対する回答のイベント列（answer_question_streamの本体）"""
+        relevant_docs = self._retrieve_documents(question, microcontroller, num_docs)
+        yield {
+            "type": "metadata",
+            "sources": self._extract_sources(relevant_docs),
+            "confidence": self._calculate_confidence(relevant_docs),
+            "microcontroller": microcontroller,
+            "num_sources": len(relevant_docs)
+        }
+        
+        if not relevant_docs:
+            yield {"type": "token", "text": NO_DOCUMENTS_ANSWER}
+            return
+        for text in self._stream_answer(question, relevant_docs, microcontroller):
+            yield {"type": "token", "text": text}
+    
+    def _retrieve_documents(self, question: str, microcontroller: str, num_docs: int) -> List[Tuple[Document, float]]:
+        """回答に使う関連ドキュメントを検索"""
+        return self.vector_db.search_similar_documents(
+            query=question,
+            k=num_docs,
+            microcontroller=microcontroller,
+            score_threshold=0.05  # より緩い閾値
+        )
+    
+    def _source_string(self, relevant_docs: List[Tuple[Document, float]]) -> str:
+        """プロンプト・テンプレート用の参考ドキュメント名"""
+        sources = [doc.metadata.get("filename", "不明") for doc, _ in relevant_docs[:3]]
+        return ", ".join(sources) if sources else "関連ドキュメント"
+    
     def _generate_answer(self, question: str, relevant_docs: List[Tuple[Document, float]], microcontroller: str) -> str:
         """回答生成（OpenAI API使用可能時はより高品質な回答を生成）"""
         
         # ソース情報を作成
-        sources = [doc.metadata.get("filename", "不明") for doc, _ in relevant_docs[:3]]
-        source_str = ", ".join(sources) if sources else "関連ドキュメント"
+        source_str = self._source_string(relevant_docs)
         
         # OpenAI APIが利用可能な場合は高品質な回答を生成
         if self.use_openai and self.openai_client and relevant_docs:
+            cached_answer = self.answer_cache.get(question, microcontroller, relevant_docs)
+            if cached_answer is not None:
+                return cached_answer
             try:
-                return self._generate_openai_answer(question, relevant_docs, microcontroller, source_str)
+                answer = self._generate_openai_answer(question, relevant_docs, microcontroller, source_str)
+                self.answer_cache.put(question, microcontroller, relevant_docs, answer)
+                return answer
+            except CircuitOpenError:
+                logger.info("OpenAI API is degraded, using template-based response")
             except Exception as e:
                 logger.error(f"OpenAI API call failed: {e}")
                 logger.info("Falling back to template-based response")
@@ -648,15 +714,80 @@ CubeMX使用時の注意点:
         # フォールバック：テンプレートベース回答
         return self._generate_template_answer(question, relevant_docs, microcontroller, source_str)
     
+    def _stream_answer(self, question: str, relevant_docs: List[Tuple[Document, float]],
+                       microcontroller: str) -> Iterator[str]:
+        """回答の断片を生成された順に返す（_generate_answerのストリーミング版）"""
+        source_str = self._source_string(relevant_docs)
+        
+        if self.use_openai and self.openai_client and relevant_docs:
+            cached_answer = self.answer_cache.get(question, microcontroller, relevant_docs)
+            if cached_answer is not None:
+                yield cached_answer
+                return
+            
+            parts = []
+            try:
+                for text in self._stream_openai_answer(question, relevant_docs, microcontroller, source_str):
+                    parts.append(text)
+                    yield text
+                self.answer_cache.put(question, microcontroller, relevant_docs, "".join(parts))
+                return
+            except CircuitOpenError:
+                logger.info("OpenAI API is degraded, using template-based response")
+            except Exception as e:
+                logger.error(f"OpenAI API call failed: {e}")
+                # 表示済みの断片は取り消せないため、途中で失敗した場合は中断を知らせる
+                if parts:
+                    yield INTERRUPTED_ANSWER_NOTE
+                    return
+                logger.info("Falling back to template-based response")
+        
+        yield self._generate_template_answer(question, relevant_docs, microcontroller, source_str)
+    
     def _generate_openai_answer(self, question: str, relevant_docs: List[Tuple[Document, float]], 
                                microcontroller: str, source_str: str) -> str:
         """OpenAI APIを使用した高品質回答生成"""
+        try:
+            response = self.openai_client.chat.completions.create(
+                model=Config.LLM_MODEL,
+                messages=self._build_openai_messages(question, relevant_docs, microcontroller, source_str),
+                temperature=Config.LLM_TEMPERATURE,
+                max_tokens=Config.MAX_TOKENS
+            )
+            
+            answer = response.choices[0].message.content
+            logger.info("Generated answer using OpenAI API")
+            return answer
+        
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            raise
+    
+    def _stream_openai_answer(self, question: str, relevant_docs: List[Tuple[Document, float]],
+                              microcontroller: str, source_str: str) -> Iterator[str]:
+        """OpenAI APIのストリーミング応答から回答の断片を返す"""
+        stream = self.openai_client.chat.completions.create(
+            model=Config.LLM_MODEL,
+            messages=self._build_openai_messages(question, relevant_docs, microcontroller, source_str),
+            temperature=Config.LLM_TEMPERATURE,
+            max_tokens=Config.MAX_TOKENS,
+            stream=True
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+        logger.info("Streamed answer using OpenAI API")
+    
+    def _build_openai_messages(self, question: str, relevant_docs: List[Tuple[Document, float]],
+                               microcontroller: str, source_str: str) -> List[Dict]:
+        """回答生成用のメッセージ（システムプロンプト + コンテキスト付きの質問）"""
         
         # コンテキストを構築
         context_parts = []
-        for doc, score in relevant_docs[:5]:  # 上位5件のドキュメントを使用
+        for doc, content in self.context_packer.pack(relevant_docs, Config.CONTEXT_TOKEN_BUDGET,
+                                                     CONTEXT_ENTRY_OVERHEAD_TOKENS):
             context_parts.append(f"文書: {doc.metadata.get('filename', '不明')}")
-            context_parts.append(f"内容: {doc.page_content[:800]}")  # 長すぎるコンテンツを制限
+            context_parts.append(f"内容: {content}")
             context_parts.append("---")
         
         context = "\n".join(context_parts)
@@ -685,24 +816,10 @@ CubeMX使用時の注意点:
 
 マイコン初心者にも分かりやすく、実用的で詳しい回答をお願いします。"""
 
-        try:
-            response = self.openai_client.chat.completions.create(
-                model=Config.LLM_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=Config.LLM_TEMPERATURE,
-                max_tokens=Config.MAX_TOKENS
-            )
-            
-            answer = response.choices[0].message.content
-            logger.info("Generated answer using OpenAI API")
-            return answer
-            
-        except Exception as e:
-            logger.error(f"OpenAI API error: {e}")
-            raise
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
     
     def _generate_template_answer(self, question: str, relevant_docs: List[Tuple[Document, float]], 
                                  microcontroller: str, source_str: str) -> str:
@@ -790,9 +907,10 @@ CubeMX使用時の注意点:
         
         # コンテキストを構築
         context_parts = []
-        for doc, score in relevant_docs[:3]:  # 上位3件のドキュメントを使用
+        for doc, content in self.context_packer.pack(relevant_docs, Config.CODE_CONTEXT_TOKEN_BUDGET,
+                                                     CONTEXT_ENTRY_OVERHEAD_TOKENS):
             context_parts.append(f"参考文書: {doc.metadata.get('filename', '不明')}")
-            context_parts.append(f"内容: {doc.page_content[:600]}")
+            context_parts.append(f"内容: {content}")
             context_parts.append("---")
         
         context = "\n".join(context_parts)
@@ -1054,7 +1172,10 @@ void {request.replace(' ', '_')}_Example(void)
             "vector_db_collections": self.vector_db.list_collections() if self.vector_db else [],
             "embedding_model": "TF-IDF (Simple)",
             "llm_model": Config.LLM_MODEL if self.use_openai else "Template-based (Offline)",
-            "total_documents": len(self.vector_db.documents) if self.vector_db else 0,
+            "total_documents": self.vector_db.count_documents() if self.vector_db else 0,
+            "query_cache": self.vector_db.query_cache.stats() if self.vector_db else {},
+            "answer_cache": self.answer_cache.stats(),
+            "single_flight": dict(self.single_flight.stats),
             "openai_available": OPENAI_AVAILABLE,
             "openai_configured": bool(Config.get_openai_api_key()),
             "mode": "OpenAI + Template Fallback" if self.use_openai else "Template-only"
@@ -1,16 +1,21 @@
 """
-シンプルなベクトルデータベース（TF-IDF + Cosine Similarity）
+シンプルなベクトルデータベース（TF-IDF + Cosine Similarity / BM25）
 依存関係を最小限に抑えたオフライン版
 """
 import os
+import copy
 import json
 import logging
 import pickle
-from typing import List, Dict, Optional, Tuple
+import shutil
+import threading
+from typing import List, Dict, Optional, Tuple, Iterable, Set
 from collections import Counter
+from itertools import islice
 import math
-import re
 
+import numpy as np
+from scipy import sparse
 from langchain.schema import Document
 
 import os
@@ -18,19 +23,57 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config import Config
+from models.index_segment import IndexSegment
+from models.index_shard import IndexShard, BM25Parameters, COMMON_SHARD, merge_tf_blocks
+from models.tokenizer import Tokenizer, tokenize
+from models.token_cache import TokenCache
+from models.query_cache import QueryCache
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+INDEX_FORMAT_VERSION = 2
+INDEX_HEADER_FILE = "index.json"
+DOCUMENT_FREQUENCIES_FILE = "document_frequencies_{generation:06d}.npy"
+VOCABULARY_FILE = "vocabulary.txt"
+LEGACY_PICKLE_FILE = "simple_vector_db.pkl"
+# 検索時に選べる順位付け方式
+RANKING_MODES = ("tfidf", "bm25", "bm25+")
+# TFブロック作成時に出現回数をまとめて集計するチャンク数
+TF_BLOCK_BATCH_SIZE = 4096
+
 class SimpleVectorDatabase:
     """シンプルなベクトルデータベース（TF-IDF）"""
     
     def __init__(self, persist_directory: str = None):
         self.persist_directory = persist_directory or Config.VECTOR_DB_PATH
-        self.documents = []  # List[Document]
-        self.tfidf_vectors = []  # List[Dict[str, float]]
-        self.vocabulary = set()
-        self.idf_scores = {}
+        self.index_directory = os.path.join(self.persist_directory, "simple_index")
+        # マイコンごとのシャード（セグメントは検索・追加で必要になるまで開かない）
+        self.shards = {}  # Dict[str, IndexShard]
+        self._vocabulary = None  # トークン → 語彙ID（初回アクセス時に読み込み）
+        self._tokenizer = None  # 語彙にインターンするトークナイザ（語彙と同時に作成）
+        # チャンク本文のハッシュ → トークンID配列（変更のない本文の再取り込みでトークン化を省略）
+        self.token_cache = TokenCache(self.index_directory, Config.SIMPLE_INDEX_TOKEN_CACHE_MAX_MB * 1024 * 1024)
+        self._persisted_vocab_size = 0
+        self._vocabulary_bytes = 0
+        self._generation = 0
+        self._header_signature = None  # 最後に読み書きしたインデックスヘッダの（更新時刻, サイズ）
+        self._next_doc_seq = 0  # 全シャード共通の追加順序番号（同点時の並び順）
+        # 語彙・文書頻度・IDFは全シャード共通（シャードを分けてもスコアは変わらない）
+        self.document_frequencies = np.zeros(0, dtype=np.int64)  # 語彙ID → 出現ドキュメント数
+        self._document_frequencies_file = None  # 保存済みの文書頻度ファイル（未保存の変更があればNone）
+        self._idf = None  # キャッシュ済みIDFベクトル
+        self._idf_version = 0
+        self._bm25_idf = None  # キャッシュ済みBM25用IDFベクトル
+        self._total_document_length = 0  # 有効ドキュメントの総トークン数（BM25の平均文書長用、不明ならNone）
+        # 検索結果のキャッシュ（ドキュメントの追加・削除でコーパスバージョンを進めて無効化）
+        self._corpus_version = 0
+        self.query_cache = QueryCache(Config.QUERY_CACHE_MAX_ENTRIES, Config.QUERY_CACHE_TTL_SECONDS)
+        
+        # 検索・追加とバックグラウンドコンパクションの排他制御
+        self._lock = threading.RLock()
+        self._compaction_lock = threading.Lock()
+        self._compaction_thread = None
         
         # ディレクトリ作成
         os.makedirs(self.persist_directory, exist_ok=True)
@@ -40,27 +83,37 @@ class SimpleVectorDatabase:
         
         logger.info(f"Simple vector database initialized at: {self.persist_directory}")
     
+    @property
+    def vocabulary(self) -> Dict[str, int]:
+        """トークン → 語彙ID（検索・追加で必要になるまで読み込まない）"""
+        if self._vocabulary is None:
+            self._vocabulary = self._load_vocabulary()
+        return self._vocabulary
+    
+    @vocabulary.setter
+    def vocabulary(self, vocabulary: Dict[str, int]):
+        self._vocabulary = vocabulary
+        self._tokenizer = None
+    
+    @property
+    def tokenizer(self) -> Tokenizer:
+        """語彙に未知のトークンを追加しながらトークンIDを返すトークナイザ"""
+        if self._tokenizer is None:
+            self._tokenizer = Tokenizer(self.vocabulary)
+        return self._tokenizer
+    
     def _tokenize(self, text: str) -> List[str]:
         """テキストをトークン化"""
-        # 簡単な前処理
-        text = text.lower()
-        # 英数字と日本語文字のみを保持
-        text = re.sub(r'[^a-zA-Z0-9\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF\s]', ' ', text)
-        # 単語分割（英語）と文字分割（日本語）
-        tokens = []
-        for word in text.split():
-            if re.match(r'^[a-zA-Z0-9]+$', word):
-                # 英数字の場合はそのまま
-                if len(word) > 2:  # 短すぎる単語は除外
-                    tokens.append(word)
-            else:
-                # 日本語の場合は2-gramで分割
-                for i in range(len(word) - 1):
-                    bigram = word[i:i+2]
-                    if len(bigram) == 2:
-                        tokens.append(bigram)
-        
-        return tokens
+        return tokenize(text)
+    
+    def _encode(self, text: str) -> np.ndarray:
+        """テキストを語彙IDの配列に変換（未知のトークンは語彙に追加、同じ本文はキャッシュから取得）"""
+        key = self.token_cache.key(text)
+        token_ids = self.token_cache.get(key)
+        if token_ids is None:
+            token_ids = self.tokenizer.encode(text)
+            self.token_cache.put(key, token_ids)
+        return token_ids
     
     def _calculate_tf(self, tokens: List[str]) -> Dict[str, float]:
         """Term Frequency計算"""
@@ -73,55 +126,268 @@ class SimpleVectorDatabase:
         
         return tf_scores
     
-    def _calculate_idf(self):
-        """Inverse Document Frequency計算"""
-        doc_count = len(self.documents)
-        if doc_count == 0:
-            return
+    def _get_idf(self) -> np.ndarray:
+        """Inverse Document Frequency計算（文書頻度カウンタから遅延計算）"""
+        if self._idf is None:
+            idf = np.zeros(len(self.document_frequencies), dtype=np.float64)
+            present = self.document_frequencies > 0
+            idf[present] = np.log(self.count_documents() / self.document_frequencies[present])
+            self._idf = idf
+            self._idf_version += 1
+        
+        return self._idf
+    
+    def _get_bm25_idf(self) -> np.ndarray:
+        """BM25用のIDF（log(1 + (N - df + 0.5) / (df + 0.5))、常に正）"""
+        if self._bm25_idf is None:
+            idf = np.zeros(len(self.document_frequencies), dtype=np.float64)
+            present = self.document_frequencies > 0
+            document_frequencies = self.document_frequencies[present]
+            idf[present] = np.log1p((self.count_documents() - document_frequencies + 0.5) / (document_frequencies + 0.5))
+            self._bm25_idf = idf
+        
+        return self._bm25_idf
+    
+    def _get_average_document_length(self) -> float:
+        """有効ドキュメントの平均文書長（総トークン数が不明なら各シャードの文書長から数え直す）"""
+        if self._total_document_length is None:
+            self._total_document_length = int(sum(
+                shard.get_doc_lengths()[shard.get_live_mask()].sum() for shard in self.shards.values()
+            ))
+        num_documents = self.count_documents()
+        return self._total_document_length / num_documents if num_documents else 0.0
+    
+    def _get_bm25_parameters(self, ranking: str) -> Optional[BM25Parameters]:
+        """順位付け方式に対応するBM25パラメータ（TF-IDFならNone）"""
+        if ranking not in RANKING_MODES:
+            raise ValueError(f"Unknown ranking mode: {ranking}")
+        if ranking == "tfidf":
+            return None
+        return BM25Parameters(
+            k1=Config.BM25_K1,
+            b=Config.BM25_B,
+            delta=Config.BM25_PLUS_DELTA if ranking == "bm25+" else 0.0,
+            average_length=self._get_average_document_length() or 1.0
+        )
+    
+    def _build_tf_block(self, token_id_arrays: Iterable[np.ndarray]) -> Tuple[sparse.csr_matrix, np.ndarray]:
+        """チャンクごとの語彙ID配列から語彙ID×ドキュメントのTF行列と文書長を作成
+        
+        一定件数ごとに（語彙ID, ドキュメント）の出現をまとめて疎行列化し、重複を合算して出現回数を得る
+        """
+        blocks = []
+        doc_lengths = []
+        token_id_arrays = iter(token_id_arrays)
+        while True:
+            batch = list(islice(token_id_arrays, TF_BLOCK_BATCH_SIZE))
+            if not batch:
+                break
+            lengths = np.fromiter((len(token_ids) for token_ids in batch), dtype=np.int64, count=len(batch))
+            token_ids = np.concatenate(batch)
+            counts = sparse.csr_matrix(
+                (np.ones(len(token_ids), dtype=np.float64), (token_ids, np.repeat(np.arange(len(batch)), lengths))),
+                shape=(len(self.vocabulary), len(batch))
+            )
+            counts.sum_duplicates()
+            # TF = 出現回数 / トークン数
+            counts.data /= lengths[counts.indices]
+            blocks.append(counts.astype(np.float32))
+            doc_lengths.append(lengths)
+        
+        tf_block = merge_tf_blocks(blocks, len(self.vocabulary))
+        tf_block.sort_indices()
+        doc_lengths = np.concatenate(doc_lengths).astype(np.int32) if doc_lengths else np.zeros(0, dtype=np.int32)
+        return tf_block, doc_lengths
+    
+    def _add_document_frequencies(self, tf_block: sparse.csr_matrix):
+        """TFブロック分だけ文書頻度を差分更新（既存ブロックには触れない）"""
+        vocab_size = tf_block.shape[0]
+        if len(self.document_frequencies) < vocab_size:
+            self.document_frequencies = np.concatenate([
+                self.document_frequencies,
+                np.zeros(vocab_size - len(self.document_frequencies), dtype=np.int64)
+            ])
         
-        # 各トークンが出現するドキュメント数をカウント
-        token_doc_count = Counter()
+        # 各行の非ゼロ数 = そのトークンを含むドキュメント数
+        block_df = np.diff(tf_block.indptr)
+        self.document_frequencies[:len(block_df)] += block_df
+        self._invalidate_idf()
+    
+    def _subtract_document_frequencies(self, deleted: Iterable[Tuple[IndexSegment, int]]):
+        """削除したドキュメント分だけ文書頻度を差分更新
+        
+        削除対象の本文のみを再トークン化するため、コストは削除するチャンクの長さに比例する
+        """
+        token_ids = []
+        for segment, local_id in deleted:
+            doc_token_ids = self._encode(segment.get_text(local_id))
+            if self._total_document_length is not None:
+                self._total_document_length -= len(doc_token_ids)
+            token_ids.append(np.unique(doc_token_ids))
+        if token_ids:
+            np.subtract.at(self.document_frequencies, np.concatenate(token_ids), 1)
+        self._invalidate_idf()
+    
+    def _invalidate_idf(self):
+        """文書数・文書頻度の変化を反映（IDFと各シャードのノルムは次回検索時に再計算）"""
+        self._idf = None
+        self._bm25_idf = None
+        self._document_frequencies_file = None
+    
+    def count_documents(self, microcontroller: str = None) -> int:
+        """有効なドキュメント数（シャードを開かずにインデックスヘッダの値から数える）"""
+        if microcontroller:
+            shard = self.shards.get(microcontroller)
+            return shard.num_live() if shard else 0
+        return sum(shard.num_live() for shard in self.shards.values())
+    
+    def _get_shard(self, name: str) -> IndexShard:
+        """シャードを取得（なければ作成）"""
+        shard = self.shards.get(name)
+        if shard is None:
+            shard = self.shards[name] = IndexShard(name, self.index_directory, tokenize=self._tokenize)
+        return shard
+    
+    def _search_shards(self, microcontroller: str = None) -> List[IndexShard]:
+        """検索対象のシャード（マイコン指定時はそのマイコンと共通シャードのみ）"""
+        if not microcontroller:
+            return list(self.shards.values())
+        return [self.shards[name] for name in dict.fromkeys([microcontroller, COMMON_SHARD]) if name in self.shards]
+    
+    def _query_terms(self, query: str, bm25: BM25Parameters = None) -> Tuple[np.ndarray, np.ndarray, float]:
+        """クエリを（語彙ID, 重み, クエリベクトルのノルム）に変換
+        
+        ドキュメント側は生TFのため、重みにはIDFを2回掛けておく。
+        BM25では重みを（クエリ内の出現回数 × IDF）とし、ノルムの代わりに
+        クエリで到達しうる最大スコアを返す（スコアを0〜1に正規化するため）
+        """
+        if bm25 is not None:
+            return self._bm25_query_terms(query, bm25)
         
-        for doc in self.documents:
-            tokens = set(self._tokenize(doc.page_content))
-            for token in tokens:
-                token_doc_count[token] += 1
+        idf = self._get_idf()
+        query_tf = self._calculate_tf(self._tokenize(query))
+        query_ids = []
+        query_weights = []
+        query_norm_squared = 0.0
+        for token, tf in query_tf.items():
+            token_id = self.vocabulary.get(token)
+            if token_id is None:
+                continue  # 未知語はIDF=0
+            weight = tf * idf[token_id]
+            if weight == 0:
+                continue
+            query_norm_squared += weight ** 2
+            query_ids.append(token_id)
+            query_weights.append(weight * idf[token_id])
         
-        # IDF計算
-        self.idf_scores = {}
-        for token, count in token_doc_count.items():
-            self.idf_scores[token] = math.log(doc_count / count)
+        return (np.array(query_ids, dtype=np.int64),
+                np.array(query_weights, dtype=np.float64),
+                math.sqrt(query_norm_squared))
     
-    def _calculate_tfidf_vector(self, tokens: List[str]) -> Dict[str, float]:
-        """TF-IDFベクトル計算"""
-        tf_scores = self._calculate_tf(tokens)
-        tfidf_vector = {}
+    def get_query_vector(self, query: str) -> Dict[str, float]:
+        """クエリのTF-IDFベクトル（トークン → 重み、L2正規化済み。質問同士の類似度計算用）"""
+        with self._lock:
+            idf = self._get_idf()
+            weights = {}
+            for token, tf in self._calculate_tf(self._tokenize(query)).items():
+                token_id = self.vocabulary.get(token)
+                if token_id is not None and token_id < len(idf) and idf[token_id] > 0:
+                    weights[token] = tf * idf[token_id]
         
-        for token, tf in tf_scores.items():
-            idf = self.idf_scores.get(token, 0)
-            tfidf_vector[token] = tf * idf
+        norm = math.sqrt(sum(weight ** 2 for weight in weights.values()))
+        return {token: weight / norm for token, weight in weights.items()} if norm else {}
+    
+    def _bm25_query_terms(self, query: str, bm25: BM25Parameters) -> Tuple[np.ndarray, np.ndarray, float]:
+        """クエリをBM25の（語彙ID, 重み, 到達しうる最大スコア）に変換"""
+        idf = self._get_bm25_idf()
+        query_ids = []
+        query_weights = []
+        for token, count in Counter(self._tokenize(query)).items():
+            token_id = self.vocabulary.get(token)
+            if token_id is None or not self.document_frequencies[token_id]:
+                continue  # 未知語・削除済みのみの語は採点しない
+            query_ids.append(token_id)
+            query_weights.append(count * idf[token_id])
         
-        return tfidf_vector
+        # 飽和TFは k1 + 1 未満（BM25+ではさらに delta を加算）
+        max_score = sum(query_weights) * (bm25.k1 + 1 + bm25.delta)
+        return (np.array(query_ids, dtype=np.int64),
+                np.array(query_weights, dtype=np.float64),
+                max_score)
     
-    def _cosine_similarity(self, vector1: Dict[str, float], vector2: Dict[str, float]) -> float:
-        """コサイン類似度計算"""
-        # 共通する語彙を取得
-        common_tokens = set(vector1.keys()) & set(vector2.keys())
+    def _rank_documents(self,
+                        query: str,
+                        k: Optional[int],
+                        score_threshold: float,
+                        shards: List[IndexShard],
+                        filters: Dict[str, str] = None,
+                        ranking: str = "tfidf") -> List[Tuple[IndexShard, int, float]]:
+        """シャードごとに上位k件を求め、（類似度降順・追加順）でマージ
         
-        if not common_tokens:
-            return 0.0
+        先に検索したシャードで確定したk位のスコアは、後のシャードの枝刈りに使う。
+        k=Noneの場合は枝刈りせず、閾値以上の全ドキュメントを返す
+        """
+        bm25 = self._get_bm25_parameters(ranking)
+        query_ids, query_weights, query_norm = self._query_terms(query, bm25)
+        idf = self._get_idf()
         
-        # 内積計算
-        dot_product = sum(vector1[token] * vector2[token] for token in common_tokens)
+        shard_results = []
+        collected_scores = np.zeros(0, dtype=np.float64)
+        theta = None
+        for shard in shards:
+            shard.use_idf(idf, self._idf_version)
+            doc_ids, scores = shard.rank(query_ids, query_weights, query_norm, k, score_threshold,
+                                         shard.get_allowed_mask(filters or {}), theta, bm25)
+            shard_results.append((shard, doc_ids, scores))
+            if k is not None:
+                collected_scores = np.concatenate([collected_scores, scores])
+                if len(collected_scores) >= k > 0:
+                    theta = np.partition(collected_scores, len(collected_scores) - k)[len(collected_scores) - k]
         
-        # ベクトルの大きさ計算
-        magnitude1 = math.sqrt(sum(val ** 2 for val in vector1.values()))
-        magnitude2 = math.sqrt(sum(val ** 2 for val in vector2.values()))
+        return self._merge_shard_results(shard_results, k)
+    
+    def _merge_shard_results(self,
+                             shard_results: List[Tuple[IndexShard, np.ndarray, np.ndarray]],
+                             k: Optional[int]) -> List[Tuple[IndexShard, int, float]]:
+        """シャードごとの結果を（類似度降順・追加順）で上位k件にマージ"""
+        if not shard_results:
+            return []
+        shard_indices = np.concatenate([np.full(len(doc_ids), i) for i, (_, doc_ids, _) in enumerate(shard_results)])
+        doc_ids = np.concatenate([doc_ids for _, doc_ids, _ in shard_results])
+        scores = np.concatenate([scores for _, _, scores in shard_results])
+        doc_seqs = np.concatenate([shard.get_doc_seqs()[doc_ids] for shard, doc_ids, _ in shard_results])
         
-        if magnitude1 == 0 or magnitude2 == 0:
-            return 0.0
+        order = np.lexsort((doc_seqs, -scores))[:k]
+        return [(shard_results[shard_indices[i]][0], int(doc_ids[i]), float(scores[i])) for i in order]
+    
+    def _zero_score_documents(self,
+                              shards: List[IndexShard],
+                              filters: Dict[str, str],
+                              ranked: List[Tuple[IndexShard, int, float]],
+                              count: int) -> List[Tuple[IndexShard, int, float]]:
+        """類似度0のドキュメントを追加順に取得（閾値0以下の検索で上位k件に満たない場合）"""
+        shard_results = []
+        for shard in shards:
+            allowed = shard.get_allowed_mask(filters).copy()
+            allowed[[doc_id for ranked_shard, doc_id, _ in ranked if ranked_shard is shard]] = False
+            doc_ids = np.flatnonzero(allowed)[:count]
+            shard_results.append((shard, doc_ids, np.zeros(len(doc_ids))))
+        return self._merge_shard_results(shard_results, count)
+    
+    def _append_documents(self, shard: IndexShard, documents: List[Document], doc_seqs: np.ndarray = None):
+        """新規チャンクのみトークン化してシャードにTFブロックを追加
         
-        return dot_product / (magnitude1 * magnitude2)
+        IDFとノルムは検索時に遅延計算するため既存チャンクは再計算しない
+        """
+        tf_block, doc_lengths = self._build_tf_block(self._encode(doc.page_content) for doc in documents)
+        if doc_seqs is None:
+            doc_seqs = np.arange(self._next_doc_seq, self._next_doc_seq + len(documents), dtype=np.int64)
+        self._next_doc_seq = max(self._next_doc_seq, int(doc_seqs.max()) + 1)
+        shard.append(documents, tf_block, doc_seqs, doc_lengths)
+        self._corpus_version += 1
+        if self._total_document_length is not None:
+            self._total_document_length += int(doc_lengths.sum())
+        self._add_document_frequencies(tf_block)
     
     def add_documents(self, documents: List[Document], microcontroller: str = "NUCLEO-F767ZI") -> bool:
         """ドキュメントを追加"""
@@ -134,33 +400,20 @@ class SimpleVectorDatabase:
             for doc in documents:
                 doc.metadata["microcontroller"] = microcontroller
             
-            # ドキュメントを追加
-            self.documents.extend(documents)
-            
-            # 語彙を更新
-            for doc in documents:
-                tokens = self._tokenize(doc.page_content)
-                self.vocabulary.update(tokens)
-            
-            # IDF再計算
-            self._calculate_idf()
-            
-            # 全ドキュメントのTF-IDFベクトルを再計算
-            self.tfidf_vectors = []
-            for doc in self.documents:
-                tokens = self._tokenize(doc.page_content)
-                tfidf_vector = self._calculate_tfidf_vector(tokens)
-                self.tfidf_vectors.append(tfidf_vector)
+            with self._lock:
+                self._append_documents(self._get_shard(microcontroller), documents)
+                
+                # データを保存（新しいセグメントとして追記）
+                self._save_data()
             
-            # データを保存
-            self._save_data()
+            self._maybe_start_compaction()
             
             logger.info(f"Added {len(documents)} documents for {microcontroller}")
-            logger.info(f"Total documents: {len(self.documents)}")
+            logger.info(f"Total documents: {self.count_documents()}")
             logger.info(f"Vocabulary size: {len(self.vocabulary)}")
             
             return True
-            
+        
         except Exception as e:
             logger.error(f"Failed to add documents: {e}")
             return False
@@ -170,39 +423,48 @@ class SimpleVectorDatabase:
                                k: int = 5, 
                                microcontroller: str = None,
                                category: str = None,
-                               score_threshold: float = 0.1) -> List[Tuple[Document, float]]:
-        """類似ドキュメントを検索"""
+                               score_threshold: float = 0.1,
+                               file_type: str = None,
+                               source: str = None,
+                               ranking: str = None) -> List[Tuple[Document, float]]:
+        """類似ドキュメントを検索
+        
+        マイコン指定時はそのマイコンのシャードと共通シャードのみを開いて検索する。
+        rankingは"tfidf"（コサイン類似度）・"bm25"・"bm25+"のいずれか（省略時はConfigの設定）。
+        BM25のスコアはクエリで到達しうる最大スコアで割って0〜1に正規化する。
+        同じトークン列・検索条件の結果はコーパスが変わるまでキャッシュから返す
+        """
         try:
-            if not self.documents:
-                logger.warning("No documents in database")
-                return []
-            
-            # クエリのTF-IDFベクトル計算
-            query_tokens = self._tokenize(query)
-            query_vector = self._calculate_tfidf_vector(query_tokens)
-            
-            # 各ドキュメントとの類似度計算
-            similarities = []
-            for i, (doc, doc_vector) in enumerate(zip(self.documents, self.tfidf_vectors)):
-                # フィルター適用
-                if microcontroller and doc.metadata.get("microcontroller") != microcontroller:
-                    continue
-                if category and doc.metadata.get("category") != category:
-                    continue
+            ranking = ranking or Config.SIMPLE_INDEX_RANKING
+            cache_key = (tuple(sorted(self._tokenize(query))), k, microcontroller, category,
+                         score_threshold, file_type, source, ranking)
+            with self._lock:
+                if not self.count_documents():
+                    logger.warning("No documents in database")
+                    return []
                 
-                similarity = self._cosine_similarity(query_vector, doc_vector)
-                if similarity >= score_threshold:
-                    similarities.append((doc, 1.0 - similarity))  # スコアを距離に変換
-            
-            # 類似度でソート（スコアが小さいほど類似度が高い）
-            similarities.sort(key=lambda x: x[1])
-            
-            # 上位k件を返す
-            results = similarities[:k]
+                # キャッシュには複製を登録し、ヒット時も複製を返す（呼び出し元がDocumentを書き換えても影響しない）
+                cached = self.query_cache.get(cache_key, self._corpus_version)
+                if cached is not None:
+                    return copy.deepcopy(cached)
+                
+                # フィルター条件のマスクを先に積集合し、一致するドキュメントのみを採点する
+                # （削除済みのドキュメントはコンパクション前でも除外する）
+                shards = self._search_shards(microcontroller)
+                filters = {"category": category, "file_type": file_type, "source": source}
+                ranked = self._rank_documents(query, k, score_threshold, shards, filters, ranking)
+                
+                # 閾値0以下なら類似度0のドキュメントも追加順で含める
+                if score_threshold <= 0 and len(ranked) < k:
+                    ranked += self._zero_score_documents(shards, filters, ranked, k - len(ranked))
+                
+                # スコアを距離に変換（スコアが小さいほど類似度が高い）
+                results = [(shard.documents[doc_id], 1.0 - score) for shard, doc_id, score in ranked]
+                self.query_cache.put(cache_key, self._corpus_version, copy.deepcopy(results))
             
             logger.info(f"Found {len(results)} relevant documents for query: {query[:50]}...")
             return results
-            
+        
         except Exception as e:
             logger.error(f"Search failed: {e}")
             return []
@@ -218,9 +480,8 @@ class SimpleVectorDatabase:
     def list_collections(self) -> List[str]:
         """利用可能なコレクションを一覧表示"""
         microcontrollers = set()
-        for doc in self.documents:
-            mc = doc.metadata.get("microcontroller")
-            if mc:
+        for mc in self._microcontroller_counts():
+            if mc and mc != "unknown":
                 microcontrollers.add(f"microcontroller_{mc.lower().replace('-', '_')}")
         return list(microcontrollers)
     
@@ -229,8 +490,7 @@ class SimpleVectorDatabase:
         stats = {}
         
         if microcontroller:
-            count = sum(1 for doc in self.documents 
-                       if doc.metadata.get("microcontroller") == microcontroller)
+            count = self._microcontroller_counts().get(microcontroller, 0)
             collection_name = f"microcontroller_{microcontroller.lower().replace('-', '_')}"
             stats[collection_name] = {
                 "document_count": count,
@@ -238,10 +498,7 @@ class SimpleVectorDatabase:
             }
         else:
             # 全てのマイコンの統計
-            microcontroller_counts = Counter()
-            for doc in self.documents:
-                mc = doc.metadata.get("microcontroller", "unknown")
-                microcontroller_counts[mc] += 1
+            microcontroller_counts = self._microcontroller_counts()
             
             for mc, count in microcontroller_counts.items():
                 collection_name = f"microcontroller_{mc.lower().replace('-', '_')}"
@@ -252,48 +509,414 @@ class SimpleVectorDatabase:
         
         return stats
     
-    def _save_data(self):
-        """データを保存"""
+    def _find_document_ids(self,
+                           shard: IndexShard,
+                           filters: Dict[str, str] = None,
+                           chunk_ids: Set[str] = None) -> List[int]:
+        """シャード内でメタデータ条件に一致する有効ドキュメントのIDを取得"""
+        doc_ids = np.flatnonzero(shard.get_allowed_mask(filters or {}))
+        if chunk_ids is not None:
+            doc_ids = [doc_id for doc_id in doc_ids
+                       if shard.documents.get_metadata(doc_id).get("chunk_id") in chunk_ids]
+        return [int(doc_id) for doc_id in doc_ids]
+    
+    def delete_by_source(self, source: str) -> int:
+        """指定したソースファイル由来のチャンクを削除（削除件数を返す）"""
         try:
-            data = {
-                "documents": [(doc.page_content, doc.metadata) for doc in self.documents],
-                "tfidf_vectors": self.tfidf_vectors,
-                "vocabulary": list(self.vocabulary),
-                "idf_scores": self.idf_scores
-            }
+            with self._lock:
+                num_deleted = sum(
+                    self._tombstone_documents(shard, self._find_document_ids(shard, {"source": source}), write_header=False)
+                    for shard in list(self.shards.values())
+                )
+                if num_deleted:
+                    self._write_index_header()
+            self._maybe_start_compaction()
             
-            with open(os.path.join(self.persist_directory, "simple_vector_db.pkl"), "wb") as f:
-                pickle.dump(data, f)
+            logger.info(f"Deleted {num_deleted} documents from source: {source}")
+            return num_deleted
+        
+        except Exception as e:
+            logger.error(f"Failed to delete documents by source: {e}")
+            return 0
+    
+    def _delete_shard_documents(self, microcontroller: str) -> int:
+        """マイコンのシャード内の全チャンクを削除済みにする"""
+        with self._lock:
+            shard = self.shards.get(microcontroller)
+            if shard is None:
+                return 0
+            num_deleted = self._tombstone_documents(shard, self._find_document_ids(shard))
+        self._maybe_start_compaction()
+        return num_deleted
+    
+    def delete_by_microcontroller(self, microcontroller: str) -> int:
+        """指定したマイコンのチャンクを削除（削除件数を返す）"""
+        try:
+            num_deleted = self._delete_shard_documents(microcontroller)
+            logger.info(f"Deleted {num_deleted} documents for {microcontroller}")
+            return num_deleted
+        
+        except Exception as e:
+            logger.error(f"Failed to delete documents by microcontroller: {e}")
+            return 0
+    
+    def delete_collection(self, microcontroller: str) -> bool:
+        """指定されたマイコンのコレクションを削除（VectorDatabaseと同じインターフェース）"""
+        try:
+            self._delete_shard_documents(microcontroller)
+            collection_name = f"microcontroller_{microcontroller.lower().replace('-', '_')}"
+            logger.info(f"Deleted collection: {collection_name}")
+            return True
+        
+        except Exception as e:
+            logger.error(f"Failed to delete collection: {e}")
+            return False
+    
+    def replace_documents(self, documents: List[Document], microcontroller: str = "NUCLEO-F767ZI") -> bool:
+        """同じマイコン内でchunk_idが一致する既存チャンクを置き換える（該当がなければ追加）
+        
+        削除と追加は1回のヘッダ更新でまとめて反映されるため、途中で失敗しても
+        旧チャンクだけが消えることはない
+        """
+        try:
+            if not documents:
+                logger.warning("No documents to replace")
+                return False
             
-            logger.info("Data saved successfully")
+            for doc in documents:
+                doc.metadata["microcontroller"] = microcontroller
+            chunk_ids = {doc.metadata.get("chunk_id") for doc in documents if doc.metadata.get("chunk_id")}
+            
+            with self._lock:
+                shard = self._get_shard(microcontroller)
+                num_replaced = self._tombstone_documents(
+                    shard, self._find_document_ids(shard, chunk_ids=chunk_ids), write_header=False
+                )
+                self._append_documents(shard, documents)
+                self._save_data()
+            
+            self._maybe_start_compaction()
+            
+            logger.info(f"Replaced {num_replaced} documents with {len(documents)} documents for {microcontroller}")
+            return True
+        
+        except Exception as e:
+            logger.error(f"Failed to replace documents: {e}")
+            return False
+    
+    def update_document(self, document_id: str, new_content: str, new_metadata: Dict) -> bool:
+        """chunk_idで指定したドキュメントを更新（VectorDatabaseと同じインターフェース）"""
+        metadata = dict(new_metadata)
+        metadata["chunk_id"] = document_id
+        microcontroller = metadata.get("microcontroller")
+        if not microcontroller:
+            # マイコン未指定なら既存チャンクのあるシャードを探す
+            with self._lock:
+                microcontroller = next(
+                    (shard.name for shard in self.shards.values()
+                     if self._find_document_ids(shard, chunk_ids={document_id})),
+                    "NUCLEO-F767ZI"
+                )
+        
+        return self.replace_documents([Document(page_content=new_content, metadata=metadata)], microcontroller)
+    
+    def _microcontroller_counts(self) -> Counter:
+        """マイコン（シャード）別の有効ドキュメント数"""
+        return +Counter({name: shard.num_live() for name, shard in self.shards.items()})
+    
+    def _load_vocabulary(self) -> Dict[str, int]:
+        """語彙ファイルから保存済みの語彙を読み込み"""
+        vocabulary = {}
+        if self._persisted_vocab_size:
+            with open(os.path.join(self.index_directory, VOCABULARY_FILE), "rb") as f:
+                tokens = f.read(self._vocabulary_bytes).decode("utf-8").split("\n")
+            for token_id, token in enumerate(tokens[:self._persisted_vocab_size]):
+                vocabulary[token] = token_id
+        return vocabulary
+    
+    def _append_vocabulary_file(self):
+        """未保存の語彙を語彙ファイルに追記（ヘッダ未反映の書きかけ部分は切り捨て）"""
+        if self._vocabulary is None or len(self._vocabulary) == self._persisted_vocab_size:
+            return
+        
+        new_tokens = islice(self._vocabulary, self._persisted_vocab_size, None)
+        data = "".join(f"{token}\n" for token in new_tokens).encode("utf-8")
+        with open(os.path.join(self.index_directory, VOCABULARY_FILE), "ab") as f:
+            f.truncate(self._vocabulary_bytes)
+            f.write(data)
+        
+        self._vocabulary_bytes += len(data)
+        self._persisted_vocab_size = len(self._vocabulary)
+    
+    def _write_index_header(self):
+        """文書頻度とインデックスヘッダを一時ファイル経由で原子的に書き換え"""
+        self._generation += 1
+        if self._document_frequencies_file is None:
+            file_name = DOCUMENT_FREQUENCIES_FILE.format(generation=self._generation)
+            file_path = os.path.join(self.index_directory, file_name)
+            with open(file_path + ".tmp", "wb") as f:
+                np.save(f, self.document_frequencies)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(file_path + ".tmp", file_path)
+            self._document_frequencies_file = file_name
+        
+        header = {
+            "format_version": INDEX_FORMAT_VERSION,
+            "generation": self._generation,
+            "shards": {
+                name: {
+                    "segments": shard.segment_names,
+                    "num_docs": len(shard),
+                    "tombstones": {
+                        segment_name: sorted(local_ids)
+                        for segment_name, local_ids in shard.tombstones.items() if local_ids
+                    }
+                }
+                for name, shard in self.shards.items()
+            },
+            "num_docs": self.count_documents(),
+            "vocab_size": self._persisted_vocab_size,
+            "vocabulary_bytes": self._vocabulary_bytes,
+            "next_doc_seq": self._next_doc_seq,
+            "total_document_length": self._total_document_length,
+            "document_frequencies": self._document_frequencies_file
+        }
+        header_path = os.path.join(self.index_directory, INDEX_HEADER_FILE)
+        with open(header_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(header, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(header_path + ".tmp", header_path)
+        self._header_signature = self._stat_index_header()
+        
+        self._remove_unlisted_files()
+        
+        # キャッシュのトークンIDはヘッダに記録済みの語彙だけを参照させる（キャッシュの失敗は保存を妨げない）
+        try:
+            self.token_cache.flush()
+        except Exception as e:
+            logger.warning(f"Failed to write token cache: {e}")
+            self.token_cache.clear()
+    
+    def _remove_unlisted_files(self):
+        """ヘッダに載っていない書きかけ・コンパクション済みのセグメントと古い文書頻度ファイルを削除"""
+        listed = {segment_name for shard in self.shards.values() for segment_name in shard.segment_names}
+        for name in os.listdir(self.index_directory):
+            path = os.path.join(self.index_directory, name)
+            if name.startswith("segment_") and name not in listed:
+                # コンパクション中の統合セグメント（.tmpまたは切り替え前）は消さない
+                if self._compaction_lock.locked():
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+            elif name.startswith("document_frequencies_") and name != self._document_frequencies_file:
+                os.remove(path)
+    
+    def _next_segment_name(self) -> str:
+        """新しいセグメント名を払い出す（世代番号を進める）"""
+        self._generation += 1
+        return f"segment_{self._generation:06d}"
+    
+    def _save_data(self):
+        """データを保存（未保存分のみを新しいセグメントとして書き出し、ヘッダを切り替える）
+        
+        既存セグメントは書き換えないため、書き込みコストは追加分に比例する
+        """
+        try:
+            with self._lock:
+                pending_shards = [shard for shard in self.shards.values()
+                                  if shard.is_loaded and shard.documents.pending]
+                if not pending_shards:
+                    return
+                os.makedirs(self.index_directory, exist_ok=True)
+                
+                for shard in pending_shards:
+                    shard.write_pending_segment(self._next_segment_name(), len(self.document_frequencies))
+                self._append_vocabulary_file()
+                self._write_index_header()
             
+            logger.info("Data saved successfully")
+        
         except Exception as e:
             logger.error(f"Failed to save data: {e}")
     
+    def _tombstone_documents(self, shard: IndexShard, doc_ids: Iterable[int], write_header: bool = True) -> int:
+        """シャード内IDで指定したチャンクを削除済みにする（物理削除はコンパクション時）
+        
+        write_header=Falseの場合はヘッダを書き換えず、続く_save_data等でまとめて反映する
+        """
+        with self._lock:
+            # 未保存のチャンクは先にセグメントへ書き出してから削除済みにする
+            self._save_data()
+            
+            deleted = shard.tombstone(doc_ids)
+            if deleted:
+                self._corpus_version += 1
+                self._subtract_document_frequencies(deleted)
+                if write_header:
+                    self._write_index_header()
+        
+        return len(deleted)
+    
+    def _shards_needing_compaction(self) -> List[IndexShard]:
+        """セグメント数または削除済みチャンクの割合が閾値を超えているシャード"""
+        return [
+            shard for shard in self.shards.values()
+            if shard.needs_compaction(Config.SIMPLE_INDEX_MAX_SEGMENTS, Config.SIMPLE_INDEX_MAX_DELETED_RATIO)
+        ]
+    
+    def _maybe_start_compaction(self):
+        """必要ならバックグラウンドスレッドでコンパクションを開始"""
+        with self._lock:
+            if not self._shards_needing_compaction():
+                return
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return
+            self._compaction_thread = threading.Thread(
+                target=lambda: [self._compact_shard(shard) for shard in self._shards_needing_compaction()],
+                name="simple-index-compaction",
+                daemon=True
+            )
+            self._compaction_thread.start()
+    
+    def wait_for_compaction(self, timeout: float = None) -> bool:
+        """実行中のバックグラウンドコンパクションの完了を待つ"""
+        thread = self._compaction_thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+    
+    def _compact_shard(self, shard: IndexShard) -> bool:
+        """1つのシャードをコンパクション"""
+        with self._compaction_lock:
+            try:
+                shard.compact(self._next_segment_name, self._lock, self._write_index_header)
+                return True
+            except Exception as e:
+                logger.error(f"Compaction failed for shard {shard.name}: {e}")
+                return False
+    
+    def compact(self, microcontroller: str = None) -> bool:
+        """シャードのセグメントを統合し、トゥームストーン済みのチャンクを物理削除
+        
+        マイコン未指定の場合は全シャードが対象
+        """
+        shards = [self.shards[microcontroller]] if microcontroller in self.shards else list(self.shards.values())
+        return all([self._compact_shard(shard) for shard in shards])
+    
+    def _open_index(self):
+        """インデックスヘッダと文書頻度を読み込む（シャード・語彙・本文は遅延読み込み）"""
+        with open(os.path.join(self.index_directory, INDEX_HEADER_FILE), "r", encoding="utf-8") as f:
+            header = json.load(f)
+        
+        format_version = header.get("format_version")
+        if format_version == 1:
+            self._migrate_unsharded_index(header)
+            return
+        if format_version != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format version: {format_version}")
+        
+        self._generation = header["generation"]
+        self._persisted_vocab_size = header["vocab_size"]
+        self._vocabulary_bytes = header["vocabulary_bytes"]
+        self._next_doc_seq = header["next_doc_seq"]
+        self._total_document_length = header.get("total_document_length")
+        self._document_frequencies_file = header["document_frequencies"]
+        self.document_frequencies = np.load(os.path.join(self.index_directory, self._document_frequencies_file))
+        self._idf = None
+        
+        self.shards = {
+            name: IndexShard(name, self.index_directory, info["segments"], info.get("tombstones"), info["num_docs"],
+                             tokenize=self._tokenize)
+            for name, info in header["shards"].items()
+        }
+        self._remove_unlisted_files()
+    
+    def _ingest_documents(self, documents: List[Document]):
+        """移行用：元の順序を保ったままマイコン別のシャードに振り分けて取り込む"""
+        self.vocabulary = {}
+        self._persisted_vocab_size = 0
+        self._vocabulary_bytes = 0
+        self.token_cache.clear()
+        
+        groups = {}
+        for doc_seq, doc in enumerate(documents):
+            groups.setdefault(doc.metadata.get("microcontroller", "unknown"), []).append((doc_seq, doc))
+        for microcontroller, group in groups.items():
+            self._append_documents(
+                self._get_shard(microcontroller),
+                [doc for _, doc in group],
+                np.array([doc_seq for doc_seq, _ in group], dtype=np.int64)
+            )
+        self._save_data()
+    
+    def _migrate_unsharded_index(self, header: Dict):
+        """シャード導入前（format_version 1）のインデックスをシャード形式へ移行"""
+        documents = []
+        for name in header["segments"]:
+            segment = IndexSegment(os.path.join(self.index_directory, name))
+            deleted = set(header.get("tombstones", {}).get(name, ()))
+            documents.extend(segment.get_document(local_id) for local_id in range(len(segment)) if local_id not in deleted)
+            segment.close()
+        
+        self._generation = header["generation"]
+        self._ingest_documents(documents)
+        logger.info(f"Migrated {len(documents)} documents to {len(self.shards)} shards")
+    
+    def _load_legacy_pickle(self, data_file: str):
+        """旧形式（pickle）のデータを読み込み、セグメント形式へ移行（pickleは残す）"""
+        with open(data_file, "rb") as f:
+            data = pickle.load(f)
+        
+        # ドキュメント復元（TFは一度だけ再計算）
+        documents = [
+            Document(page_content=content, metadata=metadata)
+            for content, metadata in data.get("documents", [])
+        ]
+        if documents:
+            self._ingest_documents(documents)
+    
+    def _stat_index_header(self) -> Optional[Tuple[int, int]]:
+        """インデックスヘッダの（更新時刻, サイズ）（なければNone）"""
+        try:
+            stat = os.stat(os.path.join(self.index_directory, INDEX_HEADER_FILE))
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+    
+    def index_changed_on_disk(self) -> bool:
+        """最後に読み書きした後に、別プロセスがインデックスを書き換えたか"""
+        return self._stat_index_header() != self._header_signature
+    
     def _load_data(self):
         """データを読み込み"""
         try:
-            data_file = os.path.join(self.persist_directory, "simple_vector_db.pkl")
-            if os.path.exists(data_file):
-                with open(data_file, "rb") as f:
-                    data = pickle.load(f)
-                
-                # ドキュメント復元
-                self.documents = [
-                    Document(page_content=content, metadata=metadata)
-                    for content, metadata in data.get("documents", [])
-                ]
-                
-                self.tfidf_vectors = data.get("tfidf_vectors", [])
-                self.vocabulary = set(data.get("vocabulary", []))
-                self.idf_scores = data.get("idf_scores", {})
-                
-                logger.info(f"Loaded {len(self.documents)} documents from cache")
-            
+            # 読み込み中に別プロセスが書き換えた場合も検知できるよう、読み込む前に記録する
+            self._header_signature = self._stat_index_header()
+            legacy_file = os.path.join(self.persist_directory, LEGACY_PICKLE_FILE)
+            if os.path.exists(os.path.join(self.index_directory, INDEX_HEADER_FILE)):
+                self._open_index()
+                logger.info(f"Opened index with {self.count_documents()} documents in {len(self.shards)} shards")
+            elif os.path.exists(legacy_file):
+                self._load_legacy_pickle(legacy_file)
+                logger.info(f"Loaded {self.count_documents()} documents from cache")
+            else:
+                # ヘッダのないディレクトリに残ったキャッシュは別の語彙のトークンIDを指している
+                self.token_cache.clear()
+        
         except Exception as e:
             logger.warning(f"Failed to load existing data: {e}")
             # 新規データベースとして初期化
-            self.documents = []
-            self.tfidf_vectors = []
-            self.vocabulary = set()
-            self.idf_scores = {}
\ No newline at end of file
+            self.shards = {}
+            self.vocabulary = {}
+            self._persisted_vocab_size = 0
+            self._vocabulary_bytes = 0
+            self.token_cache.clear()
+            self._generation = 0
+            self._next_doc_seq = 0
+            self.document_frequencies = np.zeros(0, dtype=np.int64)
+            self._document_frequencies_file = None
+            self._idf = None
+            self._bm25_idf = None
+            self._total_document_length = 0
\ No newline at end of file
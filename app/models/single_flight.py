@@ -0,0 +1,126 @@
+"""
+同じリクエストの同時実行をまとめるシングルフライト
+同じキーの処理が実行中なら新たに実行せず、実行中の結果（通常の結果またはストリーミングの各イベント）を共有する
+"""
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, Hashable, Iterator, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class SharedStream:
+    """1つのイベント列を複数の購読者に配るストリーム
+    
+    専用のスレッドは持たず、まだ届いていないイベントを求めた購読者が元のイベント列を1つ進める。
+    途中から購読しても最初のイベントから受け取る。購読者が全員いなくなったら元のイベント列を閉じる
+    """
+    
+    def __init__(self, source: Iterator, on_finish: Callable[["SharedStream"], None]):
+        self._source = source
+        self._on_finish = on_finish
+        self._events = []
+        self._done = False
+        self._error = None
+        self.closed = False  # 購読者が全員途中でやめたため打ち切った
+        self._subscribers = 0
+        self._lock = threading.Lock()  # 元のイベント列を進める間と購読者数の更新で保持
+    
+    def _finish(self, error: Exception = None):
+        """元のイベント列の終了を記録（ロック保持中に呼ぶ、on_finishはロックの外で呼ぶ）"""
+        self._done = True
+        self._error = error
+    
+    def subscribe(self) -> Iterator:
+        """最初のイベントから順に返すイテレータ
+        
+        購読者数は読み始めたときに増やし、終了・中断時に減らす
+        （一度も読まずに捨てたイテレータは購読者に数えない）
+        """
+        with self._lock:
+            self._subscribers += 1
+        position = 0
+        try:
+            while True:
+                if position < len(self._events):
+                    yield self._events[position]
+                    position += 1
+                    continue
+                with self._lock:
+                    if position < len(self._events):
+                        continue
+                    just_finished = not self._done
+                    if just_finished:
+                        try:
+                            self._events.append(next(self._source))
+                            continue
+                        except StopIteration:
+                            self._finish()
+                        except Exception as e:
+                            self._finish(e)
+                if just_finished:
+                    self._on_finish(self)
+                if self._error is not None:
+                    raise self._error
+                return
+        finally:
+            with self._lock:
+                self._subscribers -= 1
+                abandoned = self._subscribers == 0 and not self._done
+                if abandoned:
+                    # 全員が途中でやめた場合は元のイベント列（API呼び出し）も打ち切る
+                    self._finish()
+                    self.closed = True
+                    self._source.close()
+            if abandoned:
+                self._on_finish(self)
+
+class SingleFlight:
+    """キーごとに実行中の処理を1つにまとめる"""
+    
+    def __init__(self):
+        self._calls = {}  # キー → 実行中の処理のFuture
+        self._streams = {}  # キー → 配信中のSharedStream
+        self._lock = threading.Lock()
+        self.stats = {"executions": 0, "shared": 0}
+    
+    def do(self, key: Hashable, function: Callable, *args) -> Tuple[object, bool]:
+        """function(*args)の結果と、実行中の結果を共有したかどうか"""
+        with self._lock:
+            future = self._calls.get(key)
+            shared = future is not None
+            if shared:
+                self.stats["shared"] += 1
+            else:
+                future = self._calls[key] = Future()
+                self.stats["executions"] += 1
+        if shared:
+            return future.result(), True
+        
+        try:
+            future.set_result(function(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result(), False
+    
+    def stream(self, key: Hashable, function: Callable[..., Iterator], *args) -> Iterator:
+        """function(*args)のイベント列（同じキーで配信中ならそれを最初から共有）"""
+        with self._lock:
+            shared_stream = self._streams.get(key)
+            if shared_stream is None or shared_stream.closed:
+                shared_stream = self._streams[key] = SharedStream(
+                    function(*args), lambda finished: self._end_stream(key, finished))
+                self.stats["executions"] += 1
+            else:
+                self.stats["shared"] += 1
+            return shared_stream.subscribe()
+    
+    def _end_stream(self, key: Hashable, finished: SharedStream):
+        """配信が終わったストリームを外す（以降の同じキーは新たに実行する）"""
+        with self._lock:
+            if self._streams.get(key) is finished:
+                del self._streams[key]
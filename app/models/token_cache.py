@@ -0,0 +1,126 @@
+"""
+チャンク本文のハッシュ → トークンID配列の永続キャッシュ
+同じ本文を再度取り込む場合（変更のないPDFの再取り込み等）にトークン化を省略する
+
+ファイル構成（インデックスディレクトリ内）:
+    token_cache.bin        トークンID配列（int32）を追記で連結したもの
+    token_cache_keys.bin   固定長レコード（本文ハッシュ16バイト, オフセット, トークン数）の追記ログ
+
+トークンIDは同じディレクトリの語彙に対するIDのため、語彙を作り直す場合はclear()で破棄する。
+書き込みは追記のみで、途中で中断された末尾のレコードは読み込み時に無視する
+"""
+import os
+import hashlib
+import logging
+from typing import Dict, Optional
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DATA_FILE = "token_cache.bin"
+KEYS_FILE = "token_cache_keys.bin"
+RECORD_DTYPE = np.dtype([("digest", "V16"), ("offset", "<i8"), ("count", "<i4")])
+
+class TokenCache:
+    """本文ハッシュ → トークンID配列のキャッシュ（初回アクセス時にキーを読み込む）"""
+    
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes  # トークンID配列の合計サイズの上限（超えたら破棄して作り直す）
+        self._entries = None  # 本文ハッシュ → (オフセット, トークン数)
+        self._pending = {}  # 未保存の本文ハッシュ → トークンID配列
+        self._data_size = 0
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def key(text: str) -> bytes:
+        """本文のハッシュ"""
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    
+    def _load(self):
+        """キーの追記ログを読み込む（データ末尾を超えるレコードは書きかけとして無視）"""
+        if self._entries is not None:
+            return
+        self._entries = {}
+        self._data_size = 0
+        data_path = os.path.join(self.directory, DATA_FILE)
+        keys_path = os.path.join(self.directory, KEYS_FILE)
+        if not os.path.exists(data_path) or not os.path.exists(keys_path):
+            return
+        
+        self._data_size = os.path.getsize(data_path)
+        num_records = os.path.getsize(keys_path) // RECORD_DTYPE.itemsize
+        records = np.fromfile(keys_path, dtype=RECORD_DTYPE, count=num_records)
+        records = records[records["offset"] + records["count"].astype(np.int64) * 4 <= self._data_size]
+        self._entries = dict(zip(records["digest"].tolist(),
+                                 zip(records["offset"].tolist(), records["count"].tolist())))
+    
+    def __len__(self) -> int:
+        self._load()
+        return len(self._entries) + len(self._pending)
+    
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        """キャッシュ済みのトークンID配列（なければNone）"""
+        self._load()
+        token_ids = self._pending.get(key)
+        if token_ids is None:
+            entry = self._entries.get(key)
+            if entry is not None:
+                offset, count = entry
+                with open(os.path.join(self.directory, DATA_FILE), "rb") as f:
+                    f.seek(offset)
+                    token_ids = np.frombuffer(f.read(count * 4), dtype=np.int32)
+        if token_ids is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return token_ids
+    
+    def put(self, key: bytes, token_ids: np.ndarray):
+        """トークンID配列を登録（flushまではメモリ上に保持）"""
+        self._pending[key] = token_ids
+    
+    def flush(self):
+        """未保存分をファイルに追記（語彙を保存した後に呼ぶこと）"""
+        if not self._pending:
+            return
+        self._load()
+        pending_bytes = sum(len(token_ids) for token_ids in self._pending.values()) * 4
+        if self._data_size + pending_bytes > self.max_bytes:
+            logger.info(f"Token cache exceeded {self.max_bytes} bytes, rebuilding")
+            self._remove_files()
+        
+        os.makedirs(self.directory, exist_ok=True)
+        records = np.zeros(len(self._pending), dtype=RECORD_DTYPE)
+        with open(os.path.join(self.directory, DATA_FILE), "ab") as f:
+            f.truncate(self._data_size)
+            for i, (key, token_ids) in enumerate(self._pending.items()):
+                records[i] = (key, self._data_size, len(token_ids))
+                self._entries[key] = (self._data_size, len(token_ids))
+                f.write(np.ascontiguousarray(token_ids, dtype=np.int32).tobytes())
+                self._data_size += len(token_ids) * 4
+        # キーはデータの後に書く（データ末尾を超えるキーは読み込み時に無視される）
+        with open(os.path.join(self.directory, KEYS_FILE), "ab") as f:
+            f.write(records.tobytes())
+        self._pending = {}
+    
+    def _remove_files(self):
+        """キャッシュファイルを削除"""
+        for name in (DATA_FILE, KEYS_FILE):
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path):
+                os.remove(path)
+        self._entries = {}
+        self._data_size = 0
+    
+    def clear(self):
+        """キャッシュを破棄（語彙を作り直す場合）"""
+        self._remove_files()
+        self._pending = {}
+    
+    def stats(self) -> Dict[str, int]:
+        """ヒット数・ミス数・登録数"""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self)}
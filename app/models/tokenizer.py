@@ -0,0 +1,71 @@
+"""
+TF-IDFインデックス用のトークナイザ
+プリコンパイル済みのパターンで1回走査し、語彙にインターンしたトークンIDを返す
+"""
+import re
+from itertools import chain
+from operator import add
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# 残す文字（英数字・ひらがな・カタカナ・漢字）の連続を1単語とする
+WORD_PATTERN = re.compile(r"[a-zA-Z0-9\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]+")
+# 英数字のみの単語はこの長さ以上のものだけをトークンにする
+MIN_ASCII_WORD_LENGTH = 3
+# 単語 → トークンID列キャッシュの上限（超えたら作り直す）
+MAX_CACHED_WORDS = 1 << 20
+
+def split_word(word: str) -> List[str]:
+    """1単語をトークンに分割（英数字はそのまま、日本語を含む単語は文字2-gram）"""
+    if word.isascii():
+        return [word] if len(word) >= MIN_ASCII_WORD_LENGTH else []
+    return list(map(add, word[:-1], word[1:]))
+
+def tokenize(text: str) -> List[str]:
+    """テキストをトークン化"""
+    tokens = []
+    append = tokens.append
+    extend = tokens.extend
+    for word in WORD_PATTERN.findall(text.lower()):
+        if word.isascii():
+            if len(word) >= MIN_ASCII_WORD_LENGTH:
+                append(word)
+        else:
+            extend(map(add, word[:-1], word[1:]))
+    return tokens
+
+class Tokenizer:
+    """語彙にインターンしたトークンIDを返すトークナイザ
+    
+    単語ごとのトークンID列をキャッシュするため、繰り返し出現する単語は
+    2-gram分割と語彙の参照を最初の1回しか行わない
+    """
+    
+    def __init__(self, vocabulary: Dict[str, int]):
+        self.vocabulary = vocabulary  # トークン → 語彙ID（未知語は追記される）
+        self._word_token_ids = {}  # 単語 → トークンID列
+    
+    def _intern_word(self, word: str) -> Tuple[int, ...]:
+        """単語のトークンを語彙に登録し、トークンID列をキャッシュ"""
+        vocabulary = self.vocabulary
+        token_ids = []
+        for token in split_word(word):
+            token_id = vocabulary.get(token)
+            if token_id is None:
+                token_id = vocabulary[token] = len(vocabulary)
+            token_ids.append(token_id)
+        
+        if len(self._word_token_ids) >= MAX_CACHED_WORDS:
+            self._word_token_ids = {}
+        token_ids = self._word_token_ids[word] = tuple(token_ids)
+        return token_ids
+    
+    def encode(self, text: str) -> np.ndarray:
+        """テキストを出現順のトークンID配列（int32）に変換（未知のトークンは語彙に追加）"""
+        words = WORD_PATTERN.findall(text.lower())
+        word_token_ids = list(map(self._word_token_ids.get, words))
+        if None in word_token_ids:
+            word_token_ids = [ids if ids is not None else self._intern_word(word)
+                              for word, ids in zip(words, word_token_ids)]
+        return np.fromiter(chain.from_iterable(word_token_ids), dtype=np.int32)
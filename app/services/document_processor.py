@@ -5,12 +5,14 @@ PDFやテキストファイルからテキストを抽出し、チャンク化
 import os
 import re
 import logging
-from typing import List, Dict, Optional
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from typing import Callable, List, Dict, Optional, Tuple, Iterable, Iterator
 from pathlib import Path
 
 import PyPDF2
 import pdfplumber
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 
 import os
@@ -18,55 +20,160 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config import Config
+from services.text_chunker import TextChunker, TextSpan
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# PDFのページ見出し（抽出したテキストでページの区切りを示す）
+PAGE_HEADER = "\n--- Page {page_num} ---\n"
+# テキストファイルをストリーミングで読む単位（文字数）
+TEXT_READ_BLOCK_CHARS = 64 * 1024
+# 文字化けの可能性がある文字（テキストのクリーニングで空白に置き換える）
+GARBLED_CHARS = re.compile(r'[^\w\s\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF\u3400-\u4DBF\u002D\u002E\u0028\u0029\u003A\u003B\u002C\u0021\u003F\u300C\u300D\u3001\u3002\u30FB\u002F\u005C\u0040\u0023\u0024\u0025\u005E\u0026\u002A\u002B\u003D\u007B\u007D\u005B\u005D\u007C\u003C\u003E\u007E\u0060\u0027\u0022]')
+
+def format_pages(pages: List[Tuple[int, str]]) -> str:
+    """（ページ番号, テキスト）をページ見出し付きで連結（テキストのないページは含めない）"""
+    text = ""
+    for page_num, page_text in pages:
+        if page_text:
+            text += PAGE_HEADER.format(page_num=page_num)
+            text += page_text
+    return text
+
+def count_pdf_pages(pdf_path: str) -> int:
+    """PDFのページ数（ワーカープロセスで実行）"""
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+def extract_pdf_page_range(pdf_path: str, start: int = 0, end: int = None) -> List[Tuple[int, str]]:
+    """pdfplumberでstart〜end-1ページ目（0始まり、endを省略したら最後まで）のテキストを抽出（ワーカープロセスでも実行）"""
+    pages = []
+    with pdfplumber.open(pdf_path) as pdf:
+        end = len(pdf.pages) if end is None else min(end, len(pdf.pages))
+        for page_num in range(start, end):
+            page = pdf.pages[page_num]
+            try:
+                pages.append((page_num + 1, page.extract_text()))
+            except Exception as e:
+                logger.warning(f"Page {page_num + 1} processing failed: {e}")
+            finally:
+                page.close()  # ページのキャッシュを解放
+    return pages
+
+def iter_pdf_pages(pdf_path: str) -> Iterator[Tuple[int, str]]:
+    """PDFのテキストを1ページずつ抽出（テキストのないページは含めない）
+    
+    抽出し終えたページのキャッシュはすぐに解放するため、ページ数が増えてもメモリ使用量は増えない。
+    pdfplumberで1ページもテキストが取れなければPyPDF2で抽出し直す（extract_text_from_pdfと同じ）
+    """
+    found = False
+    with pdfplumber.open(pdf_path) as pdf:
+        for page_num, page in enumerate(pdf.pages, 1):
+            try:
+                page_text = page.extract_text()
+            except Exception as e:
+                logger.warning(f"Page {page_num} processing failed: {e}")
+                continue
+            finally:
+                page.close()
+            if page_text:
+                found = True
+                yield page_num, page_text
+    if not found:
+        yield from iter_pypdf2_pages(pdf_path)
+
+def iter_pypdf2_pages(pdf_path: str) -> Iterator[Tuple[int, str]]:
+    """PyPDF2でPDFのテキストを1ページずつ抽出（pdfplumberでテキストが取れない場合のフォールバック）"""
+    with open(pdf_path, 'rb') as file:
+        for page_num, page in enumerate(PyPDF2.PdfReader(file).pages, 1):
+            try:
+                page_text = page.extract_text()
+            except Exception as e:
+                logger.warning(f"Page {page_num} processing failed: {e}")
+                continue
+            if page_text:
+                yield page_num, page_text
+
 class DocumentProcessor:
     """ドキュメント処理クラス"""
     
     def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
+        self.text_splitter = TextChunker(
             chunk_size=Config.CHUNK_SIZE,
             chunk_overlap=Config.CHUNK_OVERLAP,
-            length_function=len,
             separators=["\n\n", "\n", "。", ".", " ", ""]
         )
     
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         """PDFからテキストを抽出"""
         try:
-            text = ""
-            
             # pdfplumberを使用（表やレイアウトを考慮）
-            with pdfplumber.open(pdf_path) as pdf:
-                for page_num, page in enumerate(pdf.pages):
+            text = format_pages(extract_pdf_page_range(pdf_path))
+            return self._finish_pdf_text(pdf_path, text)
+        
+        except Exception as e:
+            logger.error(f"PDF processing failed for {pdf_path}: {e}")
+            return ""
+    
+    def _finish_pdf_text(self, pdf_path: str, text: str) -> str:
+        """pdfplumberで抽出したテキストの仕上げ（空ならPyPDF2で抽出し直す）"""
+        # フォールバック: PyPDF2を使用
+        if not text.strip():
+            with open(pdf_path, 'rb') as file:
+                pdf_reader = PyPDF2.PdfReader(file)
+                for page_num, page in enumerate(pdf_reader.pages):
                     try:
                         page_text = page.extract_text()
                         if page_text:
-                            text += f"\n--- Page {page_num + 1} ---\n"
+                            text += PAGE_HEADER.format(page_num=page_num + 1)
                             text += page_text
                     except Exception as e:
                         logger.warning(f"Page {page_num + 1} processing failed: {e}")
-                        
-            # フォールバック: PyPDF2を使用
-            if not text.strip():
-                with open(pdf_path, 'rb') as file:
-                    pdf_reader = PyPDF2.PdfReader(file)
-                    for page_num, page in enumerate(pdf_reader.pages):
-                        try:
-                            page_text = page.extract_text()
-                            if page_text:
-                                text += f"\n--- Page {page_num + 1} ---\n"
-                                text += page_text
-                        except Exception as e:
-                            logger.warning(f"Page {page_num + 1} processing failed: {e}")
+        
+        return self._clean_text(text)
+    
+    def extract_texts_parallel(self, file_paths: List[str], workers: int) -> List[str]:
+        """複数ファイルのテキストをプロセスプールで抽出（結果はfile_pathsの順、失敗したファイルは空文字）
+        
+        PDFはPDF_PAGES_PER_TASKページずつのタスクに分けるため、大きなPDFも複数のワーカーで処理する。
+        ページ範囲の結果はページ順に連結するので、extract_text_from_fileと同じテキストになる
+        """
+        texts = [""] * len(file_paths)
+        pdf_indices = []
+        for i, path in enumerate(file_paths):
+            if Path(path).suffix.lower() == '.pdf':
+                pdf_indices.append(i)
+            else:
+                texts[i] = self.extract_text_from_file(path)
+        if not pdf_indices:
+            return texts
+        
+        pages_per_task = Config.PDF_PAGES_PER_TASK
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # 1. ページ数を数えてページ範囲のタスクに分割
+            page_counts = {}
+            for i, future in [(i, executor.submit(count_pdf_pages, file_paths[i])) for i in pdf_indices]:
+                try:
+                    page_counts[i] = future.result()
+                except Exception as e:
+                    logger.error(f"PDF processing failed for {file_paths[i]}: {e}")
             
-            return self._clean_text(text)
+            range_futures = {
+                i: [executor.submit(extract_pdf_page_range, file_paths[i], start, start + pages_per_task)
+                    for start in range(0, page_count, pages_per_task)]
+                for i, page_count in page_counts.items()
+            }
             
-        except Exception as e:
-            logger.error(f"PDF processing failed for {pdf_path}: {e}")
-            return ""
+            # 2. ファイルごとにページ範囲の順に組み立てる
+            for i, futures in range_futures.items():
+                try:
+                    pages = [page for future in futures for page in future.result()]
+                    texts[i] = self._finish_pdf_text(file_paths[i], format_pages(pages))
+                except Exception as e:
+                    logger.error(f"PDF processing failed for {file_paths[i]}: {e}")
+        
+        return texts
     
     def extract_text_from_file(self, file_path: str) -> str:
         """ファイルからテキストを抽出"""
@@ -85,84 +192,278 @@ class DocumentProcessor:
             logger.error(f"File processing failed for {file_path}: {e}")
             return ""
     
-    def _clean_text(self, text: str) -> str:
-        """テキストのクリーニング"""
-        if not text:
-            return ""
+    def iter_text_pieces(self, file_paths: List[str], workers: int = None,
+                         on_error: Callable[[str, Exception], None] = None) -> Iterator[Tuple[int, str, str]]:
+        """ファイルのテキストを少しずつ抽出（ファイルの番号, パス, テキスト片）
         
+        PDFはページ見出し付きの1ページずつ、テキストファイルはTEXT_READ_BLOCK_CHARS文字ずつ返す。
+        ファイルごとに連結するとextract_text_from_fileのクリーニング前のテキストになる。
+        workers（省略時はConfig.INGESTION_WORKERS、0ならCPU数）が2以上なら、PDFのページ抽出を
+        プロセスプールで並列に行う（返すテキスト片は逐次処理と同じ）。
+        抽出に失敗したファイルは（途中までのテキスト片を返していても）ログに出してon_error(パス, 例外)を呼び、
+        次のファイルに進む
+        """
+        workers = workers if workers is not None else Config.INGESTION_WORKERS
+        workers = workers or os.cpu_count() or 1
+        if workers > 1 and any(Path(path).suffix.lower() == '.pdf' for path in file_paths):
+            yield from self._iter_text_pieces_parallel(file_paths, workers, on_error)
+            return
+        for index, file_path in enumerate(file_paths):
+            yield from self._iter_file_pieces(index, file_path, on_error)
+    
+    def _report_error(self, file_path: str, error: Exception, on_error: Callable[[str, Exception], None] = None):
+        """ファイルの処理の失敗をログに出し、on_errorに知らせる"""
+        logger.error(f"File processing failed for {file_path}: {error}")
+        if on_error is not None:
+            on_error(file_path, error)
+    
+    def _iter_file_pieces(self, index: int, file_path: str,
+                          on_error: Callable[[str, Exception], None] = None) -> Iterator[Tuple[int, str, str]]:
+        """1ファイルのテキスト片を逐次に抽出"""
+        file_extension = Path(file_path).suffix.lower()
+        try:
+            if file_extension == '.pdf':
+                for page_num, page_text in iter_pdf_pages(file_path):
+                    yield index, file_path, PAGE_HEADER.format(page_num=page_num) + page_text
+            elif file_extension in ['.txt', '.md']:
+                with open(file_path, 'r', encoding='utf-8') as file:
+                    for block in iter(lambda: file.read(TEXT_READ_BLOCK_CHARS), ""):
+                        yield index, file_path, block
+            else:
+                logger.warning(f"Unsupported file type: {file_extension}")
+        except Exception as e:
+            self._report_error(file_path, e, on_error)
+    
+    def _iter_text_pieces_parallel(self, file_paths: List[str], workers: int,
+                                   on_error: Callable[[str, Exception], None] = None) -> Iterator[Tuple[int, str, str]]:
+        """PDFをPDF_PAGES_PER_TASKページずつのタスクに分けてプロセスプールで抽出し、ファイル・ページ順に返す
+        
+        投入済みで未読のタスクはworkersの2倍までにするため、大きなPDFでもメモリ使用量は増えない。
+        テキストファイルは順番が来たら逐次に読む
+        """
+        pages_per_task = Config.PDF_PAGES_PER_TASK
+        executor = ProcessPoolExecutor(max_workers=workers)
+        
+        def tasks():
+            """（ファイルの番号, パス, ページ範囲のFuture, ファイルの最後のタスクか）を投入しながら順に返す"""
+            for index, file_path in enumerate(file_paths):
+                if Path(file_path).suffix.lower() != '.pdf':
+                    yield index, file_path, None, True
+                    continue
+                try:
+                    page_count = executor.submit(count_pdf_pages, file_path).result()
+                except Exception as e:
+                    self._report_error(file_path, e, on_error)
+                    continue
+                starts = range(0, page_count, pages_per_task)
+                for start in starts:
+                    future = executor.submit(extract_pdf_page_range, file_path, start, start + pages_per_task)
+                    yield index, file_path, future, start == starts[-1]
+        
+        found = set()  # テキストが取れたPDFの番号
+        failed = set()  # 抽出に失敗したPDFの番号
+        
+        def pieces(index, file_path, future, last):
+            if future is None:
+                yield from self._iter_file_pieces(index, file_path, on_error)
+                return
+            if index in failed:
+                future.cancel()
+                return
+            try:
+                for page_num, page_text in future.result():
+                    if page_text:
+                        found.add(index)
+                        yield index, file_path, PAGE_HEADER.format(page_num=page_num) + page_text
+                # pdfplumberで1ページもテキストが取れなければPyPDF2で抽出し直す（iter_pdf_pagesと同じ）
+                if last and index not in found:
+                    for page_num, page_text in iter_pypdf2_pages(file_path):
+                        yield index, file_path, PAGE_HEADER.format(page_num=page_num) + page_text
+            except Exception as e:
+                failed.add(index)
+                self._report_error(file_path, e, on_error)
+        
+        try:
+            pending = deque()
+            for task in tasks():
+                pending.append(task)
+                if len(pending) >= workers * 2:
+                    yield from pieces(*pending.popleft())
+            while pending:
+                yield from pieces(*pending.popleft())
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+    
+    def iter_clean_text(self, pieces: Iterable[str]) -> Iterator[str]:
+        """テキスト片を順にクリーニング（連結すると全体を_clean_textしたものと同じになる）
+        
+        空白・改行の連続をまとめる置換が片の境界をまたがないよう、末尾の空白類は次の片に持ち越す
+        """
+        carry = ""  # 次の片の先頭に付けるクリーニング前の空白類
+        pending = ""  # 続きに空白以外が現れたら出力するクリーニング済みの空白類
+        started = False
+        for piece in pieces:
+            text = carry + piece
+            head_end = len(text.rstrip())
+            head, carry = text[:head_end], text[head_end:]
+            if not head:
+                continue
+            cleaned = self._normalize_text(head)
+            if not started:
+                cleaned = cleaned.lstrip()
+                if not cleaned:
+                    continue
+                started = True
+            body = cleaned.rstrip()
+            if body:
+                yield pending + body
+                pending = cleaned[len(body):]
+            else:
+                pending += cleaned
+    
+    def iter_split_text(self, pieces: Iterable[str]) -> Iterator[Tuple[TextSpan, str]]:
+        """クリーニング済みのテキスト片を順にチャンク化（位置, チャンク）
+        
+        連結したテキストをtext_splitterで一括して分割した場合と同じチャンクになる
+        """
+        return self.text_splitter.iter_chunks(pieces)
+    
+    def _file_metadata(self, file_path: str, microcontroller: str) -> Dict:
+        """ファイル単位のメタデータ"""
+        metadata = {
+            "source": file_path,
+            "filename": os.path.basename(file_path),
+            "microcontroller": microcontroller,
+            "file_type": Path(file_path).suffix.lower()
+        }
+        
+        # ファイルタイプ別の追加メタデータ
+        if "nucleo" in file_path.lower():
+            metadata["category"] = "hardware"
+        elif "cubemx" in file_path.lower():
+            metadata["category"] = "software_tool"
+        elif any(app_note in file_path.lower() for app_note in ["an", "application_note"]):
+            metadata["category"] = "application_note"
+        elif "user_manual" in file_path.lower() or "um" in file_path.lower():
+            metadata["category"] = "user_manual"
+        elif "technical_note" in file_path.lower() or "tn" in file_path.lower():
+            metadata["category"] = "technical_note"
+        else:
+            metadata["category"] = "general"
+        return metadata
+    
+    def _chunk_metadata(self, metadata: Dict, file_path: str, index: int, span: TextSpan) -> Dict:
+        """チャンクのメタデータ（ファイル単位のメタデータ＋チャンクの番号・位置・ページ）"""
+        chunk_metadata = metadata.copy()
+        chunk_metadata.update({
+            "chunk_index": index,
+            "chunk_id": f"{os.path.basename(file_path)}_{index}",
+            "start_index": span.start
+        })
+        if span.page is not None:
+            chunk_metadata["page"] = span.page
+            chunk_metadata["page_end"] = span.page_end
+        return chunk_metadata
+    
+    def _normalize_text(self, text: str) -> str:
+        """テキストのクリーニング（前後の空白は残す）
+        
+        空白・改行の正規化はstr.replace（部分文字列の置換）で行い、正規表現は
+        文字化けの可能性がある文字の除去の1回だけ走らせる
+        """
         # 改行の正規化
-        text = re.sub(r'\r\n|\r', '\n', text)
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
         
         # 余分な空白の削除
-        text = re.sub(r' +', ' ', text)
+        while '  ' in text:
+            text = text.replace('  ', ' ')
         
         # 余分な改行の削除（3つ以上の連続改行を2つに）
-        text = re.sub(r'\n{3,}', '\n\n', text)
+        while '\n\n\n' in text:
+            text = text.replace('\n\n\n', '\n\n')
         
         # 文字化けの可能性がある文字の除去
-        text = re.sub(r'[^\w\s\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF\u3400-\u4DBF\u002D\u002E\u0028\u0029\u003A\u003B\u002C\u0021\u003F\u300C\u300D\u3001\u3002\u30FB\u002F\u005C\u0040\u0023\u0024\u0025\u005E\u0026\u002A\u002B\u003D\u007B\u007D\u005B\u005D\u007C\u003C\u003E\u007E\u0060\u0027\u0022]', ' ', text)
-        
-        return text.strip()
+        return GARBLED_CHARS.sub(' ', text)
+    
+    def _clean_text(self, text: str) -> str:
+        """テキストのクリーニング"""
+        if not text:
+            return ""
+        return self._normalize_text(text).strip()
     
-    def create_documents(self, file_paths: List[str], microcontroller: str = "NUCLEO-F767ZI") -> List[Document]:
-        """ファイルリストからDocumentオブジェクトを作成"""
+    def create_documents(self, file_paths: List[str], microcontroller: str = "NUCLEO-F767ZI",
+                         workers: int = None) -> List[Document]:
+        """ファイルリストからDocumentオブジェクトを作成
+        
+        workers（省略時はConfig.INGESTION_WORKERS、0ならCPU数）が2以上なら
+        テキスト抽出をプロセスプールで並列に行う。作成されるDocumentは逐次処理と同じ
+        """
         documents = []
+        workers = workers if workers is not None else Config.INGESTION_WORKERS
+        workers = workers or os.cpu_count() or 1
+        texts = self.extract_texts_parallel(file_paths, workers) if workers > 1 and file_paths else None
         
-        for file_path in file_paths:
+        for index, file_path in enumerate(file_paths):
             try:
-                text = self.extract_text_from_file(file_path)
+                text = texts[index] if texts is not None else self.extract_text_from_file(file_path)
                 if not text:
                     continue
                 
                 # ファイル情報をメタデータに追加
-                metadata = {
-                    "source": file_path,
-                    "filename": os.path.basename(file_path),
-                    "microcontroller": microcontroller,
-                    "file_type": Path(file_path).suffix.lower(),
-                    "char_count": len(text)
-                }
+                metadata = self._file_metadata(file_path, microcontroller)
+                metadata["char_count"] = len(text)
                 
-                # ファイルタイプ別の追加メタデータ
-                if "nucleo" in file_path.lower():
-                    metadata["category"] = "hardware"
-                elif "cubemx" in file_path.lower():
-                    metadata["category"] = "software_tool"
-                elif any(app_note in file_path.lower() for app_note in ["an", "application_note"]):
-                    metadata["category"] = "application_note"
-                elif "user_manual" in file_path.lower() or "um" in file_path.lower():
-                    metadata["category"] = "user_manual"
-                elif "technical_note" in file_path.lower() or "tn" in file_path.lower():
-                    metadata["category"] = "technical_note"
-                else:
-                    metadata["category"] = "general"
-                
-                # テキストをチャンクに分割
-                chunks = self.text_splitter.split_text(text)
+                # テキストをチャンクに分割（位置だけを求め、Documentを作る時に切り出す）
+                spans = self.text_splitter.split_spans(text)
                 
                 # 各チャンクをDocumentオブジェクトに変換
-                for i, chunk in enumerate(chunks):
-                    if chunk.strip():  # 空でないチャンクのみ追加
-                        chunk_metadata = metadata.copy()
-                        chunk_metadata.update({
-                            "chunk_index": i,
-                            "chunk_id": f"{os.path.basename(file_path)}_{i}"
-                        })
-                        
-                        documents.append(Document(
-                            page_content=chunk,
-                            metadata=chunk_metadata
-                        ))
-                
-                logger.info(f"Processed {file_path}: {len(chunks)} chunks created")
+                for i, span in enumerate(spans):
+                    documents.append(Document(
+                        page_content=text[span.start:span.end],
+                        metadata=self._chunk_metadata(metadata, file_path, i, span)
+                    ))
                 
+                logger.info(f"Processed {file_path}: {len(spans)} chunks created")
+            
             except Exception as e:
                 logger.error(f"Error processing {file_path}: {e}")
         
         logger.info(f"Total documents created: {len(documents)}")
         return documents
     
-    def process_directory(self, directory_path: str, microcontroller: str = "NUCLEO-F767ZI") -> List[Document]:
+    def iter_documents(self, file_paths: List[str], microcontroller: str = "NUCLEO-F767ZI",
+                       workers: int = None) -> Iterator[Document]:
+        """ファイルリストからDocumentを1つずつ作成（ページ抽出 → クリーニング → チャンク化を少しずつ進める）
+        
+        ファイル全体のテキストを保持しないため、メモリ使用量は文書の大きさによらない
+        """
+        return self.documents_from_pieces(self.iter_text_pieces(file_paths, workers), microcontroller)
+    
+    def documents_from_pieces(self, pieces: Iterable[Tuple[int, str, str]],
+                              microcontroller: str = "NUCLEO-F767ZI",
+                              on_error: Callable[[str, Exception], None] = None) -> Iterator[Document]:
+        """iter_text_piecesのテキスト片からDocumentを1つずつ作成
+        
+        メタデータはcreate_documentsと同じ（ファイル全体の文字数char_countは付けない）。
+        チャンク化に失敗したファイルはon_error(パス, 例外)を呼んで次のファイルに進む
+        """
+        for (index, file_path), file_pieces in groupby(pieces, key=lambda item: item[:2]):
+            metadata = self._file_metadata(file_path, microcontroller)
+            chunk_count = 0
+            try:
+                texts = self.iter_clean_text(piece for _, _, piece in file_pieces)
+                for i, (span, chunk) in enumerate(self.iter_split_text(texts)):
+                    chunk_count = i + 1
+                    yield Document(page_content=chunk, metadata=self._chunk_metadata(metadata, file_path, i, span))
+            except Exception as e:
+                logger.error(f"Error processing {file_path}: {e}")
+                if on_error is not None:
+                    on_error(file_path, e)
+            logger.info(f"Processed {file_path}: {chunk_count} chunks created")
+    
+    def process_directory(self, directory_path: str, microcontroller: str = "NUCLEO-F767ZI",
+                          workers: int = None) -> List[Document]:
         """ディレクトリ内のサポートされているファイルをすべて処理"""
         file_paths = []
         
@@ -172,7 +473,7 @@ class DocumentProcessor:
                     file_paths.append(os.path.join(root, file))
         
         logger.info(f"Found {len(file_paths)} supported files in {directory_path}")
-        return self.create_documents(file_paths, microcontroller)
+        return self.create_documents(file_paths, microcontroller, workers)
     
     def get_document_summary(self, documents: List[Document]) -> Dict:
         """ドキュメントの要約統計を取得"""
@@ -0,0 +1,163 @@
+"""
+取り込みマニフェスト（差分の再取り込み）
+取り込んだファイルごとにパス・サイズ・更新時刻・ハッシュ・チャンクIDを記録し、
+再実行時は変更のないファイルを飛ばし、変更されたファイルのチャンクを置き換え、
+削除されたファイルのチャンクを消す
+"""
+import os
+import json
+import logging
+from typing import Callable, Dict, List
+
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.schema import Document
+
+from services.document_processor import DocumentProcessor
+from services.ingestion_pipeline import ingest_files
+from utils.helpers import calculate_file_hash
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MANIFEST_FORMAT_VERSION = 1
+# インデックスのディレクトリに置く（インデックスを消せばマニフェストも消える）
+MANIFEST_FILE = "ingestion_manifest.json"
+
+class IngestionManifest:
+    """取り込み済みファイルの記録（絶対パス → サイズ・更新時刻・ハッシュ・チャンクID）"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = self._load()
+    
+    @classmethod
+    def for_index(cls, vector_db) -> "IngestionManifest":
+        """ベクトルDBのインデックスに対応するマニフェスト"""
+        return cls(os.path.join(vector_db.index_directory, MANIFEST_FILE))
+    
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("format_version") != MANIFEST_FORMAT_VERSION:
+                logger.warning(f"Unsupported manifest format, ignoring: {self.path}")
+                return {}
+            return data["files"]
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Failed to load ingestion manifest, ignoring: {e}")
+            return {}
+    
+    def save(self):
+        """一時ファイル経由で原子的に書き換え"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"format_version": MANIFEST_FORMAT_VERSION, "files": self.entries}, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+
+def _is_deleted(path: str) -> bool:
+    """ファイルが削除されたか（ディレクトリごと見えない場合は共有フォルダの未接続などとみなし、削除扱いしない）"""
+    return not os.path.exists(path) and os.path.isdir(os.path.dirname(path))
+
+def _is_unchanged(entry: Dict, file_path: str, stat: os.stat_result) -> bool:
+    """記録と同じ内容か（サイズ・更新時刻が同じならハッシュは計算しない）"""
+    if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return True
+    if entry["size"] != stat.st_size:
+        return False
+    # 更新時刻だけ変わった（コピー・touchなど）場合は内容を比べる
+    if calculate_file_hash(file_path) != entry["hash"]:
+        return False
+    entry["mtime_ns"] = stat.st_mtime_ns
+    return True
+
+def sync_files(vector_db, file_paths: List[str], microcontroller: str = "NUCLEO-F767ZI",
+               processor: DocumentProcessor = None, manifest: IngestionManifest = None,
+               on_document: Callable[[Document], None] = None, force: bool = False,
+               workers: int = None) -> Dict[str, int]:
+    """マニフェストと比べて新規・変更されたファイルだけを取り込み、削除されたファイルのチャンクを消す
+    
+    file_paths以外に記録されているファイルは、ディスクから消えていなければそのまま残す
+    （複数のスクリプトが同じインデックスに別々のファイルを取り込むため）。
+    取り込み前にマニフェストから外して保存し、抽出・チャンク化・登録のどこかで失敗したファイルは
+    記録しないため、次回に取り込み直す。パスは絶対パスにそろえて記録・登録する（チャンクのsource）。
+    forceなら記録によらず全ファイルを取り込み直す。workersはingest_filesに渡す。件数の集計を返す
+    """
+    manifest = manifest or IngestionManifest.for_index(vector_db)
+    summary = {"new": 0, "changed": 0, "unchanged": 0, "removed": 0, "failed": 0, "chunks": 0, "deleted_chunks": 0}
+    entries = manifest.entries
+    
+    # 1. ディスクから消えたファイル・変更されたファイルを調べる
+    stale_sources = [entries.pop(key)["source"] for key in list(entries) if _is_deleted(key)]
+    summary["removed"] = len(stale_sources)
+    pending = []  # (絶対パス, 渡されたパス, 取り込み前のstat, ハッシュ)
+    seen = set()
+    for file_path in file_paths:
+        key = os.path.abspath(file_path)
+        if key in seen:
+            continue
+        seen.add(key)
+        try:
+            stat = os.stat(file_path)
+        except OSError as e:
+            logger.warning(f"Skipping unreadable file {file_path}: {e}")
+            continue
+        entry = entries.get(key)
+        if entry is not None and not force and entry["microcontroller"] == microcontroller \
+                and _is_unchanged(entry, file_path, stat):
+            summary["unchanged"] += 1
+            continue
+        if entry is not None:
+            stale_sources.append(entries.pop(key)["source"])
+            summary["changed"] += 1
+        else:
+            summary["new"] += 1
+        pending.append((key, file_path, stat, calculate_file_hash(file_path)))
+    manifest.save()
+    
+    # 2. 古いチャンクを消す（新規ファイルも、マニフェスト導入前に取り込んだ分や途中で失敗した分を消す。
+    #    以前に相対パスで取り込んだチャンクも消すため、渡されたパスでも消す）
+    pending_sources = [source for key, file_path, _, _ in pending for source in (key, file_path)]
+    for source in dict.fromkeys(stale_sources + pending_sources):
+        summary["deleted_chunks"] += vector_db.delete_by_source(source)
+    
+    # 3. 新規・変更されたファイルを取り込み、成功したファイルだけ記録する
+    if pending:
+        chunk_ids = {key: [] for key, _, _, _ in pending}
+        failed = set()
+        
+        def record_error(source: str, error: Exception):
+            failed.add(source)
+        
+        def record_batch(batch: List[Document], success: bool):
+            for document in batch:
+                source = document.metadata["source"]
+                if success:
+                    chunk_ids[source].append(document.metadata["chunk_id"])
+                else:
+                    failed.add(source)
+        
+        summary["chunks"] = ingest_files(vector_db, [key for key, _, _, _ in pending], microcontroller,
+                                         processor=processor, on_document=on_document, on_batch=record_batch,
+                                         workers=workers, on_error=record_error)
+        for key, file_path, stat, file_hash in pending:
+            if key in failed:
+                summary["failed"] += 1
+                continue
+            entries[key] = {
+                "source": key,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "hash": file_hash,
+                "microcontroller": microcontroller,
+                "chunk_ids": chunk_ids[key]
+            }
+        manifest.save()
+    
+    logger.info(f"Ingestion sync: {summary}")
+    return summary
@@ -0,0 +1,131 @@
+"""
+ストリーミング取り込みパイプライン
+ページ抽出 → クリーニング・チャンク化 → トークン化・索引登録 の各段を別スレッドで動かし、
+段の間を上限付きキューでつなぐ。ファイル全体のテキストやチャンク一覧を保持しないため、
+ピークメモリは文書の大きさによらず、キューの長さとページ・バッチの大きさで決まる
+"""
+import queue
+import logging
+import threading
+from typing import Callable, Iterable, Iterator, List
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.schema import Document
+
+from config import Config
+from services.document_processor import DocumentProcessor
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_ITEM, _DONE, _ERROR = range(3)
+
+class BoundedStage:
+    """イテレータを別スレッドで回し、結果を上限付きキューで次の段に渡す
+    
+    キューが満杯の間は上流が待つ（背圧）。上流の例外は下流で再送出し、
+    下流が途中でやめたら（close）上流のイテレータも閉じる。closeは別のスレッドから呼んでもよく、
+    キューを待っている下流のイテレーションも終わる
+    """
+    
+    def __init__(self, iterable: Iterable, maxsize: int, name: str = None):
+        self._queue = queue.Queue(maxsize)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(iterable,), name=name, daemon=True)
+        self._thread.start()
+    
+    def _put(self, kind: int, payload) -> bool:
+        """キューに入れる（closeされたらFalse）"""
+        while not self._stopped.is_set():
+            try:
+                self._queue.put((kind, payload), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _run(self, iterable: Iterable):
+        try:
+            for item in iterable:
+                if not self._put(_ITEM, item):
+                    break
+            else:
+                self._put(_DONE, None)
+        except BaseException as e:
+            self._put(_ERROR, e)
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()
+    
+    def __iter__(self) -> Iterator:
+        try:
+            # 上流が止まったまま（要素を出さないまま）closeされても待ち続けないよう、時間を区切って待つ
+            while not self._stopped.is_set():
+                try:
+                    kind, payload = self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if kind == _DONE:
+                    return
+                if kind == _ERROR:
+                    raise payload
+                yield payload
+        finally:
+            self.close()
+    
+    def close(self):
+        """上流を止める（キューに残った要素は捨てる）"""
+        self._stopped.set()
+
+def ingest_files(vector_db, file_paths: List[str], microcontroller: str = "NUCLEO-F767ZI",
+                 processor: DocumentProcessor = None, batch_size: int = None, queue_size: int = None,
+                 on_document: Callable[[Document], None] = None,
+                 on_batch: Callable[[List[Document], bool], None] = None, workers: int = None,
+                 on_error: Callable[[str, Exception], None] = None) -> int:
+    """ファイルをストリーミングで取り込み、登録したチャンク数を返す
+    
+    抽出スレッドがページ（テキスト片）を、チャンク化スレッドがDocumentをそれぞれ上限付きキューに流し、
+    呼び出し元のスレッドがbatch_size件ずつvector_db.add_documents（トークン化・索引登録）する。
+    on_documentは登録前の各Document（メタデータの上書きなど）に、on_batchは登録したバッチと
+    その成否に対して呼び出す。workers（省略時はConfig.INGESTION_WORKERS）が2以上なら、
+    抽出スレッドはPDFのページ抽出をプロセスプールで並列に行う。
+    on_errorは抽出・チャンク化に失敗したファイルのパスと例外に対して（抽出・チャンク化のスレッドで）呼び出す
+    """
+    processor = processor or DocumentProcessor()
+    batch_size = batch_size or Config.INGESTION_BATCH_SIZE
+    queue_size = queue_size or Config.INGESTION_QUEUE_SIZE
+    
+    pieces = BoundedStage(processor.iter_text_pieces(file_paths, workers, on_error), queue_size, "ingest-extract")
+    documents = BoundedStage(processor.documents_from_pieces(pieces, microcontroller, on_error), queue_size, "ingest-chunk")
+    added = 0
+    
+    def add_batch(batch: List[Document]) -> int:
+        success = vector_db.add_documents(batch, microcontroller)
+        if on_batch is not None:
+            on_batch(batch, success)
+        if success:
+            return len(batch)
+        logger.error(f"Failed to index {len(batch)} chunks from {batch[0].metadata.get('source')}")
+        return 0
+    
+    try:
+        batch = []
+        for document in documents:
+            if on_document is not None:
+                on_document(document)
+            batch.append(document)
+            if len(batch) >= batch_size:
+                added += add_batch(batch)
+                batch = []
+        if batch:
+            added += add_batch(batch)
+    finally:
+        documents.close()
+        pieces.close()
+    
+    logger.info(f"Ingested {len(file_paths)} files into {added} chunks")
+    return added
@@ -0,0 +1,169 @@
+"""
+プロセス共通のOpenAIクライアント
+接続プール（keep-alive）付きのHTTPクライアントをAPIキーごとに1つだけ作り、
+429/5xx・接続エラーはジッター付きの指数バックオフで再試行する。
+失敗が続いた場合はサーキットブレーカーを開き、回復を確認するまでAPIを呼ばずに
+CircuitOpenErrorを送出する（呼び出し側はテンプレート回答に切り替える）
+"""
+import time
+import random
+import logging
+import threading
+from types import SimpleNamespace
+from typing import Callable, Optional
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+
+try:
+    import httpx
+    import openai
+    from openai import OpenAI
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているためAPIを呼ばなかった"""
+    pass
+
+class CircuitBreaker:
+    """連続失敗数でAPIの劣化を検知するサーキットブレーカー
+    
+    closed: 通常どおり呼び出す
+    open: reset_timeout秒が経つまで呼び出さない
+    half_open: 1件だけ試し、成功すればclosed、失敗すれば再びopen
+    """
+    
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+    
+    def allow_request(self) -> bool:
+        """呼び出してよいか（open中に待ち時間が過ぎたら1件だけ試す）"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and self.clock() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                return True
+            return False
+    
+    def record_success(self):
+        """成功を記録（closedに戻す）"""
+        with self._lock:
+            if self.state != "closed":
+                logger.info("OpenAI circuit breaker closed")
+            self.state = "closed"
+            self.consecutive_failures = 0
+    
+    def record_failure(self):
+        """失敗を記録（閾値に達するか、試行中の失敗ならopenにする）"""
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"OpenAI circuit breaker opened after {self.consecutive_failures} failures")
+                self.state = "open"
+                self._opened_at = self.clock()
+    
+    def record_non_retryable_error(self):
+        """再試行しないエラー（4xxなど）を記録（closed中は失敗に数えず、試行中ならopenに戻す）"""
+        with self._lock:
+            if self.state == "half_open":
+                logger.warning("OpenAI circuit breaker trial failed, reopening")
+                self.state = "open"
+                self._opened_at = self.clock()
+
+def is_retryable_error(error: Exception) -> bool:
+    """再試行すべきエラーか（レート制限・サーバエラー・接続エラー・タイムアウト）"""
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+class ResilientOpenAIClient:
+    """再試行・サーキットブレーカー付きのOpenAIクライアント
+    
+    chat.completions.create はOpenAIクライアントと同じ引数で呼び出せる
+    """
+    
+    def __init__(self, client, breaker: CircuitBreaker = None, max_retries: int = None,
+                 backoff_base: float = None, backoff_max: float = None, sleep: Callable[[float], None] = time.sleep):
+        self.client = client
+        self.breaker = breaker or CircuitBreaker(Config.OPENAI_CIRCUIT_FAILURE_THRESHOLD,
+                                                 Config.OPENAI_CIRCUIT_RESET_SECONDS)
+        self.max_retries = Config.OPENAI_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = backoff_base or Config.OPENAI_BACKOFF_BASE
+        self.backoff_max = backoff_max or Config.OPENAI_BACKOFF_MAX
+        self.sleep = sleep
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create_chat_completion))
+    
+    def _backoff_delay(self, attempt: int, error: Exception) -> float:
+        """再試行までの待ち時間（上限付き指数バックオフのフルジッター、Retry-Afterがあればそれ以上）"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, min(float(retry_after), self.backoff_max))
+            except ValueError:
+                pass
+        return delay
+    
+    def create_chat_completion(self, **kwargs):
+        """chat.completions.create（429/5xxは再試行、ブレーカーが開いていれば即座にCircuitOpenError）"""
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow_request():
+                raise CircuitOpenError("OpenAI API is temporarily unavailable (circuit open)")
+            try:
+                response = self.client.chat.completions.create(**kwargs)
+            except Exception as e:
+                if not is_retryable_error(e):
+                    # 試行中（half_open）のまま残すと、以後ずっとCircuitOpenErrorになる
+                    self.breaker.record_non_retryable_error()
+                    raise
+                self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt, e)
+                logger.warning(f"OpenAI API error ({e.__class__.__name__}), retrying in {delay:.2f}s")
+                self.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return response
+
+_shared_clients = {}  # APIキー → ResilientOpenAIClient
+_shared_clients_lock = threading.Lock()
+
+def get_shared_openai_client(api_key: str = None) -> Optional[ResilientOpenAIClient]:
+    """プロセス共通のOpenAIクライアント（APIキーごとに1つ、キーがなければNone）"""
+    if not OPENAI_AVAILABLE:
+        return None
+    api_key = api_key or Config.get_openai_api_key()
+    if not api_key:
+        return None
+    
+    with _shared_clients_lock:
+        client = _shared_clients.get(api_key)
+        if client is None:
+            http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=Config.OPENAI_MAX_CONNECTIONS,
+                                    max_keepalive_connections=Config.OPENAI_MAX_KEEPALIVE_CONNECTIONS),
+                timeout=Config.OPENAI_REQUEST_TIMEOUT
+            )
+            # 再試行はResilientOpenAIClient側で行う
+            client = ResilientOpenAIClient(OpenAI(api_key=api_key, http_client=http_client, max_retries=0))
+            _shared_clients[api_key] = client
+            logger.info("Shared OpenAI client initialized")
+        return client
@@ -0,0 +1,90 @@
+"""
+Streamlitアプリのプロセス共通リソース
+インデックス・RAGエンジン・コード生成・マイコン選択をプロセスで1つだけ作り、
+全セッション・全再実行で共有する（再実行のたびにインデックスを読み直さない）。
+セッションは読み取りのみ行い、取り込み（書き込み）はingestion_lockで直列化する。
+別プロセスで取り込んだ場合はreload / reload_if_index_changedで読み直す
+"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.simple_vector_db import SimpleVectorDatabase
+from models.simple_rag_engine import SimpleRAGEngine
+from services.code_generator import CodeGenerator
+from services.microcontroller_selector import MicrocontrollerSelector
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class AppResources:
+    """プロセス共通のアプリリソース
+    
+    rag_engine（とそのvector_db）は読み直し時に新しいものへ丸ごと差し替えるため、
+    再実行の最初に取得した参照はその再実行の間、一貫した状態のまま使える
+    """
+    
+    def __init__(self, persist_directory: str = None):
+        self.persist_directory = persist_directory
+        self.code_generator = CodeGenerator()
+        self.microcontroller_selector = MicrocontrollerSelector()
+        self.ingestion_lock = threading.Lock()  # 取り込み・読み直しを直列化
+        self.bootstrapped = False
+        self.rag_engine = None
+        self.reload()
+    
+    @property
+    def vector_db(self) -> SimpleVectorDatabase:
+        """現在のインデックス"""
+        return self.rag_engine.vector_db
+    
+    def reload(self) -> float:
+        """インデックスを読み直してエンジンを差し替える（所要秒数を返す）
+        
+        現在のインデックスのバックグラウンドコンパクションの完了を待ってから読み直す
+        （読み直し時の掃除で統合中のセグメントを消さず、統合後のセグメントを読む）
+        """
+        with self.ingestion_lock:
+            start = time.perf_counter()
+            if self.rag_engine is not None:
+                self.rag_engine.vector_db.wait_for_compaction()
+            vector_db = SimpleVectorDatabase(persist_directory=self.persist_directory)
+            self.rag_engine = SimpleRAGEngine(vector_db)
+            elapsed = time.perf_counter() - start
+            logger.info(f"Shared RAG engine loaded in {elapsed:.2f}s ({vector_db.count_documents()} documents)")
+            return elapsed
+    
+    def reload_if_index_changed(self) -> bool:
+        """別プロセスでインデックスが更新されていれば読み直す（読み直したらTrue）"""
+        if not self.vector_db.index_changed_on_disk():
+            return False
+        logger.info("Index changed on disk, reloading shared RAG engine")
+        self.reload()
+        return True
+    
+    @contextmanager
+    def ingestion(self) -> Iterator[SimpleVectorDatabase]:
+        """共有インデックスへの取り込み（他の取り込み・読み直しと直列化する）
+        
+        自プロセスでの追加はメモリ上のインデックスに反映済みのため、終了後に読み直す必要はない
+        """
+        with self.ingestion_lock:
+            yield self.vector_db
+
+_app_resources = None
+_app_resources_lock = threading.Lock()
+
+def get_app_resources() -> AppResources:
+    """プロセス共通のアプリリソース（最初の呼び出しで作成）"""
+    global _app_resources
+    if _app_resources is None:
+        with _app_resources_lock:
+            if _app_resources is None:
+                _app_resources = AppResources()
+    return _app_resources
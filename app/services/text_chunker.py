@@ -0,0 +1,184 @@
+"""
+テキストのチャンク分割
+区切り文字の優先順位・チャンクサイズ・重なりはRecursiveCharacterTextSplitterと同じ設定を使い、
+テキストを先頭から1回なめるだけで分割する（再帰的な分割・部分文字列の作り直しをしない）。
+チャンクは元のテキストでの位置（オフセット）として返し、--- Page N --- の見出しから
+チャンクのページ番号を求める
+"""
+import re
+import logging
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 優先順位の高い順（段落 → 行 → 文 → 単語 → 文字）
+DEFAULT_SEPARATORS = ["\n\n", "\n", "。", ".", " ", ""]
+# PDFのページ見出し（document_processor.PAGE_HEADERの中身）
+PAGE_MARKER = re.compile(r"--- Page (\d+) ---")
+# ページ見出しの最大の長さ（ストリーミングで片の境界をまたぐ見出しを探し直す長さ）
+PAGE_MARKER_LOOKBACK = 32
+
+@dataclass(frozen=True)
+class TextSpan:
+    """チャンクの位置（テキスト全体でのオフセット、前後の空白は含まない）とページ番号"""
+    start: int
+    end: int
+    page: Optional[int] = None  # チャンクの先頭のページ（ページ見出しがなければNone）
+    page_end: Optional[int] = None  # チャンクの末尾のページ
+
+class _PageMarkers:
+    """見つけたページ見出し（テキスト全体でのオフセット順）"""
+    
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.pages = []
+    
+    @property
+    def scanned_end(self) -> int:
+        """最後に見つけたページ見出しの末尾"""
+        return self.ends[-1] if self.ends else 0
+    
+    def add(self, text: str, scan_from: int = 0, base: int = 0):
+        """textのscan_from文字目以降のページ見出しを追加（textの先頭はテキスト全体のbase文字目）"""
+        for match in PAGE_MARKER.finditer(text, scan_from):
+            self.starts.append(base + match.start())
+            self.ends.append(base + match.end())
+            self.pages.append(int(match.group(1)))
+    
+    def discard_before(self, offset: int):
+        """offsetより前のページ見出しを捨てる（offsetのページの見出しは残す）"""
+        keep = max(bisect_right(self.starts, offset) - 1, 0)
+        del self.starts[:keep], self.ends[:keep], self.pages[:keep]
+    
+    def span(self, start: int, end: int) -> TextSpan:
+        """チャンクの位置にページ番号を付ける"""
+        first = bisect_right(self.starts, start) - 1
+        last = bisect_left(self.starts, end) - 1
+        if last > first and self.ends[last] >= end:
+            last -= 1  # 次のページの見出しで終わる（次のページの本文を含まない）
+        return TextSpan(start, end, self.pages[first] if first >= 0 else None, self.pages[last] if last >= 0 else None)
+
+class TextChunker:
+    """区切り文字の優先順位に従う線形時間のチャンク分割
+    
+    チャンクの先頭からchunk_size文字の範囲で、優先順位の最も高い区切り文字の最後の出現の直後で切る
+    （区切り文字はチャンクの末尾に残し、前後の空白は除く）。どの区切り文字もなければchunk_size文字で切る。
+    次のチャンクは、直前のチャンクの末尾chunk_overlap文字の範囲にある、切った区切り文字と同じか
+    より優先順位の高い区切り文字の最初の出現の直後から始める（なければ重ねない。文字で切った場合は
+    chunk_overlap文字重ねる）。各チャンクは直前のチャンクより先まで進む
+    """
+    
+    def __init__(self, chunk_size: int, chunk_overlap: int, separators: List[str] = None):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = list(separators or DEFAULT_SEPARATORS)
+        if self.separators[-1] != "":
+            self.separators.append("")  # 最後は文字単位で切る
+    
+    def split_spans(self, text: str) -> List[TextSpan]:
+        """テキストをチャンクの位置のリストに分割（部分文字列は作らない）"""
+        markers = _PageMarkers()
+        markers.add(text)
+        spans = []
+        start = prev_end = 0
+        while True:
+            step = self._next_chunk(text, start, prev_end, final=True)
+            if step is None:
+                return spans
+            chunk_start, chunk_end, prev_end, start = step
+            spans.append(markers.span(chunk_start, chunk_end))
+    
+    def split_text(self, text: str) -> List[str]:
+        """テキストをチャンクの文字列のリストに分割（RecursiveCharacterTextSplitter.split_textの代わり）"""
+        return [text[span.start:span.end] for span in self.split_spans(text)]
+    
+    def iter_chunks(self, pieces: Iterable[str]) -> Iterator[Tuple[TextSpan, str]]:
+        """テキスト片を順にチャンク化（位置, チャンクの文字列）
+        
+        片を連結したテキストをsplit_spansで分割した場合と同じチャンクになる。
+        分割の終わったテキストは捨てるため、保持するのはおおよそchunk_size＋片1つ分
+        """
+        buffer = ""
+        base = 0  # bufferの先頭のテキスト全体でのオフセット
+        markers = _PageMarkers()
+        start = prev_end = 0  # bufferでの位置
+        for piece in pieces:
+            if not piece:
+                continue
+            scan_from = max(len(buffer) - PAGE_MARKER_LOOKBACK, markers.scanned_end - base, 0)
+            buffer += piece
+            markers.add(buffer, scan_from, base)
+            
+            while True:
+                step = self._next_chunk(buffer, start, prev_end, final=False)
+                if step is None:
+                    break
+                chunk_start, chunk_end, prev_end, start = step
+                yield markers.span(base + chunk_start, base + chunk_end), buffer[chunk_start:chunk_end]
+            
+            # 分割の終わったテキストを捨てる（ページ見出しは現在のページの分だけ残す）
+            buffer, base, prev_end, start = buffer[start:], base + start, prev_end - start, 0
+            markers.discard_before(base)
+        
+        while True:
+            step = self._next_chunk(buffer, start, prev_end, final=True)
+            if step is None:
+                return
+            chunk_start, chunk_end, prev_end, start = step
+            yield markers.span(base + chunk_start, base + chunk_end), buffer[chunk_start:chunk_end]
+    
+    def _next_chunk(self, text: str, start: int, prev_end: int, final: bool) -> Optional[Tuple[int, int, int, int]]:
+        """startからの次のチャンク（チャンクの先頭, 末尾, 切った位置, 次のチャンクの開始位置）
+        
+        チャンクがなければNone。finalでなければ、textの続きで結果が変わりうる場合もNone
+        （textの末尾PAGE_MARKER_LOOKBACK文字は見出しの途中かもしれないため、その手前までで切る）
+        """
+        length = len(text)
+        # 直前のチャンクより先に空白以外の文字を含める
+        while prev_end < length and text[prev_end].isspace():
+            prev_end += 1
+        if prev_end >= length:
+            return None
+        start = max(start, prev_end - self.chunk_size + 1)  # 空白が長く続いて重ねられない場合
+        while text[start].isspace():
+            start += 1
+        
+        limit = start + self.chunk_size
+        if not final and limit + PAGE_MARKER_LOOKBACK >= length:
+            return None  # 切る位置・チャンク内のページ見出しが続きのテキストで変わりうる
+        if limit >= length:
+            end, next_start = length, length
+        else:
+            end, level = self._find_break(text, prev_end, limit)
+            next_start = self._overlap_start(text, max(end - self.chunk_overlap, start + 1), end, level)
+        
+        chunk_end = end
+        while text[chunk_end - 1].isspace():
+            chunk_end -= 1
+        return start, chunk_end, end, next_start
+    
+    def _find_break(self, text: str, low: int, limit: int) -> Tuple[int, int]:
+        """low〜limitの範囲で切る位置と、使った区切り文字の優先順位"""
+        for level, separator in enumerate(self.separators[:-1]):
+            index = text.rfind(separator, low, limit)
+            if index >= 0:
+                return index + len(separator), level
+        return limit, len(self.separators) - 1
+    
+    def _overlap_start(self, text: str, low: int, end: int, level: int) -> int:
+        """次のチャンクの開始位置（low〜endの範囲で重ねる）"""
+        if self.chunk_overlap == 0 or low >= end:
+            return end
+        for separator in self.separators[:level + 1]:
+            if not separator:
+                return low
+            index = text.find(separator, max(low - len(separator), 0), end - 1)
+            if index >= 0:
+                return index + len(separator)
+        return end
@@ -4,9 +4,9 @@
 import streamlit as st
 import os
 import logging
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterator
 from langchain.schema import Document
-import openai
+from services.openai_client import get_shared_openai_client
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
@@ -32,10 +32,10 @@ def check_auth():
 
 # OpenAI設定
 def get_openai_client():
-    """OpenAIクライアント取得"""
+    """OpenAIクライアント取得（再実行ごとに作り直さず、プロセス共通のクライアントを使う）"""
     try:
         api_key = st.secrets["api_keys"]["openai_api_key"]
-        return openai.OpenAI(api_key=api_key)
+        return get_shared_openai_client(api_key)
     except Exception as e:
         st.error(f"OpenAI設定エラー: {e}")
         return None
@@ -179,14 +179,17 @@ def simple_search(query: str, docs: List[Dict]) -> List[Dict]:
 
 def generate_answer(question: str, client) -> str:
     """OpenAIで回答生成"""
+    return "".join(stream_answer(question, client, simple_search(question, EMBEDDED_DOCS)))
+
+def stream_answer(question: str, client, relevant_docs: List[Dict]) -> Iterator[str]:
+    """OpenAIの回答を生成された断片ごとに返す"""
     if not client:
-        return "OpenAI接続エラーのため、テンプレート回答を使用できません。"
-    
-    # 関連文書を検索
-    relevant_docs = simple_search(question, EMBEDDED_DOCS)
+        yield "OpenAI接続エラーのため、テンプレート回答を使用できません。"
+        return
     
     if not relevant_docs:
-        return "申し訳ございませんが、関連する情報が見つかりませんでした。質問を言い換えてお試しください。"
+        yield "申し訳ございませんが、関連する情報が見つかりませんでした。質問を言い換えてお試しください。"
+        return
     
     # コンテキスト作成
     context = "\n\n".join([f"【{doc['title']}】\n{doc['content']}" for doc in relevant_docs])
@@ -209,15 +212,18 @@ STM32 NUCLEO-F767ZI開発に関する質問に、提供された技術文書を
 """
 
     try:
-        response = client.chat.completions.create(
+        stream = client.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[{"role": "user", "content": prompt}],
             max_tokens=1000,
-            temperature=0.7
+            temperature=0.7,
+            stream=True
         )
-        return response.choices[0].message.content
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
     except Exception as e:
-        return f"回答生成中にエラーが発生しました: {e}"
+        yield f"回答生成中にエラーが発生しました: {e}"
 
 def main():
     """メイン関数"""
@@ -269,12 +275,13 @@ def main():
             with st.chat_message("user"):
                 st.markdown(prompt)
             
-            # AI回答生成
+            # AI回答生成（参考文書を先に表示し、回答は生成された順に表示）
             with st.chat_message("assistant"):
-                with st.spinner("回答を生成しています..."):
-                    answer = generate_answer(prompt, client)
-                    st.markdown(answer)
-                    st.session_state.messages.append({"role": "assistant", "content": answer})
+                relevant_docs = simple_search(prompt, EMBEDDED_DOCS)
+                if relevant_docs:
+                    st.caption("📚 参考文書: " + ", ".join(doc["title"] for doc in relevant_docs))
+                answer = st.write_stream(stream_answer(prompt, client, relevant_docs))
+                st.session_state.messages.append({"role": "assistant", "content": answer})
     
     with tab2:
         st.markdown("### 利用可能な技術文書")
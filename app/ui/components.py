@@ -245,6 +245,22 @@ def render_system_status(status: Dict):
     # コレクション数
     collection_count = len(status.get("vector_db_collections", []))
     st.sidebar.write(f"**登録ドキュメント:** {collection_count} コレクション")
+    
+    # 検索結果キャッシュ
+    query_cache = status.get("query_cache")
+    if query_cache:
+        st.sidebar.write(f"**検索キャッシュ:** ヒット {query_cache['hits']} / ミス {query_cache['misses']} "
+                         f"({query_cache['hit_rate']:.0%})")
+    
+    # 同時に届いた同じ質問の共有
+    single_flight = status.get("single_flight")
+    if single_flight:
+        st.sidebar.write(f"**同じ質問の共有:** 実行 {single_flight['executions']} / 共有 {single_flight['shared']}")
+    
+    # 前回の再実行の所要時間
+    if status.get("last_rerun_ms") is not None:
+        st.sidebar.write(f"**前回の再実行:** {status['last_rerun_ms']:.0f} ms "
+                         f"(初期化 {status.get('last_init_ms') or 0:.0f} ms)")
 
 def render_tips_panel(tips: List[str]):
     """開発Tipsパネルを表示"""
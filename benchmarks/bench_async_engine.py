@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+非同期RAGエンジンの負荷試験
+ローカルに立てたOpenAI互換の偽サーバ（一定の遅延で固定の回答を返す）に対して、
+同時実行数を変えながら質問を投げ、スループットとレイテンシを計測する
+
+使用例:
+    python benchmarks/bench_async_engine.py --questions 200 --latency 0.2
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(current_dir)
+sys.path.insert(0, os.path.join(project_dir, "app"))
+sys.path.insert(0, project_dir)
+
+from openai import AsyncOpenAI
+from langchain.schema import Document
+from app.models.simple_vector_db import SimpleVectorDatabase
+from app.models.async_rag_engine import AsyncSimpleRAGEngine
+from app.bootstrap_docs import OnlineDocumentBootstrap
+from add_simulink_knowledge import build_simulink_documents
+
+# モジュール側のINFOログ（質問ごとのログ出力）を抑制
+logging.disable(logging.INFO)
+
+QUESTIONS = ["GPIOの出力設定方法", "UART通信の設定", "PWMでモーターを制御したい", "クロック設定の方法",
+             "Simulinkでコード生成する手順", "External Modeで信号を監視する"]
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """/v1/chat/completions に一定の遅延で固定の回答を返す"""
+    
+    latency = 0.2
+    
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.latency)
+        response = json.dumps({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "偽サーバの回答です。"},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+    
+    def log_message(self, format, *args):
+        pass
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """同時接続を待たせないよう接続待ちキューを大きくしたHTTPサーバ"""
+    
+    request_queue_size = 256
+    daemon_threads = True
+
+def start_fake_server(latency: float) -> ThreadingHTTPServer:
+    """偽サーバをバックグラウンドスレッドで起動"""
+    FakeOpenAIHandler.latency = latency
+    server = FakeOpenAIServer(("127.0.0.1", 0), FakeOpenAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def build_documents():
+    """ブートストラップ文書とSimulinkナレッジ"""
+    bootstrap = OnlineDocumentBootstrap(vector_db=object())
+    documents = [
+        Document(page_content=info["content"], metadata={"title": info["title"], "source": "bootstrap"})
+        for info in bootstrap.basic_info
+    ]
+    return documents + build_simulink_documents()
+
+async def run_load(engine: AsyncSimpleRAGEngine, num_questions: int, concurrency: int):
+    """（経過秒, 1質問あたりのレイテンシのリスト）"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def ask(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            result = await engine.answer_question(QUESTIONS[i % len(QUESTIONS)])
+            latencies.append(time.perf_counter() - start)
+            assert result["answer"] == "偽サーバの回答です。", result["answer"]
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(ask(i) for i in range(num_questions)))
+    return time.perf_counter() - start, sorted(latencies)
+
+async def main_async(args):
+    server = start_fake_server(args.latency)
+    persist_directory = tempfile.mkdtemp()
+    try:
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        vector_db.add_documents(build_documents())
+        client = AsyncOpenAI(api_key="sk-fake", base_url=f"http://127.0.0.1:{server.server_port}/v1",
+                             max_retries=0)
+        engine = AsyncSimpleRAGEngine(vector_db, async_openai_client=client)
+        engine.answer_cache.max_entries = 0  # 毎回偽サーバを呼ぶ
+        
+        print(f"{args.questions} questions, server latency {args.latency * 1000:.0f} ms")
+        print(f"{'concurrency':>11} | {'q/s':>8} | {'mean[ms]':>8} | {'p95[ms]':>8} | {'speedup':>8}")
+        baseline = None
+        for concurrency in args.concurrency:
+            elapsed, latencies = await run_load(engine, args.questions, concurrency)
+            throughput = args.questions / elapsed
+            baseline = baseline or throughput
+            print(f"{concurrency:>11} | {throughput:8.1f} | {sum(latencies) / len(latencies) * 1000:8.1f} | "
+                  f"{latencies[int(len(latencies) * 0.95)] * 1000:8.1f} | {throughput / baseline:7.2f}x")
+        await engine.aclose()
+    finally:
+        server.shutdown()
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="AsyncSimpleRAGEngine load test against a fake OpenAI server")
+    parser.add_argument("--questions", type=int, default=200, help="同時実行数ごとの質問数")
+    parser.add_argument("--latency", type=float, default=0.2, help="偽サーバの応答遅延（秒）")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32],
+                        help="計測する同時実行数")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+チャンク分割の速度とメモリ（RecursiveCharacterTextSplitterとTextChunker）
+同じ区切り文字・CHUNK_SIZE・CHUNK_OVERLAPで、LangChainのRecursiveCharacterTextSplitter（変更前）と
+TextChunker（変更後。文字列のリストを返すsplit_textと、位置だけを返すsplit_spans）の
+処理速度・ピークメモリ（tracemalloc）・チャンク数・平均チャンク長を比較する。
+--directoryを指定すると、そのディレクトリのPDF・テキストから抽出したテキストで計測し、
+指定しない場合はデータシート風（英語）・アプリケーションノート風（日本語）の合成テキストと、
+改行のない1行のテキスト（再帰的な分割が深くなる場合）で計測する
+
+使用例:
+    python benchmarks/bench_chunking.py --pages 400
+    python benchmarks/bench_chunking.py --directory data/documents
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+import tracemalloc
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(current_dir)
+sys.path.insert(0, os.path.join(project_dir, "app"))
+sys.path.insert(0, project_dir)
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from app.config import Config
+from app.services.text_chunker import TextChunker
+from test_clean_text import datasheet_text, legacy_clean_text
+
+# モジュール側のINFOログを抑制
+logging.disable(logging.INFO)
+
+SEPARATORS = ["\n\n", "\n", "。", ".", " ", ""]
+
+def measure(split, text: str):
+    """（Mchar/s, ピークメモリ[MB], チャンクの長さのリスト）"""
+    start = time.perf_counter()
+    split(text)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        chunks = split(text)
+        peak = tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+    lengths = [span.end - span.start if hasattr(span, "end") else len(span) for span in chunks]
+    return len(text) / 1e6 / elapsed, peak, lengths
+
+def raw_text(directory: str) -> str:
+    """ディレクトリ内のファイルから抽出したクリーニング済みのテキスト"""
+    from app.services.document_processor import DocumentProcessor
+    processor = DocumentProcessor()
+    file_paths = [os.path.join(root, name) for root, _, names in os.walk(directory) for name in sorted(names)
+                  if os.path.splitext(name)[1].lower() in Config.SUPPORTED_FORMATS]
+    return "\n\n".join(processor.extract_text_from_file(path) for path in file_paths)
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunking throughput and memory benchmark")
+    parser.add_argument("--directory", help="計測に使うPDF・テキストのディレクトリ（省略時は合成テキスト）")
+    parser.add_argument("--pages", type=int, default=400, help="合成テキストのページ数")
+    args = parser.parse_args()
+    
+    if args.directory:
+        inputs = [(os.path.basename(os.path.abspath(args.directory)), raw_text(args.directory))]
+    else:
+        english = legacy_clean_text(datasheet_text(args.pages, "en"))
+        inputs = [("datasheet (en)", english),
+                  ("app note (ja)", legacy_clean_text(datasheet_text(args.pages, "ja"))),
+                  ("single line", english.replace("\n", " ").replace(".", ","))]
+    
+    langchain = RecursiveCharacterTextSplitter(chunk_size=Config.CHUNK_SIZE, chunk_overlap=Config.CHUNK_OVERLAP,
+                                               length_function=len, separators=SEPARATORS)
+    chunker = TextChunker(Config.CHUNK_SIZE, Config.CHUNK_OVERLAP, SEPARATORS)
+    splitters = [("langchain", langchain.split_text), ("split_text", chunker.split_text),
+                 ("split_spans", chunker.split_spans)]
+    
+    print(f"chunk_size={Config.CHUNK_SIZE}, chunk_overlap={Config.CHUNK_OVERLAP}")
+    print(f"{'input':>16} | {'splitter':>11} | {'Mchar/s':>8} | {'peak[MB]':>9} | {'chunks':>6} | {'avg len':>7}")
+    for label, text in inputs:
+        for name, split in splitters:
+            speed, peak, lengths = measure(split, text)
+            print(f"{label:>16} | {name:>11} | {speed:8.1f} | {peak:9.2f} | {len(lengths):6d} | "
+                  f"{sum(lengths) / max(len(lengths), 1):7.0f}")
+
+if __name__ == "__main__":
+    main()
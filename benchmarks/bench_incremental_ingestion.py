@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+再取り込みの所要時間（マニフェストによる差分の取り込み）
+合成PDFを全件取り込んだ後、変更なし・1ファイルだけ変更・1ファイル削除の各場合に
+sync_filesで取り込み直す時間を、全ファイルを取り込み直す場合（変更前）と比較する
+
+使用例:
+    python benchmarks/bench_incremental_ingestion.py --files 20 --pages 4
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import logging
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(current_dir)
+sys.path.insert(0, os.path.join(project_dir, "app"))
+sys.path.insert(0, project_dir)
+
+from app.models.simple_vector_db import SimpleVectorDatabase
+from app.services.document_processor import DocumentProcessor
+from app.services.ingestion_manifest import sync_files
+from test_parallel_ingestion import write_manual
+
+# モジュール側のINFOログ（ファイル・バッチごとのログ出力）を抑制
+logging.disable(logging.INFO)
+
+def timed(label: str, vector_db, file_paths, processor, **kwargs):
+    """sync_filesを1回実行して所要時間と集計を表示"""
+    start = time.perf_counter()
+    summary = sync_files(vector_db, file_paths, processor=processor, **kwargs)
+    elapsed = time.perf_counter() - start
+    print(f"{label:>16} | {elapsed:8.2f} | {summary['new']:4d} | {summary['changed']:7d} | "
+          f"{summary['unchanged']:9d} | {summary['removed']:7d} | {summary['chunks']:6d}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental re-ingestion benchmark")
+    parser.add_argument("--files", type=int, default=20, help="合成PDFの数")
+    parser.add_argument("--pages", type=int, default=4, help="合成PDF1つあたりのページ数")
+    args = parser.parse_args()
+    
+    directory = tempfile.mkdtemp()
+    try:
+        docs_directory = os.path.join(directory, "docs")
+        os.makedirs(docs_directory)
+        file_paths = []
+        for i in range(args.files):
+            path = os.path.join(docs_directory, f"manual_{i:03d}.pdf")
+            write_manual(path, args.pages)
+            file_paths.append(path)
+        vector_db = SimpleVectorDatabase(persist_directory=os.path.join(directory, "db"))
+        processor = DocumentProcessor()
+        
+        print(f"{args.files} files x {args.pages} pages")
+        print(f"{'run':>16} | {'seconds':>8} | {'new':>4} | {'changed':>7} | {'unchanged':>9} | {'removed':>7} | {'chunks':>6}")
+        timed("initial", vector_db, file_paths, processor)
+        timed("full re-ingest", vector_db, file_paths, processor, force=True)
+        timed("no changes", vector_db, file_paths, processor)
+        write_manual(file_paths[0], args.pages + 1)
+        timed("1 file changed", vector_db, file_paths, processor)
+        os.remove(file_paths[-1])
+        timed("1 file removed", vector_db, file_paths[:-1], processor)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+PDF取り込みのスループット（ワーカー数ごと）
+DocumentProcessor.create_documentsをワーカー数を変えて実行し、ページ/秒と
+1ワーカー（逐次処理）に対する速度向上を表示する。全ての結果が逐次処理と一致することも確認する
+
+使用例:
+    python benchmarks/bench_pdf_ingestion.py --files 8 --pages 60 --workers 1 2 4 8
+    python benchmarks/bench_pdf_ingestion.py --directory data/documents --workers 1 4
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import logging
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(current_dir)
+sys.path.insert(0, os.path.join(project_dir, "app"))
+sys.path.insert(0, project_dir)
+
+from app.services.document_processor import DocumentProcessor, count_pdf_pages
+from test_parallel_ingestion import write_manual
+
+# モジュール側のINFOログ（ファイルごとのログ出力）を抑制
+logging.disable(logging.INFO)
+
+def measure(processor: DocumentProcessor, file_paths, workers: int):
+    """取り込みの所要秒数とDocument"""
+    start = time.perf_counter()
+    documents = processor.create_documents(file_paths, workers=workers)
+    return time.perf_counter() - start, documents
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF ingestion throughput benchmark")
+    parser.add_argument("--directory", help="取り込むPDFのディレクトリ（省略時は合成PDFを使う）")
+    parser.add_argument("--files", type=int, default=8, help="合成PDFの数")
+    parser.add_argument("--pages", type=int, default=60, help="合成PDF1つあたりのページ数")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="計測するワーカー数")
+    args = parser.parse_args()
+    
+    directory = args.directory or tempfile.mkdtemp()
+    try:
+        if not args.directory:
+            for i in range(args.files):
+                write_manual(os.path.join(directory, f"manual_{i:03d}.pdf"), args.pages)
+        file_paths = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory) if name.lower().endswith(".pdf")
+        )
+        total_pages = sum(count_pdf_pages(path) for path in file_paths)
+        processor = DocumentProcessor()
+        
+        print(f"{len(file_paths)} files, {total_pages} pages, {os.cpu_count()} CPUs")
+        print(f"{'workers':>8} | {'seconds':>8} | {'pages/s':>8} | {'speedup':>8}")
+        baseline_seconds, baseline = measure(processor, file_paths, 1)
+        expected = [(doc.page_content, doc.metadata) for doc in baseline]
+        for workers in args.workers:
+            if workers == 1:
+                seconds = baseline_seconds
+            else:
+                seconds, documents = measure(processor, file_paths, workers)
+                assert [(doc.page_content, doc.metadata) for doc in documents] == expected, \
+                    f"{workers}ワーカーの結果が逐次処理と一致しない"
+            print(f"{workers:8d} | {seconds:8.2f} | {total_pages / seconds:8.1f} | {baseline_seconds / seconds:7.2f}x")
+    finally:
+        if not args.directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
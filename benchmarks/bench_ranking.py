@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+順位付け方式（TF-IDF / BM25 / BM25+）の関連性・レイテンシ比較
+ブートストラップ文書（短いメモ）とSimulinkナレッジ（長めのチャンク）を1つのインデックスに入れ、
+正解チャンクを付けたクエリでMRR・Hit@kを、コーパスを複製した規模でクエリレイテンシを計測する
+
+使用例:
+    python benchmarks/bench_ranking.py --replicas 500
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import logging
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(current_dir)
+sys.path.insert(0, os.path.join(project_dir, "app"))
+sys.path.insert(0, project_dir)
+
+from langchain.schema import Document
+from app.models.simple_vector_db import SimpleVectorDatabase, RANKING_MODES
+from app.bootstrap_docs import OnlineDocumentBootstrap
+from add_simulink_knowledge import build_simulink_documents
+
+# モジュール側のINFOログ（検索ごとのログ出力）を抑制
+logging.disable(logging.INFO)
+
+# クエリ → 正解チャンク（ブートストラップ文書はtitle、Simulinkナレッジはchunk_id）
+JUDGED_QUERIES = [
+    ("GPIO 出力 設定", {"GPIO基本設定"}),
+    ("HAL_GPIO_WritePin", {"GPIO基本設定"}),
+    ("UART 送信 baudrate", {"UART通信設定"}),
+    ("UART 受信 HAL_UART_Receive", {"UART通信設定"}),
+    ("STM32F767ZI Flash RAM 仕様", {"STM32F767ZI基本仕様"}),
+    ("Simulink サポートパッケージ インストール", {"simulink_setup_001", "Simulink STM32サポート"}),
+    ("ST-LINK ドライバ", {"simulink_setup_001"}),
+    ("ブロック配置 モデル作成", {"simulink_modeling_001"}),
+    ("コード生成 Configuration Parameters", {"simulink_codegen_001"}),
+    ("Fixed-step solver", {"simulink_codegen_001"}),
+    ("External Mode 信号監視", {"simulink_debug_001"}),
+    ("PIL テスト 処理時間", {"simulink_debug_001"}),
+    ("PWM モーター制御 サンプル", {"simulink_examples_001"}),
+    ("LED 点滅", {"simulink_examples_001"}),
+]
+
+def build_documents():
+    """ブートストラップ文書とSimulinkナレッジ"""
+    bootstrap = OnlineDocumentBootstrap(vector_db=object())
+    documents = [
+        Document(page_content=info["content"], metadata={"title": info["title"], "source": "bootstrap"})
+        for info in bootstrap.basic_info
+    ]
+    return documents + build_simulink_documents()
+
+def document_key(doc: Document) -> str:
+    """正解判定用のキー"""
+    return doc.metadata.get("chunk_id") or doc.metadata.get("title")
+
+def evaluate_relevance(vector_db: SimpleVectorDatabase, ranking: str, k: int = 3):
+    """MRR・Hit@1・Hit@k"""
+    reciprocal_ranks = []
+    hits_at_1 = 0
+    hits_at_k = 0
+    for query, relevant in JUDGED_QUERIES:
+        results = vector_db.search_similar_documents(query, k=k, score_threshold=0.0, ranking=ranking)
+        ranks = [rank for rank, (doc, _) in enumerate(results, 1) if document_key(doc) in relevant]
+        reciprocal_ranks.append(1.0 / ranks[0] if ranks else 0.0)
+        hits_at_1 += bool(ranks) and ranks[0] == 1
+        hits_at_k += bool(ranks)
+    num_queries = len(JUDGED_QUERIES)
+    return sum(reciprocal_ranks) / num_queries, hits_at_1 / num_queries, hits_at_k / num_queries
+
+def measure_latency(vector_db: SimpleVectorDatabase, ranking: str, repeat: int):
+    """1クエリあたりの平均・p95レイテンシ（ミリ秒）"""
+    # 初回はIDF・ノルム・寄与上限の計算を含むため計測から除く
+    for query, _ in JUDGED_QUERIES:
+        vector_db.search_similar_documents(query, k=5, ranking=ranking)
+    
+    timings = []
+    for _ in range(repeat):
+        for query, _ in JUDGED_QUERIES:
+            start = time.perf_counter()
+            vector_db.search_similar_documents(query, k=5, ranking=ranking)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return sum(timings) / len(timings), timings[int(len(timings) * 0.95)]
+
+def main():
+    parser = argparse.ArgumentParser(description="TF-IDF / BM25 ranking benchmark")
+    parser.add_argument("--replicas", type=int, default=500, help="レイテンシ計測時にコーパスを複製する数")
+    parser.add_argument("--repeat", type=int, default=20, help="クエリセットの繰り返し回数")
+    args = parser.parse_args()
+    
+    documents = build_documents()
+    persist_directory = tempfile.mkdtemp()
+    try:
+        vector_db = SimpleVectorDatabase(persist_directory=os.path.join(persist_directory, "judged"))
+        vector_db.add_documents([Document(page_content=doc.page_content, metadata=dict(doc.metadata))
+                                 for doc in documents])
+        
+        replicated_db = SimpleVectorDatabase(persist_directory=os.path.join(persist_directory, "replicated"))
+        replicated_db.add_documents([
+            Document(page_content=doc.page_content, metadata={"chunk_id": f"replica_{replica}_{i}"})
+            for replica in range(args.replicas) for i, doc in enumerate(documents)
+        ])
+        # 繰り返しのクエリも毎回検索する（検索結果キャッシュのヒットを計測しない）
+        for db in (vector_db, replicated_db):
+            db.query_cache.max_entries = 0
+        
+        print(f"judged corpus: {len(documents)} chunks, {len(JUDGED_QUERIES)} queries; "
+              f"latency corpus: {len(documents) * args.replicas} chunks")
+        print(f"{'ranking':>8} | {'MRR':>6} | {'Hit@1':>6} | {'Hit@3':>6} | {'mean[ms]':>8} | {'p95[ms]':>8}")
+        for ranking in RANKING_MODES:
+            mrr, hit_at_1, hit_at_3 = evaluate_relevance(vector_db, ranking)
+            mean_ms, p95_ms = measure_latency(replicated_db, ranking, args.repeat)
+            print(f"{ranking:>8} | {mrr:6.3f} | {hit_at_1:6.3f} | {hit_at_3:6.3f} | {mean_ms:8.2f} | {p95_ms:8.2f}")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Streamlitの再実行1回あたりのコンポーネント初期化コスト
+再実行ごとにインデックス・エンジンを作り直す場合（変更前）と、プロセス共通のリソースを
+使う場合（変更後）で、初期化 + システム状態の取得 + 検索1回の所要時間を比較する
+
+使用例:
+    python benchmarks/bench_rerun_init.py --replicas 200
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import logging
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(current_dir)
+sys.path.insert(0, os.path.join(project_dir, "app"))
+sys.path.insert(0, project_dir)
+
+from langchain.schema import Document
+from app.models.simple_vector_db import SimpleVectorDatabase
+from app.models.simple_rag_engine import SimpleRAGEngine
+from app.services.code_generator import CodeGenerator
+from app.services.microcontroller_selector import MicrocontrollerSelector
+from app.services.shared_resources import AppResources
+from app.bootstrap_docs import OnlineDocumentBootstrap
+from add_simulink_knowledge import build_simulink_documents
+
+# モジュール側のINFOログ（初期化・検索ごとのログ出力）を抑制
+logging.disable(logging.INFO)
+
+QUESTIONS = ["GPIOの出力設定方法", "UART通信の設定", "PWMでモーターを制御したい", "Simulinkでコード生成する手順"]
+
+def build_documents(replicas: int):
+    """ブートストラップ文書とSimulinkナレッジをreplicas回複製したもの"""
+    bootstrap = OnlineDocumentBootstrap(vector_db=object())
+    base = [
+        Document(page_content=info["content"], metadata={"title": info["title"], "source": "bootstrap"})
+        for info in bootstrap.basic_info
+    ] + build_simulink_documents()
+    return [
+        Document(page_content=f"{doc.page_content} (copy {i})", metadata=dict(doc.metadata, chunk_id=f"{i}_{j}"))
+        for i in range(replicas) for j, doc in enumerate(base)
+    ]
+
+def rerun_per_session(persist_directory: str, question: str):
+    """変更前: 再実行のたびにコンポーネントを作り直す"""
+    MicrocontrollerSelector()
+    CodeGenerator()
+    rag_engine = SimpleRAGEngine(SimpleVectorDatabase(persist_directory=persist_directory), use_openai=False)
+    rag_engine.get_system_status()
+    rag_engine.vector_db.search_similar_documents(question, k=5)
+
+def rerun_shared(resources: AppResources, question: str):
+    """変更後: プロセス共通のリソースを使う"""
+    resources.reload_if_index_changed()
+    rag_engine = resources.rag_engine
+    rag_engine.get_system_status()
+    rag_engine.vector_db.search_similar_documents(question, k=5)
+
+def measure(rerun, *args, repeat: int):
+    """1回の再実行あたりの平均・p95（ミリ秒）"""
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        rerun(*args, QUESTIONS[i % len(QUESTIONS)])
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return sum(timings) / len(timings), timings[int(len(timings) * 0.95)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-rerun component initialization benchmark")
+    parser.add_argument("--replicas", type=int, default=200, help="コーパスを複製する数")
+    parser.add_argument("--repeat", type=int, default=20, help="計測する再実行の回数")
+    args = parser.parse_args()
+    
+    persist_directory = tempfile.mkdtemp()
+    try:
+        documents = build_documents(args.replicas)
+        SimpleVectorDatabase(persist_directory=persist_directory).add_documents(documents)
+        resources = AppResources(persist_directory)
+        
+        print(f"{len(documents)} chunks, {args.repeat} reruns")
+        print(f"{'mode':>12} | {'mean[ms]':>9} | {'p95[ms]':>9}")
+        before = measure(rerun_per_session, persist_directory, repeat=args.repeat)
+        after = measure(rerun_shared, resources, repeat=args.repeat)
+        print(f"{'per-rerun':>12} | {before[0]:9.2f} | {before[1]:9.2f}")
+        print(f"{'shared':>12} | {after[0]:9.2f} | {after[1]:9.2f}")
+        print(f"speedup: {before[0] / after[0]:.1f}x")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
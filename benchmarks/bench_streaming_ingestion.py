@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+取り込みのピークメモリ（一括処理とストリーミング）
+create_documentsでファイル全体のテキスト・チャンク一覧を作る一括処理（変更前）と、
+ingest_filesでページ（ブロック）単位に流すストリーミング（変更後）で、文書の大きさごとの
+ピークメモリ（tracemalloc）と所要時間を比較する。合成PDFと、テキスト量の影響を見るための
+大きなテキストファイルの両方で計測する。索引自体のメモリを除くため、
+登録先にはチャンク数を数えるだけのベクトルDBの代わりを使う
+
+使用例:
+    python benchmarks/bench_streaming_ingestion.py --pages 25 100 --text-mb 5 20
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import logging
+import tracemalloc
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(current_dir)
+sys.path.insert(0, os.path.join(project_dir, "app"))
+sys.path.insert(0, project_dir)
+
+from app.services.document_processor import DocumentProcessor
+from app.services.ingestion_pipeline import ingest_files
+from test_parallel_ingestion import write_manual
+from test_streaming_ingestion import CountingIndex
+
+# モジュール側のINFOログ（ファイル・バッチごとのログ出力）を抑制
+logging.disable(logging.INFO)
+
+def ingest_bulk(path: str) -> int:
+    """変更前: ファイル全体をDocumentの一覧にしてから登録する"""
+    index = CountingIndex()
+    documents = DocumentProcessor().create_documents([path], workers=1)
+    index.add_documents(documents)
+    return index.chunks
+
+def ingest_streaming(path: str) -> int:
+    """変更後: ページ単位で流しながら登録する"""
+    index = CountingIndex()
+    ingest_files(index, [path], processor=DocumentProcessor())
+    return index.chunks
+
+def measure(ingest, path: str):
+    """（ピークメモリ[MB], 所要秒数, チャンク数）"""
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        chunks = ingest(path)
+        elapsed = time.perf_counter() - start
+        return tracemalloc.get_traced_memory()[1] / 1e6, elapsed, chunks
+    finally:
+        tracemalloc.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk vs streaming ingestion peak memory benchmark")
+    parser.add_argument("--pages", type=int, nargs="+", default=[25, 100], help="合成PDFのページ数")
+    parser.add_argument("--lines", type=int, default=60, help="1ページあたりの行数")
+    parser.add_argument("--text-mb", type=int, nargs="+", default=[5, 20], help="テキストファイルの大きさ（MB）")
+    args = parser.parse_args()
+    
+    directory = tempfile.mkdtemp()
+    try:
+        inputs = []
+        for pages in args.pages:
+            path = os.path.join(directory, f"manual_{pages}.pdf")
+            write_manual(path, pages, args.lines)
+            inputs.append((f"{pages} pages", path))
+        for size in args.text_mb:
+            path = os.path.join(directory, f"manual_{size}mb.txt")
+            line = "HAL_GPIO_WritePinでピンの出力を切り替える。GPIO output level is set by the BSRR register.\n"
+            with open(path, "w", encoding="utf-8") as f:
+                while f.tell() < size * 1000000:
+                    f.write(line)
+            inputs.append((f"{size} MB txt", path))
+        
+        print(f"{'input':>12} | {'mode':>9} | {'peak[MB]':>9} | {'seconds':>8} | {'chunks':>7}")
+        for label, path in inputs:
+            for name, ingest in [("bulk", ingest_bulk), ("streaming", ingest_streaming)]:
+                peak, elapsed, chunks = measure(ingest, path)
+                print(f"{label:>12} | {name:>9} | {peak:9.2f} | {elapsed:8.2f} | {chunks:7d}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
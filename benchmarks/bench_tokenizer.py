@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+トークナイザのスループット比較
+従来の_tokenize（re.sub + 単語ごとのre.match + 2-gramのスライス）と、
+1パスのtokenize / 語彙IDにインターンするTokenizer.encodeを日英混在のデータシート風テキストで計測する
+
+使用例:
+    python benchmarks/bench_tokenizer.py --megabytes 20
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import logging
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(current_dir)
+sys.path.insert(0, os.path.join(project_dir, "app"))
+sys.path.insert(0, project_dir)
+
+from app.models.tokenizer import Tokenizer, tokenize
+from app.bootstrap_docs import OnlineDocumentBootstrap
+from add_simulink_knowledge import build_simulink_documents
+
+logging.disable(logging.INFO)
+
+QUERIES = ["GPIO 出力 設定", "UART 送信 baudrate 115200", "HAL_TIM_PWM_Start", "クロック設定の方法",
+           "Simulink External Mode", "ADC DMA 変換"]
+
+def legacy_tokenize(text):
+    """変更前のSimpleVectorDatabase._tokenize"""
+    text = text.lower()
+    text = re.sub(r'[^a-zA-Z0-9\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF\s]', ' ', text)
+    tokens = []
+    for word in text.split():
+        if re.match(r'^[a-zA-Z0-9]+$', word):
+            if len(word) > 2:
+                tokens.append(word)
+        else:
+            for i in range(len(word) - 1):
+                bigram = word[i:i+2]
+                if len(bigram) == 2:
+                    tokens.append(bigram)
+    return tokens
+
+def build_chunks(megabytes: float, chunk_size: int = 1000, seed: int = 0):
+    """ブートストラップ文書・Simulinkナレッジの行を並べ替えて約1000文字のチャンクを作る"""
+    bootstrap = OnlineDocumentBootstrap(vector_db=object())
+    texts = [info["content"] for info in bootstrap.basic_info]
+    texts += [doc.page_content for doc in build_simulink_documents()]
+    lines = [line.strip() for text in texts for line in text.splitlines() if line.strip()]
+    
+    rng = random.Random(seed)
+    chunks = []
+    total_bytes = 0
+    while total_bytes < megabytes * 1024 * 1024:
+        chunk = []
+        length = 0
+        while length < chunk_size:
+            line = rng.choice(lines)
+            # 型番・レジスタ名のような語彙の多様性を加える
+            line = line.replace("STM32F767ZI", f"STM32F{rng.randint(100, 999)}ZI")
+            chunk.append(line)
+            length += len(line) + 1
+        chunk = "\n".join(chunk)
+        chunks.append(chunk)
+        total_bytes += len(chunk.encode("utf-8"))
+    return chunks, total_bytes
+
+def measure(function, items, repeat: int = 1) -> float:
+    """1回あたりの処理時間（秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            function(item)
+    return (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokenizer throughput benchmark")
+    parser.add_argument("--megabytes", type=float, default=20, help="チャンクの合計サイズ（MB）")
+    parser.add_argument("--query-repeat", type=int, default=20000, help="クエリセットの繰り返し回数")
+    args = parser.parse_args()
+    
+    chunks, total_bytes = build_chunks(args.megabytes)
+    megabytes = total_bytes / (1024 * 1024)
+    print(f"{len(chunks)} chunks, {megabytes:.1f} MB")
+    
+    legacy_seconds = measure(legacy_tokenize, chunks)
+    tokenize_seconds = measure(tokenize, chunks)
+    tokenizer = Tokenizer({})
+    cold_seconds = measure(tokenizer.encode, chunks)
+    warm_seconds = measure(tokenizer.encode, chunks)
+    
+    print(f"{'ingestion':>24} | {'MB/s':>8} | {'speedup':>8}")
+    for name, seconds in [("legacy _tokenize", legacy_seconds),
+                          ("tokenize", tokenize_seconds),
+                          ("encode (new vocabulary)", cold_seconds),
+                          ("encode (warm vocabulary)", warm_seconds)]:
+        print(f"{name:>24} | {megabytes / seconds:8.2f} | {legacy_seconds / seconds:7.2f}x")
+    
+    queries = QUERIES * args.query_repeat
+    legacy_seconds = measure(legacy_tokenize, queries)
+    tokenize_seconds = measure(tokenize, queries)
+    print(f"{'query':>24} | {'q/ms':>8} | {'speedup':>8}")
+    for name, seconds in [("legacy _tokenize", legacy_seconds), ("tokenize", tokenize_seconds)]:
+        print(f"{name:>24} | {len(queries) / seconds / 1000:8.1f} | {legacy_seconds / seconds:7.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+SimpleVectorDatabase 検索性能ベンチマーク
+従来の辞書ベースTF-IDF全件走査と、疎行列（CSR）バックエンドのクエリレイテンシを比較する
+
+使用例:
+    python benchmarks/bench_vector_search.py --sizes 10000,100000,1000000
+"""
+import os
+import sys
+import math
+import time
+import random
+import itertools
+import shutil
+import argparse
+import tempfile
+import logging
+from collections import Counter
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(current_dir)
+sys.path.insert(0, os.path.join(project_dir, "app"))
+sys.path.insert(0, project_dir)
+
+from langchain.schema import Document
+from app.models.simple_vector_db import SimpleVectorDatabase
+
+# モジュール側のINFOログ（検索ごとのログ出力）を抑制
+logging.disable(logging.INFO)
+
+QUERIES = ["w12 w305 設定", "w7 w88 w1500", "w3 割り込み", "w42 w4200 w9 クロック", "w2048"]
+
+def build_corpus(num_docs: int, vocab_size: int = 50000, words_per_doc: int = 40, seed: int = 0):
+    """Zipf分布の語彙からなる合成チャンクを生成"""
+    rng = random.Random(seed)
+    vocab = [f"w{i}" for i in range(vocab_size)]
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(vocab_size)))
+    ja_words = ["設定", "割り込み", "クロック", "タイマー", "通信"]
+    
+    documents = []
+    for i in range(num_docs):
+        words = rng.choices(vocab, cum_weights=cum_weights, k=words_per_doc)
+        words.append(rng.choice(ja_words))
+        documents.append(Document(page_content=" ".join(words), metadata={"chunk_id": f"bench_{i}"}))
+    return documents
+
+class LegacyTfidfSearch:
+    """変更前の実装（TF-IDF辞書 + 全件コサイン類似度）"""
+    
+    def __init__(self, vector_db: SimpleVectorDatabase, documents):
+        self.vector_db = vector_db
+        token_lists = [vector_db._tokenize(doc.page_content) for doc in documents]
+        token_doc_count = Counter()
+        for tokens in token_lists:
+            token_doc_count.update(set(tokens))
+        self.idf_scores = {token: math.log(len(documents) / count) for token, count in token_doc_count.items()}
+        self.documents = documents
+        self.tfidf_vectors = [self._tfidf(tokens) for tokens in token_lists]
+    
+    def _tfidf(self, tokens):
+        counts = Counter(tokens)
+        return {token: count / len(tokens) * self.idf_scores.get(token, 0) for token, count in counts.items()}
+    
+    def search(self, query: str, k: int = 5, score_threshold: float = 0.1):
+        query_vector = self._tfidf(self.vector_db._tokenize(query))
+        similarities = []
+        for doc, doc_vector in zip(self.documents, self.tfidf_vectors):
+            common_tokens = set(query_vector) & set(doc_vector)
+            if not common_tokens:
+                similarity = 0.0
+            else:
+                dot_product = sum(query_vector[token] * doc_vector[token] for token in common_tokens)
+                magnitude1 = math.sqrt(sum(val ** 2 for val in query_vector.values()))
+                magnitude2 = math.sqrt(sum(val ** 2 for val in doc_vector.values()))
+                similarity = dot_product / (magnitude1 * magnitude2) if magnitude1 and magnitude2 else 0.0
+            if similarity >= score_threshold:
+                similarities.append((doc, 1.0 - similarity))
+        similarities.sort(key=lambda x: x[1])
+        return similarities[:k]
+
+def time_queries(search, repeat: int) -> float:
+    """1クエリあたりの平均時間（ミリ秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in QUERIES:
+            search(query)
+    return (time.perf_counter() - start) * 1000 / (repeat * len(QUERIES))
+
+def run(num_docs: int, legacy_max_docs: int, repeat: int):
+    """1サイズ分のベンチマークを実行"""
+    documents = build_corpus(num_docs)
+    persist_directory = tempfile.mkdtemp()
+    try:
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        vector_db.query_cache.max_entries = 0  # 繰り返しのクエリも毎回検索する
+        
+        start = time.perf_counter()
+        vector_db.add_documents(documents)
+        ingest_seconds = time.perf_counter() - start
+        
+        # 追加直後の初回検索はIDF・ノルムの再計算を含む
+        start = time.perf_counter()
+        vector_db.search_similar_documents(QUERIES[0])
+        first_query_ms = (time.perf_counter() - start) * 1000
+        
+        csr_ms = time_queries(lambda q: vector_db.search_similar_documents(q, k=5), repeat)
+        
+        legacy_ms = None
+        if num_docs <= legacy_max_docs:
+            legacy = LegacyTfidfSearch(vector_db, documents)
+            legacy_ms = time_queries(lambda q: legacy.search(q, k=5), max(1, repeat // 10))
+        
+        speedup = f"{legacy_ms / csr_ms:8.1f}x" if legacy_ms else "       -"
+        legacy_str = f"{legacy_ms:10.2f}" if legacy_ms else "         -"
+        print(f"{num_docs:>9} | {ingest_seconds:9.2f} | {first_query_ms:10.2f} | {csr_ms:8.2f} | {legacy_str} | {speedup}")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="SimpleVectorDatabase search benchmark")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="カンマ区切りのチャンク数")
+    parser.add_argument("--legacy-max-docs", type=int, default=100000,
+                        help="従来実装を計測する最大チャンク数（それ以上は時間がかかるため省略）")
+    parser.add_argument("--repeat", type=int, default=20, help="クエリセットの繰り返し回数")
+    args = parser.parse_args()
+    
+    print(f"{'chunks':>9} | {'ingest[s]':>9} | {'first[ms]':>10} | {'csr[ms]':>8} | {'legacy[ms]':>10} | {'speedup':>8}")
+    for size in args.sizes.split(","):
+        run(int(size), args.legacy_max_docs, args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,7 @@ sys.path.insert(0, current_dir)
 
 from app.services.document_processor import DocumentProcessor
 from app.models.simple_vector_db import SimpleVectorDatabase
+from app.services.ingestion_manifest import sync_files
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -63,40 +64,34 @@ def main():
         logger.error("処理対象のファイルが見つかりません")
         return
     
-    # ドキュメントを処理
+    # ドキュメントを処理（変更のないファイルは飛ばし、ページ単位でストリーミングしながらベクトルDBに追加）
     try:
-        documents = doc_processor.create_documents(existing_files, "NUCLEO-F767ZI")
-        logger.info(f"作成されたドキュメントチャンク数: {len(documents)}")
+        summary = sync_files(vector_db, existing_files, "NUCLEO-F767ZI", processor=doc_processor)
+        logger.info(f"作成されたドキュメントチャンク数: {summary['chunks']}（変更のないファイル: {summary['unchanged']}）")
         
-        if documents:
-            # ベクトルDBに追加
-            success = vector_db.add_documents(documents, "NUCLEO-F767ZI")
+        if summary["chunks"] or summary["unchanged"]:
+            logger.info("シンプルなドキュメントインデックス作成完了！")
             
-            if success:
-                logger.info("シンプルなドキュメントインデックス作成完了！")
-                
-                # 統計情報を表示
-                stats = vector_db.get_collection_stats()
-                logger.info(f"ベクトルDB統計: {stats}")
-                
-                # テスト検索
-                logger.info("\\n=== テスト検索 ===")
-                test_queries = [
-                    "GPIO LED制御",
-                    "UART通信",
-                    "タイマー PWM",
-                    "STM32F767ZI",
-                ]
-                
-                for query in test_queries:
-                    results = vector_db.search_similar_documents(query, k=2)
-                    logger.info(f"クエリ: '{query}' -> {len(results)}件の結果")
-                    for i, (doc, score) in enumerate(results):
-                        source = doc.metadata.get("filename", "不明")
-                        logger.info(f"  {i+1}. {source} (スコア: {score:.3f})")
-                        
-            else:
-                logger.error("ベクトルDBへの追加に失敗しました")
+            # 統計情報を表示
+            stats = vector_db.get_collection_stats()
+            logger.info(f"ベクトルDB統計: {stats}")
+            
+            # テスト検索
+            logger.info("\\n=== テスト検索 ===")
+            test_queries = [
+                "GPIO LED制御",
+                "UART通信",
+                "タイマー PWM",
+                "STM32F767ZI",
+            ]
+            
+            for query in test_queries:
+                results = vector_db.search_similar_documents(query, k=2)
+                logger.info(f"クエリ: '{query}' -> {len(results)}件の結果")
+                for i, (doc, score) in enumerate(results):
+                    source = doc.metadata.get("filename", "不明")
+                    logger.info(f"  {i+1}. {source} (スコア: {score:.3f})")
+                    
         else:
             logger.error("ドキュメントの処理に失敗しました")
             
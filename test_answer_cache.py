@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+回答キャッシュのテスト
+同じ質問・よく似た質問ではOpenAI APIを呼ばず、再起動後もキャッシュが使われ、
+マイコン・検索されたチャンクが変わればキャッシュを使わないことを確認する
+"""
+import os
+import sys
+import shutil
+import tempfile
+import json
+import logging
+import threading
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+from langchain.schema import Document
+from app.models.simple_vector_db import SimpleVectorDatabase
+from app.models.simple_rag_engine import SimpleRAGEngine
+from app.models.answer_cache import AnswerCache, context_key
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DOCUMENTS = [
+    "GPIOの出力設定：HAL_GPIO_WritePinでピンの出力を切り替える。GPIO 出力 設定 方法",
+    "UARTの送信設定：HAL_UART_Transmitで送信する。baudrate 115200",
+    "タイマーのPWM出力：HAL_TIM_PWM_Startでパルス幅変調を開始する",
+    "ADCの変換：HAL_ADC_Startで変換を開始し、DMAで転送する",
+    "クロック設定：PLLでシステムクロックを216MHzにする",
+]
+
+class FakeCompletions:
+    """呼び出し回数を数えるchat.completionsの代わり（stream=Trueなら1文字ずつ返す）"""
+    
+    def __init__(self):
+        self.calls = 0
+        self.fail_after = None  # ストリーミングでこの文字数を返した後に例外を送出
+    
+    def create(self, model, messages, stream=False, **kwargs):
+        self.calls += 1
+        content = f"回答{self.calls}"
+        if stream:
+            return self._stream(content)
+        message = type("Message", (), {"content": content})
+        choice = type("Choice", (), {"message": message})
+        return type("Response", (), {"choices": [choice]})
+    
+    def _stream(self, content):
+        """ストリーミング応答のチャンク（最後は内容なし）"""
+        for i, text in enumerate(list(content) + [None]):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise ConnectionError("stream interrupted")
+            delta = type("Delta", (), {"content": text})
+            choice = type("Choice", (), {"delta": delta})
+            yield type("Chunk", (), {"choices": [choice]})
+
+class FakeOpenAIClient:
+    """OpenAIクライアントの代わり（APIを呼ばない）"""
+    
+    def __init__(self):
+        self.completions = FakeCompletions()
+        self.chat = type("Chat", (), {"completions": self.completions})
+
+def build_engine(persist_directory, client):
+    """フェイクのOpenAIクライアントを使うRAGエンジン"""
+    engine = SimpleRAGEngine(vector_db=SimpleVectorDatabase(persist_directory=persist_directory), use_openai=False)
+    engine.use_openai = True
+    engine.openai_client = client
+    return engine
+
+def test_answer_cache_levels():
+    """完全一致・類似質問でAPIを呼ばず、条件が変われば呼ぶこと"""
+    logger.info("=== 回答キャッシュテスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        client = FakeOpenAIClient()
+        engine = build_engine(persist_directory, client)
+        engine.vector_db.add_documents([
+            Document(page_content=text, metadata={"chunk_id": f"chunk_{i}", "filename": f"manual_{i}.pdf"})
+            for i, text in enumerate(DOCUMENTS)
+        ])
+        engine.vector_db.add_documents([Document(page_content=DOCUMENTS[0], metadata={"chunk_id": "chunk_0"})],
+                                       "NUCLEO-F401RE")
+        
+        first = engine.answer_question("GPIOの出力設定方法を教えてください")
+        assert first["answer"] == "回答1" and client.completions.calls == 1
+        
+        # 1段目：表記ゆれのみの質問は完全一致として扱う
+        assert engine.answer_question("ＧＰＩＯの出力設定方法を教えてください？")["answer"] == "回答1"
+        # 2段目：同じチャンクから回答するよく似た質問
+        assert engine.answer_question("GPIOの出力設定の方法を教えてください")["answer"] == "回答1"
+        assert client.completions.calls == 1
+        stats = engine.get_system_status()["answer_cache"]
+        assert stats["exact_hits"] == 1 and stats["similar_hits"] == 1, stats
+        
+        # 類似度が閾値未満の質問・別のマイコンではAPIを呼ぶ
+        assert engine.answer_question("GPIO出力の設定方法は？")["answer"] == "回答2"
+        assert engine.answer_question("GPIOの出力設定方法を教えてください", "NUCLEO-F401RE")["answer"] == "回答3"
+        
+        # 再起動後もディスクから読み込んだキャッシュを使う
+        restarted_client = FakeOpenAIClient()
+        restarted = build_engine(persist_directory, restarted_client)
+        assert restarted.answer_question("GPIOの出力設定方法を教えてください")["answer"] == "回答1"
+        assert restarted_client.completions.calls == 0
+        
+        # 検索されたチャンクの内容が変われば使わない
+        assert restarted.vector_db.replace_documents([
+            Document(page_content=DOCUMENTS[0] + " 出力速度はGPIO_SPEED_FREQ_LOWで設定する",
+                     metadata={"chunk_id": "chunk_0", "filename": "manual_0.pdf"})
+        ], "NUCLEO-F767ZI")
+        assert restarted.answer_question("GPIOの出力設定方法を教えてください")["answer"] == "回答1"
+        assert restarted_client.completions.calls == 1
+        logger.info("  ✓ 完全一致・類似質問・再起動後のキャッシュを確認")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_answer_cache_eviction():
+    """件数上限を超えたら最も古く使われた回答から破棄すること"""
+    logger.info("=== 回答キャッシュの件数上限テスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        client = FakeOpenAIClient()
+        engine = build_engine(persist_directory, client)
+        engine.vector_db.add_documents([
+            Document(page_content=text, metadata={"chunk_id": f"chunk_{i}"}) for i, text in enumerate(DOCUMENTS)
+        ])
+        engine.answer_cache.max_entries = 2
+        questions = ["GPIOの出力設定", "UARTの送信設定", "GPIOの出力設定", "ADCの変換"]
+        for question in questions:
+            engine.answer_question(question)
+        assert client.completions.calls == 3
+        assert engine.answer_cache.stats()["entries"] == 2
+        
+        engine.answer_question("GPIOの出力設定")
+        assert client.completions.calls == 3
+        engine.answer_question("UARTの送信設定")
+        assert client.completions.calls == 4
+        logger.info("  ✓ 件数上限で古く使われた回答から破棄")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_answer_cache_log():
+    """登録は1行の追記で、再起動後は後の行が優先され、書きかけの行・旧形式も読めること"""
+    logger.info("=== 回答キャッシュの追記ログテスト ===")
+    directory = tempfile.mkdtemp()
+    cache_file = os.path.join(directory, "answer_cache.json")
+    docs = [(Document(page_content=DOCUMENTS[0], metadata={"chunk_id": "chunk_0"}), 0.1)]
+    
+    def open_cache():
+        return AnswerCache(cache_file, 3, 0.9, lambda question: {question: 1.0})
+    
+    def count_lines():
+        with open(cache_file, "r", encoding="utf-8") as f:
+            return sum(1 for _ in f)
+    
+    try:
+        cache = open_cache()
+        for i in range(4):
+            cache.put(f"質問{i}", "NUCLEO-F767ZI", docs, f"回答{i}")
+        cache.put("質問3", "NUCLEO-F767ZI", docs, "回答3（更新）")
+        assert count_lines() == 5, "書き直さず1行ずつ追記する"
+        cache.put("質問4", "NUCLEO-F767ZI", docs, "回答4")
+        assert count_lines() == 6
+        cache.put("質問5", "NUCLEO-F767ZI", docs, "回答5")
+        assert count_lines() == 3, "行数が上限の2倍を超えたら現在のエントリで書き直す"
+        
+        restarted = open_cache()
+        assert [restarted.get(f"質問{i}", "NUCLEO-F767ZI", docs) for i in range(2, 6)] == [
+            None, "回答3（更新）", "回答4", "回答5"]
+        
+        # 書きかけの行は無視し、続く追記のために書き直す
+        with open(cache_file, "a", encoding="utf-8") as f:
+            f.write('{"question": "質問6", "micro')
+        restarted = open_cache()
+        assert restarted.stats()["entries"] == 3 and count_lines() == 3
+        restarted.put("質問6", "NUCLEO-F767ZI", docs, "回答6")
+        assert open_cache().get("質問6", "NUCLEO-F767ZI", docs) == "回答6"
+        
+        # 旧形式（全エントリのJSON配列）
+        with open(cache_file, "w", encoding="utf-8") as f:
+            json.dump([{"question": "質問7", "microcontroller": "NUCLEO-F767ZI", "context": context_key(docs),
+                        "vector": {"質問7": 1.0}, "answer": "回答7"}], f)
+        assert open_cache().get("質問7", "NUCLEO-F767ZI", docs) == "回答7" and count_lines() == 1
+        
+        # 追記中（ファイルのロック中）も、登録済みの回答の参照は待たない
+        cache = open_cache()
+        with cache._file_lock:
+            writer = threading.Thread(target=cache.put, args=("質問8", "NUCLEO-F767ZI", docs, "回答8"))
+            writer.start()
+            writer.join(0.2)
+            assert writer.is_alive(), "追記はファイルのロックを待つ"
+            assert cache.get("質問8", "NUCLEO-F767ZI", docs) == "回答8"
+        writer.join(5)
+        assert open_cache().get("質問8", "NUCLEO-F767ZI", docs) == "回答8"
+        logger.info("  ✓ 追記ログで保存し、書きかけの行・旧形式も読み込む")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def main():
+    """メインテスト関数"""
+    test_answer_cache_levels()
+    test_answer_cache_eviction()
+    test_answer_cache_log()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+非同期RAGエンジンのテスト
+複数の質問が同時に処理され、タイムアウト時はテンプレート回答に切り替わり、
+キャンセルした質問が他の質問を妨げないことを確認する
+"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+import logging
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+from langchain.schema import Document
+from app.models.simple_vector_db import SimpleVectorDatabase
+from app.models.async_rag_engine import AsyncSimpleRAGEngine
+from test_answer_cache import DOCUMENTS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class FakeAsyncCompletions:
+    """一定の遅延で回答するchat.completionsの代わり（非同期版）"""
+    
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0  # 同時に処理中だった呼び出し数の最大
+    
+    async def create(self, model, messages, stream=False, **kwargs):
+        self.calls += 1
+        content = f"回答{self.calls}"
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.active -= 1
+        if stream:
+            return self._stream(content)
+        message = type("Message", (), {"content": content})
+        choice = type("Choice", (), {"message": message})
+        return type("Response", (), {"choices": [choice]})
+    
+    async def _stream(self, content):
+        """ストリーミング応答のチャンク（1文字ずつ）"""
+        for text in content:
+            delta = type("Delta", (), {"content": text})
+            choice = type("Choice", (), {"delta": delta})
+            yield type("Chunk", (), {"choices": [choice]})
+
+class FakeAsyncOpenAIClient:
+    """非同期OpenAIクライアントの代わり（APIを呼ばない）"""
+    
+    def __init__(self, latency=0.0):
+        self.completions = FakeAsyncCompletions(latency)
+        self.chat = type("Chat", (), {"completions": self.completions})
+
+def build_async_engine(persist_directory, client):
+    """フェイクの非同期クライアントを使うRAGエンジン（回答キャッシュなし）"""
+    vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+    vector_db.add_documents([
+        Document(page_content=text, metadata={"chunk_id": f"chunk_{i}", "filename": f"manual_{i}.pdf"})
+        for i, text in enumerate(DOCUMENTS)
+    ])
+    engine = AsyncSimpleRAGEngine(vector_db, async_openai_client=client)
+    engine.answer_cache.max_entries = 0
+    return engine
+
+def test_concurrent_questions():
+    """複数の質問が同時に処理され、結果は質問の順に返ること"""
+    logger.info("=== 同時回答テスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        client = FakeAsyncOpenAIClient(latency=0.2)
+        engine = build_async_engine(persist_directory, client)
+        questions = ["GPIOの出力設定", "UARTの送信設定", "ADCの変換", "クロック設定"] * 2
+        
+        start = time.perf_counter()
+        results = asyncio.run(engine.answer_questions(questions, max_concurrency=8))
+        elapsed = time.perf_counter() - start
+        assert client.completions.max_active == 8, client.completions.max_active
+        assert elapsed < 0.2 * len(questions) / 2, f"逐次実行より十分速いこと: {elapsed:.2f}s"
+        assert sorted(result["answer"] for result in results) == sorted(f"回答{i}" for i in range(1, 9))
+        assert [result["sources"] for result in results] == [engine._extract_sources(
+            engine._retrieve_documents(question, "NUCLEO-F767ZI", 5)) for question in questions]
+        
+        client.completions.max_active = 0
+        asyncio.run(engine.answer_questions(questions, max_concurrency=2))
+        assert client.completions.max_active == 2
+        logger.info(f"  ✓ 8問を{elapsed:.2f}秒で同時に回答")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_timeout_and_cancellation():
+    """タイムアウト時はテンプレート回答、キャンセルした質問は他の質問を妨げないこと"""
+    logger.info("=== タイムアウト・キャンセルテスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        client = FakeAsyncOpenAIClient(latency=5.0)
+        engine = build_async_engine(persist_directory, client)
+        question = "UARTの送信設定"
+        relevant_docs = engine._retrieve_documents(question, "NUCLEO-F767ZI", 5)
+        template_answer = engine._generate_template_answer(question, relevant_docs, "NUCLEO-F767ZI",
+                                                           engine._source_string(relevant_docs))
+        
+        start = time.perf_counter()
+        result = asyncio.run(engine.answer_question(question, timeout=0.1))
+        assert result["answer"] == template_answer and time.perf_counter() - start < 1.0
+        
+        async def cancel_one():
+            slow = asyncio.create_task(engine.answer_question("GPIOの出力設定"))
+            await asyncio.sleep(0.05)
+            slow.cancel()
+            try:
+                await slow
+                raise AssertionError("キャンセルされること")
+            except asyncio.CancelledError:
+                pass
+            client.completions.latency = 0.0
+            return await engine.answer_question(question)
+        
+        assert asyncio.run(cancel_one())["answer"].startswith("回答")
+        assert client.completions.active == 0
+        logger.info("  ✓ タイムアウト時のテンプレート回答・キャンセルを確認")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_async_stream():
+    """非同期ストリーミングでも参考資料が先に返ること"""
+    logger.info("=== 非同期ストリーミングテスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        engine = build_async_engine(persist_directory, FakeAsyncOpenAIClient())
+        
+        async def collect():
+            return [event async for event in engine.answer_question_stream("GPIOの出力設定")]
+        
+        events = asyncio.run(collect())
+        assert events[0]["type"] == "metadata" and events[0]["num_sources"] > 0
+        assert [event["text"] for event in events[1:]] == ["回", "答", "1"]
+        logger.info("  ✓ 参考資料の後に回答の断片が返る")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def main():
+    """メインテスト関数"""
+    test_concurrent_questions()
+    test_timeout_and_cancellation()
+    test_async_stream()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()
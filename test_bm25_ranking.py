@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+BM25/BM25+ 順位付けのテスト
+転置インデックス上のBM25検索が、全件走査で計算したBM25と一致することを確認する
+"""
+import os
+import sys
+import math
+import random
+import shutil
+import tempfile
+import logging
+from collections import Counter
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+from app.models.simple_vector_db import SimpleVectorDatabase
+from config import Config
+from test_inverted_index import (build_synthetic_corpus, legacy_search, legacy_tokenize, assert_same_results,
+                                 EN_WORDS, JA_WORDS)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def reference_bm25_search(documents, query, k, ranking="bm25", microcontroller=None, category=None,
+                          score_threshold=0.1, file_type=None, source=None):
+    """全件走査によるBM25検索（スコアはクエリで到達しうる最大スコアで正規化）"""
+    k1, b = Config.BM25_K1, Config.BM25_B
+    delta = Config.BM25_PLUS_DELTA if ranking == "bm25+" else 0.0
+    token_lists = [legacy_tokenize(doc.page_content) for doc in documents]
+    token_doc_count = Counter()
+    for tokens in token_lists:
+        token_doc_count.update(set(tokens))
+    num_docs = len(documents)
+    average_length = sum(len(tokens) for tokens in token_lists) / num_docs
+    idf_scores = {token: math.log(1 + (num_docs - count + 0.5) / (count + 0.5))
+                  for token, count in token_doc_count.items()}
+    
+    query_counts = {token: count for token, count in Counter(legacy_tokenize(query)).items() if token in idf_scores}
+    max_score = sum(count * idf_scores[token] for token, count in query_counts.items()) * (k1 + 1 + delta)
+    
+    results = []
+    for doc, tokens in zip(documents, token_lists):
+        if microcontroller and doc.metadata.get("microcontroller") != microcontroller:
+            continue
+        if category and doc.metadata.get("category") != category:
+            continue
+        if file_type and doc.metadata.get("file_type") != file_type:
+            continue
+        if source and doc.metadata.get("source") != source:
+            continue
+        doc_counts = Counter(tokens)
+        score = 0.0
+        for token, query_count in query_counts.items():
+            f = doc_counts.get(token, 0)
+            if f:
+                saturation = f * (k1 + 1) / (f + k1 * (1 - b + b * len(tokens) / average_length))
+                score += query_count * idf_scores[token] * (saturation + delta)
+        score = score / max_score if max_score else 0.0
+        if score >= score_threshold:
+            results.append((doc, 1.0 - score))
+    results.sort(key=lambda x: x[1])
+    return results[:k]
+
+def test_bm25_parity():
+    """BM25/BM25+の検索結果が全件走査と一致し、TF-IDFの結果は変わらないこと"""
+    logger.info("=== BM25 パリティテスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        corpus = build_synthetic_corpus(num_docs=400, seed=5)
+        for mc, documents in corpus.items():
+            assert vector_db.add_documents(documents[:100], mc)
+            assert vector_db.add_documents(documents[100:], mc)
+        all_documents = [doc for documents in corpus.values() for doc in documents]
+        
+        # 置き換え（削除＋追加）後も総トークン数・文書頻度が保たれること
+        assert vector_db.replace_documents(corpus["NUCLEO-F401RE"][:50], "NUCLEO-F401RE")
+        
+        rng = random.Random(1)
+        queries = ["GPIO 設定", "uart baudrate 割り込み", "timer timer pwm", "unknownword"]
+        queries += [" ".join(rng.choices(EN_WORDS + JA_WORDS, k=rng.randint(1, 4))) for _ in range(20)]
+        
+        def assert_bm25_parity(db, documents):
+            for ranking in ["bm25", "bm25+"]:
+                for query in queries:
+                    for kwargs in [
+                        {"k": 5},
+                        {"k": 500, "score_threshold": 0.0},
+                        {"k": 10, "microcontroller": "NUCLEO-F401RE", "score_threshold": 0.05},
+                        {"k": 10, "category": "hardware"},
+                    ]:
+                        assert_same_results(db.search_similar_documents(query, ranking=ranking, **kwargs),
+                                            reference_bm25_search(documents, query, ranking=ranking, **kwargs))
+        
+        assert_bm25_parity(vector_db, all_documents)
+        assert_bm25_parity(SimpleVectorDatabase(persist_directory=persist_directory), all_documents)
+        
+        # 削除後は有効なドキュメントのみで計算されること
+        assert vector_db.delete_by_microcontroller("NUCLEO-F401RE") == len(corpus["NUCLEO-F401RE"])
+        remaining = corpus["NUCLEO-F767ZI"]
+        assert_bm25_parity(vector_db, remaining)
+        assert vector_db.compact()
+        assert_bm25_parity(SimpleVectorDatabase(persist_directory=persist_directory), remaining)
+        
+        # 既定（TF-IDF）の結果は変わらないこと
+        for query in queries[:4]:
+            assert_same_results(vector_db.search_similar_documents(query, k=10),
+                                legacy_search(remaining, query, k=10))
+        assert vector_db.search_similar_documents("GPIO", ranking="unknown") == []
+        logger.info("  ✓ BM25/BM25+ともに全件走査と同一の結果")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_bm25_pruned_top_k_parity():
+    """BM25でも枝刈り検索の上位k件が枝刈りなしの結果と一致すること"""
+    logger.info("=== BM25 上位k件 枝刈りパリティテスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        corpus = build_synthetic_corpus(num_docs=800, seed=9)
+        for mc, documents in corpus.items():
+            assert vector_db.add_documents(documents, mc)
+        
+        rng = random.Random(4)
+        shards = list(vector_db.shards.values())
+        for _ in range(60):
+            query = " ".join(rng.choices(EN_WORDS + JA_WORDS, k=rng.randint(1, 5)))
+            for ranking in ["bm25", "bm25+"]:
+                for k in [1, 5]:
+                    expected = vector_db._rank_documents(query, None, 0.0, shards, ranking=ranking)
+                    actual = vector_db._rank_documents(query, k, 0.0, shards, ranking=ranking)
+                    assert [(shard.name, doc_id, score) for shard, doc_id, score in actual] == \
+                        [(shard.name, doc_id, score) for shard, doc_id, score in expected[:k]], query
+        logger.info("  ✓ 枝刈りしても上位k件は同一")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def main():
+    """メインテスト関数"""
+    test_bm25_parity()
+    test_bm25_pruned_top_k_parity()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+テキストクリーニングのテスト
+str.replaceと正規表現1回による_clean_textが、従来の正規表現4回による実装と
+どんな入力でも完全に同じ文字列を返すことを確認する
+"""
+import os
+import re
+import sys
+import random
+import logging
+
+import pytest
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+try:
+    from app.services.document_processor import DocumentProcessor
+    PDF_AVAILABLE = True
+except ImportError as e:
+    logger.warning(f"pdfplumber / PyPDF2 が利用できないため、テキストクリーニングのテストをスキップします: {e}")
+    PDF_AVAILABLE = False
+
+# PDFライブラリがなければ（成功扱いにせず）スキップとして報告する
+requires_pdf = pytest.mark.skipif(not PDF_AVAILABLE, reason="pdfplumber / PyPDF2 が利用できません")
+
+def legacy_clean_text(text: str) -> str:
+    """従来の_clean_text（正規表現で全体を4回置換する）"""
+    if not text:
+        return ""
+    
+    text = re.sub(r'\r\n|\r', '\n', text)
+    text = re.sub(r' +', ' ', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = re.sub(r'[^\w\s\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF\u3400-\u4DBF\u002D\u002E\u0028\u0029\u003A\u003B\u002C\u0021\u003F\u300C\u300D\u3001\u3002\u30FB\u002F\u005C\u0040\u0023\u0024\u0025\u005E\u0026\u002A\u002B\u003D\u007B\u007D\u005B\u005D\u007C\u003C\u003E\u007E\u0060\u0027\u0022]', ' ', text)
+    
+    return text.strip()
+
+def datasheet_text(pages: int, language: str = "en", seed: int = 0) -> str:
+    """抽出済みのデータシート・アプリケーションノートに似たテキスト（ページ見出し付き）"""
+    if language == "en":
+        words = ("The GPIO port mode register GPIOx_MODER configures the I/O direction. Reset value: 0x0000 0000 "
+                 "VDD = 3.3 V, TA = 25 °C, typ. ±5% µA (1) Table 45. Electrical characteristics – see Section 6.3.2 "
+                 "• Note: ADC1/ADC2/ADC3 fADC max 36 MHz").split(" ")
+    else:
+        words = ("GPIOの 出力モードを 設定します。 HAL_GPIO_WritePin()関数で ピンの レベルを 切り替えます。 "
+                 "図3. クロックツリー （注） 216MHz動作時の 消費電流は ±5% 以内 → 表4を参照 ■ ポイント").split(" ")
+    random.seed(seed)
+    text = ""
+    for page in range(1, pages + 1):
+        lines = []
+        for _ in range(55):
+            line = " ".join(random.choice(words) for _ in range(random.randint(4, 14)))
+            if random.random() < 0.15:
+                line = line.replace(" ", "  ", 2)
+            lines.append(line)
+        text += f"\n--- Page {page} ---\n" + "\n".join(lines)
+    return text
+
+@requires_pdf
+def test_matches_legacy_on_random_text():
+    """空白・改行・記号・制御文字・任意のコードポイントを混ぜた入力で従来と同じ結果になること"""
+    logger.info("=== ランダムな入力のテスト ===")
+    processor = DocumentProcessor()
+    alphabet = [" ", "  ", "\n", "\r", "\r\n", "\n\n\n", "\t", "\x0b", "\x0c", "\x1c", "\x00", "\x7f", "\u3000", "\u00a0",
+                "GPIO", "_", "設定", "カタカナ", "ｶﾀｶﾅ", "「", "」", "、", "。", "・", "（", "）", "±", "°", "µ", "•",
+                "\u0301", "\U0001F600", "\U00020000", "\u3400", "\u9FAF", "\u9FB0", "-", ".", "~", "`", "'", '"', "\\"]
+    random.seed(0)
+    for i in range(20000):
+        if i % 4 == 0:
+            text = "".join(chr(random.randrange(0x110000)) for _ in range(random.randint(0, 12)))
+        else:
+            text = "".join(random.choice(alphabet) for _ in range(random.randint(0, 16)))
+        assert processor._clean_text(text) == legacy_clean_text(text), repr(text)
+    logger.info("  ✓ 20000件の入力で従来と一致")
+
+@requires_pdf
+def test_matches_legacy_on_documents():
+    """データシートに似た長いテキストで従来と同じ結果になること"""
+    logger.info("=== 長いテキストのテスト ===")
+    processor = DocumentProcessor()
+    for language in ["en", "ja"]:
+        text = datasheet_text(40, language)
+        text = text.replace("\n", "\r\n", 50).replace("\n", "\n\n\n\n", 20)
+        assert processor._clean_text(text) == legacy_clean_text(text)
+    logger.info("  ✓ 英語・日本語のテキストで従来と一致")
+
+def main():
+    """メインテスト関数"""
+    if not PDF_AVAILABLE:
+        return
+    test_matches_legacy_on_random_text()
+    test_matches_legacy_on_documents()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()
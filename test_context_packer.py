@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+コンテキストパッカーのテスト
+隣接チャンクのオーバーラップが一度だけ含まれ、トークン予算内でスコア/トークン数の
+高いチャンクが選ばれ、チャンクごとのトークン数がキャッシュされることを確認する
+"""
+import os
+import sys
+import shutil
+import tempfile
+import logging
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from app.models.context_packer import ContextPacker, estimate_tokens, overlap_length
+from app.models.simple_rag_engine import Config
+from test_answer_cache import FakeOpenAIClient, build_engine
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MANUAL_TEXT = "".join(f"GPIO{i}番ピンの設定では、HAL_GPIO_Initを呼んで出力モードを選びます。" for i in range(80))
+
+def split_manual(filename="gpio.pdf", score=0.5):
+    """マニュアルを取り込み時と同じ設定で分割した（ドキュメント, スコア）のリスト"""
+    splitter = RecursiveCharacterTextSplitter(chunk_size=Config.CHUNK_SIZE, chunk_overlap=Config.CHUNK_OVERLAP,
+                                              length_function=len, separators=["\n\n", "\n", "。", ".", " ", ""])
+    return [(Document(page_content=chunk, metadata={"chunk_id": f"{filename}_{i}", "filename": filename}), score)
+            for i, chunk in enumerate(splitter.split_text(MANUAL_TEXT))]
+
+def test_overlap_removed():
+    """隣接チャンクの重なりは一度だけ含まれ、つなげると元の本文になること"""
+    logger.info("=== オーバーラップ除去テスト ===")
+    alphabet = "abcdefghijklmnopqrstuvwxyz"
+    assert overlap_length("0123456789" + alphabet, alphabet + "0123456789", 200) == 26
+    assert overlap_length("0123456789" + alphabet, alphabet + "0123456789", 20) == 0, "max_overlapより長い一致は見ない"
+    assert overlap_length("0123456789" + alphabet, alphabet[10:] + "0123456789", 200) == 0, "短い一致は無視"
+    
+    relevant_docs = split_manual()
+    assert len(relevant_docs) > 2
+    packer = ContextPacker()
+    packed = packer.pack(relevant_docs[::-1], 100000)
+    assert [doc for doc, _ in packed] == [doc for doc, _ in relevant_docs[::-1]], "元の順位順"
+    assert "".join(content for _, content in packed[::-1]) == MANUAL_TEXT
+    
+    # 同じ本文でも別の文書のチャンクは重ならないものとして扱う
+    other = [(Document(page_content=doc.page_content, metadata={"filename": "other.pdf"}), score)
+             for doc, score in relevant_docs[:1]]
+    packed = packer.pack(relevant_docs[:1] + other, 100000)
+    assert [content for _, content in packed] == [relevant_docs[0][0].page_content] * 2
+    logger.info("  ✓ オーバーラップを除いて元の本文を再現")
+
+def test_budget_and_density():
+    """予算内に収まり、スコア/トークン数の高いチャンクから選ばれること"""
+    logger.info("=== トークン予算テスト ===")
+    packer = ContextPacker()
+    long_doc = Document(page_content="クロック設定の詳細。" * 100, metadata={"filename": "clock.pdf"})
+    short_doc = Document(page_content="PLLで216MHzにする。", metadata={"filename": "pll.pdf"})
+    weak_doc = Document(page_content="関係の薄い説明です。", metadata={"filename": "misc.pdf"})
+    relevant_docs = [(long_doc, 0.1), (short_doc, 0.2), (weak_doc, 0.9)]
+    
+    packed = packer.pack(relevant_docs, 40, overhead_tokens=4)
+    assert [doc for doc, _ in packed] == [short_doc, weak_doc], "元の順位順に、予算に収まるものだけ"
+    assert sum(packer.count_tokens(content) + 4 for _, content in packed) <= 40
+    
+    packed = packer.pack(relevant_docs, 10000)
+    assert [doc for doc, _ in packed] == [long_doc, short_doc, weak_doc]
+    assert packed[0][1] == long_doc.page_content, "予算内なら途中で切らない"
+    
+    # 1件も収まらない場合は最上位のチャンクを文の区切りで切り詰める
+    packed = packer.pack([(long_doc, 0.1)], 25)
+    assert len(packed) == 1 and packed[0][1].endswith("。") and packer.count_tokens(packed[0][1]) <= 25
+    assert estimate_tokens("abcdefgh") == 2 and estimate_tokens("設定") == 2
+    logger.info("  ✓ 予算内でスコア/トークン数の高い順に選択")
+
+def test_token_count_cache():
+    """チャンクごとのトークン数はキャッシュされ、同じチャンクでは数え直さないこと"""
+    logger.info("=== トークン数キャッシュテスト ===")
+    packer = ContextPacker()
+    calls = []
+    count_tokens = packer.count_tokens
+    packer.count_tokens = lambda text: calls.append(text) or count_tokens(text)
+    relevant_docs = split_manual()
+    
+    first = packer.pack(relevant_docs, 100000)
+    counted = len(calls)
+    assert counted > 0
+    assert packer.pack(relevant_docs, 100000) == first and len(calls) == counted
+    logger.info(f"  ✓ 2回目は数え直しなし（1回目{counted}回）")
+
+def test_engine_prompt_uses_budget():
+    """回答生成のプロンプトが予算内に収まり、チャンクの重なりを含まないこと"""
+    logger.info("=== プロンプト構築テスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        engine = build_engine(persist_directory, FakeOpenAIClient())
+        relevant_docs = split_manual()
+        original_budget = Config.CONTEXT_TOKEN_BUDGET
+        try:
+            Config.CONTEXT_TOKEN_BUDGET = 100000
+            messages = engine._build_openai_messages("GPIOの設定", relevant_docs, "NUCLEO-F767ZI", "gpio.pdf")
+            context = messages[1]["content"]
+            assert all(context.count(f"GPIO{i}番ピン") == 1 for i in range(80)), "重なりを含まない"
+            
+            Config.CONTEXT_TOKEN_BUDGET = 300
+            messages = engine._build_openai_messages("GPIOの設定", relevant_docs, "NUCLEO-F767ZI", "gpio.pdf")
+        finally:
+            Config.CONTEXT_TOKEN_BUDGET = original_budget
+        context = messages[1]["content"].split("【コンテキスト情報】")[1].split("【質問】")[0]
+        assert 0 < engine.context_packer.count_tokens(context) <= 300
+        logger.info("  ✓ プロンプトのコンテキストは予算内")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def main():
+    """メインテスト関数"""
+    test_overlap_removed()
+    test_budget_and_density()
+    test_token_count_cache()
+    test_engine_prompt_uses_budget()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()
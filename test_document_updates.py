@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+ドキュメント削除・更新のテスト
+ソース単位・マイコン単位の削除とchunk_idによる置き換えが、
+全件を再構築した場合と同じ検索結果・文書頻度になることを確認する
+"""
+import os
+import sys
+import shutil
+import tempfile
+import logging
+from collections import Counter
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+from langchain.schema import Document
+from app.models.simple_vector_db import SimpleVectorDatabase
+from test_inverted_index import build_synthetic_corpus, legacy_search, legacy_tokenize, assert_same_results
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+QUERIES = ["GPIO 設定", "uart baudrate 割り込み", "timer pwm prescaler", "クロック"]
+
+def build_corpus_with_sources():
+    """ソースファイル名付きの合成コーパス"""
+    corpus = build_synthetic_corpus(num_docs=200)
+    for mc, documents in corpus.items():
+        for i, doc in enumerate(documents):
+            doc.metadata["source"] = f"{mc}_datasheet_{i % 4}.pdf"
+            doc.metadata["microcontroller"] = mc
+    return corpus
+
+def assert_matches_documents(vector_db, documents):
+    """文書頻度と検索結果が、指定ドキュメントのみから計算した値と一致すること"""
+    expected_df = Counter()
+    for doc in documents:
+        expected_df.update(set(legacy_tokenize(doc.page_content)))
+    actual_df = {token: int(vector_db.document_frequencies[token_id])
+                 for token, token_id in vector_db.vocabulary.items()
+                 if vector_db.document_frequencies[token_id]}
+    assert actual_df == dict(expected_df)
+    
+    for query in QUERIES:
+        for kwargs in [{"k": 10}, {"k": 500, "score_threshold": 0.0}]:
+            assert_same_results(vector_db.search_similar_documents(query, **kwargs),
+                                legacy_search(documents, query, **kwargs))
+
+def test_delete_by_source_and_microcontroller():
+    """ソース単位・マイコン単位で削除できること"""
+    logger.info("=== ドキュメント削除テスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        corpus = build_corpus_with_sources()
+        for mc, documents in corpus.items():
+            assert vector_db.add_documents(documents, mc)
+        remaining = [doc for documents in corpus.values() for doc in documents]
+        
+        source = "NUCLEO-F767ZI_datasheet_1.pdf"
+        expected_deleted = sum(1 for doc in remaining if doc.metadata["source"] == source)
+        assert vector_db.delete_by_source(source) == expected_deleted
+        assert vector_db.delete_by_source(source) == 0, "削除済みチャンクは再削除されない"
+        remaining = [doc for doc in remaining if doc.metadata["source"] != source]
+        assert_matches_documents(vector_db, remaining)
+        
+        assert vector_db.delete_by_microcontroller("NUCLEO-F401RE") == len(corpus["NUCLEO-F401RE"])
+        remaining = [doc for doc in remaining if doc.metadata["microcontroller"] != "NUCLEO-F401RE"]
+        assert_matches_documents(vector_db, remaining)
+        assert vector_db.list_collections() == ["microcontroller_nucleo_f767zi"]
+        assert vector_db.get_collection_stats()["microcontroller_nucleo_f767zi"]["document_count"] == len(remaining)
+        
+        # 再オープン後・コンパクション後も削除が反映されていること
+        assert vector_db.wait_for_compaction(timeout=30)
+        assert_matches_documents(SimpleVectorDatabase(persist_directory=persist_directory), remaining)
+        assert vector_db.compact()
+        assert vector_db.count_documents() == len(remaining)
+        assert_matches_documents(vector_db, remaining)
+        logger.info("  ✓ 削除後も全件再構築と同一の結果")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_replace_by_chunk_id():
+    """chunk_idが一致するチャンクを置き換えられること"""
+    logger.info("=== chunk_id置き換えテスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        corpus = build_corpus_with_sources()
+        documents = corpus["NUCLEO-F767ZI"]
+        assert vector_db.add_documents(documents, "NUCLEO-F767ZI")
+        
+        revised = [
+            Document(page_content="改訂版 GPIO 設定 手順 pull-up", metadata={"chunk_id": documents[0].metadata["chunk_id"], "source": "rev.pdf"}),
+            Document(page_content="新規 DMA 転送 設定", metadata={"chunk_id": "new_chunk", "source": "rev.pdf"}),
+        ]
+        assert vector_db.replace_documents(revised, "NUCLEO-F767ZI")
+        assert vector_db.update_document(documents[1].metadata["chunk_id"], "改訂版 UART 受信 割り込み", {"source": "rev.pdf"})
+        
+        expected = [Document(page_content="改訂版 UART 受信 割り込み",
+                             metadata={"chunk_id": documents[1].metadata["chunk_id"], "microcontroller": "NUCLEO-F767ZI"})]
+        expected = documents[2:] + revised + expected
+        assert_matches_documents(vector_db, expected)
+        
+        reopened_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        assert_matches_documents(reopened_db, expected)
+        chunk_ids = [doc.metadata["chunk_id"] for doc, _ in reopened_db.search_similar_documents("改訂版 UART 受信", k=50, score_threshold=0.0)]
+        assert chunk_ids.count(documents[1].metadata["chunk_id"]) == 1
+        assert reopened_db.search_similar_documents("改訂版 UART 受信", k=1)[0][0].metadata["microcontroller"] == "NUCLEO-F767ZI"
+        logger.info("  ✓ 置き換え後も全件再構築と同一の結果")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def main():
+    """メインテスト関数"""
+    test_delete_by_source_and_microcontroller()
+    test_replace_by_chunk_id()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+マイコン別シャードのテスト
+シャードの遅延読み込み・共通シャードの検索対象への追加・
+シャード導入前のインデックスからの移行を確認する
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import logging
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+import numpy as np
+from scipy import sparse
+from langchain.schema import Document
+from app.models.simple_vector_db import SimpleVectorDatabase
+from app.models.index_segment import IndexSegment
+from app.models.index_shard import COMMON_SHARD
+from test_inverted_index import build_synthetic_corpus, legacy_search, assert_same_results
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_lazy_shard_loading():
+    """マイコン指定の検索では、そのマイコンと共通シャードのみが開かれること"""
+    logger.info("=== シャード遅延読み込みテスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        corpus = build_synthetic_corpus(num_docs=300)
+        for mc, documents in corpus.items():
+            assert vector_db.add_documents(documents, mc)
+        common_documents = [
+            Document(page_content="GPIO 設定 共通 HAL", metadata={"chunk_id": "common_0"}),
+            Document(page_content="クロック 設定 共通", metadata={"chunk_id": "common_1"}),
+        ]
+        assert vector_db.add_documents(common_documents, COMMON_SHARD)
+        all_documents = [doc for documents in corpus.values() for doc in documents] + common_documents
+        
+        reopened_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        assert reopened_db.count_documents() == len(all_documents)
+        assert reopened_db.count_documents("NUCLEO-F401RE") == len(corpus["NUCLEO-F401RE"])
+        assert not any(shard.is_loaded for shard in reopened_db.shards.values()), "起動時はシャードを開かない"
+        
+        results = reopened_db.search_similar_documents("GPIO 設定", k=300, microcontroller="NUCLEO-F401RE", score_threshold=0.0)
+        loaded = {name for name, shard in reopened_db.shards.items() if shard.is_loaded}
+        assert loaded == {"NUCLEO-F401RE", COMMON_SHARD}
+        
+        # 共通シャードも含めて検索され、スコアは全シャード共通のIDFで計算されること
+        expected_documents = corpus["NUCLEO-F401RE"] + common_documents
+        expected = [(doc, score) for doc, score in legacy_search(all_documents, "GPIO 設定", k=len(all_documents), score_threshold=0.0)
+                    if doc in expected_documents][:300]
+        assert_same_results(results, expected)
+        assert "common_0" in [doc.metadata["chunk_id"] for doc, _ in results]
+        
+        # マイコン未指定なら全シャードを横断して従来と同じ結果になること
+        for query in ["GPIO 設定", "uart baudrate 割り込み"]:
+            for kwargs in [{"k": 10}, {"k": 400, "score_threshold": 0.0}]:
+                assert_same_results(reopened_db.search_similar_documents(query, **kwargs),
+                                    legacy_search(all_documents, query, **kwargs))
+        logger.info("  ✓ 必要なシャードのみ読み込まれ、結果も従来実装と一致")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_unsharded_index_migration():
+    """シャード導入前（format_version 1）のインデックスから移行できること"""
+    logger.info("=== シャード形式への移行テスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        corpus = build_synthetic_corpus(num_docs=60)
+        documents = [doc for documents in corpus.values() for doc in documents]
+        for mc, docs in corpus.items():
+            for doc in docs:
+                doc.metadata["microcontroller"] = mc
+        
+        # 旧形式：1つのセグメントに全マイコンのチャンクが混在し、先頭チャンクは削除済み
+        index_directory = os.path.join(persist_directory, "simple_index")
+        os.makedirs(index_directory)
+        IndexSegment.write(
+            os.path.join(index_directory, "segment_000001"),
+            sparse.csr_matrix((1, len(documents)), dtype=np.float32),
+            ((doc.page_content, doc.metadata) for doc in documents),
+            np.arange(len(documents), dtype=np.int64)
+        )
+        with open(os.path.join(index_directory, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({"format_version": 1, "generation": 1, "segments": ["segment_000001"],
+                       "tombstones": {"segment_000001": [0]}, "num_docs": len(documents),
+                       "vocab_size": 0, "vocabulary_bytes": 0}, f)
+        
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        live_documents = documents[1:]
+        assert set(vector_db.shards) == set(corpus)
+        assert vector_db.count_documents() == len(live_documents)
+        assert not os.path.exists(os.path.join(index_directory, "segment_000001"))
+        for db in [vector_db, SimpleVectorDatabase(persist_directory=persist_directory)]:
+            for query in ["GPIO 設定", "クロック"]:
+                assert_same_results(db.search_similar_documents(query, k=100, score_threshold=0.0),
+                                    legacy_search(live_documents, query, k=100, score_threshold=0.0))
+        logger.info("  ✓ 旧形式のインデックスをシャード形式へ移行")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def main():
+    """メインテスト関数"""
+    test_lazy_shard_loading()
+    test_unsharded_index_migration()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+オンディスク・インデックス形式のテスト
+セグメントの書き出し・mmapでの再オープン・本文の遅延読み込み・旧pickleからの移行・
+追記型セグメントのコンパクションを確認する
+"""
+import os
+import sys
+import json
+import pickle
+import shutil
+import tempfile
+import logging
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+from collections import Counter
+from langchain.schema import Document
+from app.models.simple_vector_db import SimpleVectorDatabase
+from config import Config
+from test_inverted_index import build_synthetic_corpus, legacy_search, legacy_tokenize, assert_same_results
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def sample_documents():
+    """テスト用ドキュメント"""
+    return [
+        Document(page_content="GPIO 設定 LED 点灯 HAL_GPIO_WritePin", metadata={"chunk_id": "gpio_0", "category": "hardware"}),
+        Document(page_content="UART 通信 baudrate 115200 設定", metadata={"chunk_id": "uart_0", "category": "user_manual"}),
+        Document(page_content="Timer PWM prescaler period 設定", metadata={"chunk_id": "tim_0", "category": "application_note"}),
+        Document(page_content="ADC 変換 DMA 転送", metadata={"chunk_id": "adc_0", "category": "application_note"}),
+    ]
+
+def test_segment_roundtrip():
+    """保存したセグメントを再オープンし、本文がヒット時にのみ読み込まれること"""
+    logger.info("=== セグメント形式 再オープンテスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        assert vector_db.add_documents(sample_documents(), "NUCLEO-F767ZI")
+        expected = vector_db.search_similar_documents("UART 設定", k=2)
+        
+        index_directory = os.path.join(persist_directory, "simple_index")
+        with open(os.path.join(index_directory, "index.json"), encoding="utf-8") as f:
+            header = json.load(f)
+        assert header["format_version"] == 2
+        assert header["num_docs"] == 4
+        assert header["shards"]["NUCLEO-F767ZI"]["num_docs"] == 4
+        assert not os.path.exists(os.path.join(persist_directory, "simple_vector_db.pkl"))
+        
+        reopened_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        assert reopened_db.count_documents() == 4
+        assert reopened_db._vocabulary is None, "語彙は検索まで読み込まない"
+        assert not reopened_db.shards["NUCLEO-F767ZI"].is_loaded, "シャードは検索まで開かない"
+        assert reopened_db.get_collection_stats()["microcontroller_nucleo_f767zi"]["document_count"] == 4
+        
+        actual = reopened_db.search_similar_documents("UART 設定", k=2)
+        assert [doc.metadata["chunk_id"] for doc, _ in actual] == [doc.metadata["chunk_id"] for doc, _ in expected]
+        assert actual[0][0].page_content == "UART 通信 baudrate 115200 設定"
+        assert actual[0][0].metadata["microcontroller"] == "NUCLEO-F767ZI"
+        
+        # 再オープン後の追加でも語彙IDが維持されること
+        assert reopened_db.add_documents([Document(page_content="UART 割り込み 受信", metadata={"chunk_id": "uart_1"})])
+        third_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        chunk_ids = [doc.metadata["chunk_id"] for doc, _ in third_db.search_similar_documents("UART 受信", k=5)]
+        assert chunk_ids[0] == "uart_1"
+        assert "uart_0" in chunk_ids
+        logger.info("  ✓ セグメントの再オープンと遅延読み込みを確認")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_legacy_pickle_migration():
+    """旧pickle形式から読み込んでセグメント形式へ移行できること"""
+    logger.info("=== 旧pickle移行テスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        documents = sample_documents()
+        for doc in documents:
+            doc.metadata["microcontroller"] = "NUCLEO-F767ZI"
+        legacy_data = {
+            "documents": [(doc.page_content, doc.metadata) for doc in documents],
+            "tfidf_vectors": [],
+            "vocabulary": [],
+            "idf_scores": {}
+        }
+        with open(os.path.join(persist_directory, "simple_vector_db.pkl"), "wb") as f:
+            pickle.dump(legacy_data, f)
+        
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        assert vector_db.count_documents("NUCLEO-F767ZI") == 4
+        assert os.path.exists(os.path.join(persist_directory, "simple_index", "index.json"))
+        results = vector_db.search_similar_documents("ADC DMA", k=1)
+        assert results and results[0][0].metadata["chunk_id"] == "adc_0"
+        logger.info("  ✓ 旧pickleからの移行を確認")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_append_only_segments_and_compaction():
+    """追加ごとに新しいセグメントが書かれ、コンパクションで削除済みチャンクが取り除かれること"""
+    logger.info("=== 追記型セグメント・コンパクションテスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        corpus = build_synthetic_corpus(num_docs=120)
+        documents = [doc for docs in corpus.values() for doc in docs]
+        for start in range(0, len(documents), 40):
+            assert vector_db.add_documents(documents[start:start + 40])
+        
+        # 既存セグメントは書き換えられず、バッチごとにセグメントが増えること
+        shard = vector_db.shards["NUCLEO-F767ZI"]
+        segment_names = [segment.name for segment in shard.documents.segments]
+        assert len(segment_names) == 3
+        first_segment_path = shard.documents.segments[0].path
+        first_mtime = os.path.getmtime(os.path.join(first_segment_path, "postings_tf.npy"))
+        
+        # 削除済みチャンクは検索・文書頻度から即座に除外されること
+        deleted_ids = list(range(0, len(documents), 3))
+        assert vector_db._tombstone_documents(shard, deleted_ids) == len(deleted_ids)
+        assert os.path.getmtime(os.path.join(first_segment_path, "postings_tf.npy")) == first_mtime
+        live_documents = [doc for doc_id, doc in enumerate(documents) if doc_id not in set(deleted_ids)]
+        
+        def assert_matches_live_documents(db):
+            expected_df = Counter()
+            for doc in live_documents:
+                expected_df.update(set(legacy_tokenize(doc.page_content)))
+            actual_df = {token: int(db.document_frequencies[token_id])
+                         for token, token_id in db.vocabulary.items() if db.document_frequencies[token_id]}
+            assert actual_df == dict(expected_df)
+            for query in ["GPIO 設定", "uart baudrate 割り込み", "クロック"]:
+                for kwargs in [{"k": 10}, {"k": 200, "score_threshold": 0.0}]:
+                    assert_same_results(db.search_similar_documents(query, **kwargs),
+                                        legacy_search(live_documents, query, **kwargs))
+        
+        assert_matches_live_documents(vector_db)
+        assert_matches_live_documents(SimpleVectorDatabase(persist_directory=persist_directory))
+        
+        # コンパクションで1セグメントに統合され、古いセグメントは削除されること
+        assert vector_db.compact()
+        assert len(shard.documents.segments) == 1
+        assert vector_db.count_documents() == len(live_documents)
+        assert not shard.tombstones
+        assert not any(os.path.exists(os.path.join(vector_db.index_directory, name)) for name in segment_names)
+        assert_matches_live_documents(vector_db)
+        assert_matches_live_documents(SimpleVectorDatabase(persist_directory=persist_directory))
+        logger.info("  ✓ 追記・削除・コンパクション後も従来実装と同一の結果")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_background_compaction_and_crash_recovery():
+    """セグメント数の上限でバックグラウンドコンパクションが走り、書きかけのセグメントが掃除されること"""
+    logger.info("=== バックグラウンドコンパクション・クラッシュ復旧テスト ===")
+    persist_directory = tempfile.mkdtemp()
+    original_max_segments = Config.SIMPLE_INDEX_MAX_SEGMENTS
+    try:
+        Config.SIMPLE_INDEX_MAX_SEGMENTS = 2
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        for doc in sample_documents():
+            assert vector_db.add_documents([doc])
+        assert vector_db.wait_for_compaction(timeout=30)
+        assert len(vector_db.shards["NUCLEO-F767ZI"].documents.segments) <= 2
+        assert vector_db.count_documents() == 4
+        
+        # 書き出し途中でクラッシュした残骸（ヘッダに載っていないセグメント）は再オープン時に削除
+        index_directory = vector_db.index_directory
+        os.makedirs(os.path.join(index_directory, "segment_999998"))
+        os.makedirs(os.path.join(index_directory, "segment_999999.tmp"))
+        reopened_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        assert not os.path.exists(os.path.join(index_directory, "segment_999998"))
+        assert not os.path.exists(os.path.join(index_directory, "segment_999999.tmp"))
+        results = reopened_db.search_similar_documents("ADC DMA", k=1)
+        assert results and results[0][0].metadata["chunk_id"] == "adc_0"
+        logger.info("  ✓ バックグラウンドコンパクションと残骸の削除を確認")
+    finally:
+        Config.SIMPLE_INDEX_MAX_SEGMENTS = original_max_segments
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def main():
+    """メインテスト関数"""
+    test_segment_roundtrip()
+    test_legacy_pickle_migration()
+    test_append_only_segments_and_compaction()
+    test_background_compaction_and_crash_recovery()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()
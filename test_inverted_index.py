@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+転置インデックス検索のパリティテスト
+合成コーパス上で、従来の全件コサイン類似度計算と検索結果が一致することを確認する
+"""
+import os
+import sys
+import math
+import random
+import re
+import shutil
+import tempfile
+import logging
+from collections import Counter
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+from langchain.schema import Document
+from app.models.simple_vector_db import SimpleVectorDatabase
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# TF行列はfloat32で保持するため、float64の従来実装とは丸め誤差分だけずれる
+SCORE_TOLERANCE = 1e-6
+
+EN_WORDS = ["gpio", "uart", "timer", "pwm", "adc", "dma", "clock", "interrupt",
+            "stm32", "nucleo", "cubemx", "hal", "register", "prescaler", "baudrate",
+            "i2c", "spi", "can", "usb", "flash", "ram", "cortex", "io", "led"]
+JA_WORDS = ["設定", "初期化", "割り込み", "タイマー", "クロック", "通信", "出力", "入力",
+            "変換", "ピン", "ボード", "マイコン", "レジスタ"]
+MICROCONTROLLERS = ["NUCLEO-F767ZI", "NUCLEO-F401RE"]
+CATEGORIES = ["hardware", "application_note", "user_manual", "general"]
+
+def legacy_tokenize(text):
+    """従来実装と同一のトークナイザ"""
+    text = text.lower()
+    text = re.sub(r'[^a-zA-Z0-9\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF\s]', ' ', text)
+    tokens = []
+    for word in text.split():
+        if re.match(r'^[a-zA-Z0-9]+$', word):
+            if len(word) > 2:
+                tokens.append(word)
+        else:
+            for i in range(len(word) - 1):
+                tokens.append(word[i:i + 2])
+    return tokens
+
+def legacy_tfidf(tokens, idf_scores):
+    """従来実装と同一のTF-IDFベクトル"""
+    counts = Counter(tokens)
+    return {token: count / len(tokens) * idf_scores.get(token, 0) for token, count in counts.items()}
+
+def legacy_cosine(vector1, vector2):
+    """従来実装と同一のコサイン類似度"""
+    common_tokens = set(vector1) & set(vector2)
+    if not common_tokens:
+        return 0.0
+    dot_product = sum(vector1[token] * vector2[token] for token in common_tokens)
+    magnitude1 = math.sqrt(sum(val ** 2 for val in vector1.values()))
+    magnitude2 = math.sqrt(sum(val ** 2 for val in vector2.values()))
+    if magnitude1 == 0 or magnitude2 == 0:
+        return 0.0
+    return dot_product / (magnitude1 * magnitude2)
+
+def legacy_search(documents, query, k, microcontroller=None, category=None, score_threshold=0.1,
+                  file_type=None, source=None):
+    """従来の全件走査による検索"""
+    token_doc_count = Counter()
+    for doc in documents:
+        token_doc_count.update(set(legacy_tokenize(doc.page_content)))
+    idf_scores = {token: math.log(len(documents) / count) for token, count in token_doc_count.items()}
+    
+    query_vector = legacy_tfidf(legacy_tokenize(query), idf_scores)
+    similarities = []
+    for doc in documents:
+        if microcontroller and doc.metadata.get("microcontroller") != microcontroller:
+            continue
+        if category and doc.metadata.get("category") != category:
+            continue
+        if file_type and doc.metadata.get("file_type") != file_type:
+            continue
+        if source and doc.metadata.get("source") != source:
+            continue
+        doc_vector = legacy_tfidf(legacy_tokenize(doc.page_content), idf_scores)
+        similarity = legacy_cosine(query_vector, doc_vector)
+        if similarity >= score_threshold:
+            similarities.append((doc, 1.0 - similarity))
+    similarities.sort(key=lambda x: x[1])
+    return similarities[:k]
+
+def build_synthetic_corpus(num_docs=300, seed=42):
+    """合成コーパスを生成（マイコン別に返す）"""
+    rng = random.Random(seed)
+    corpus = {mc: [] for mc in MICROCONTROLLERS}
+    for i in range(num_docs):
+        words = rng.choices(EN_WORDS, k=rng.randint(3, 40))
+        words += rng.choices(JA_WORDS, k=rng.randint(0, 10))
+        rng.shuffle(words)
+        mc = MICROCONTROLLERS[i % len(MICROCONTROLLERS)]
+        corpus[mc].append(Document(
+            page_content=" ".join(words),
+            metadata={"chunk_id": f"doc_{i}", "category": rng.choice(CATEGORIES)}
+        ))
+    return corpus
+
+def assert_same_results(actual, expected):
+    """検索結果（順位とスコア）が一致することを確認"""
+    assert len(actual) == len(expected), f"{len(actual)} != {len(expected)}"
+    for (doc_a, score_a), (doc_e, score_e) in zip(actual, expected):
+        # 同点のドキュメントは順序が入れ替わってもスコアが一致すれば良い
+        assert abs(score_a - score_e) <= SCORE_TOLERANCE, f"{score_a} != {score_e}"
+
+def test_search_parity():
+    """転置インデックス検索が従来の全件コサイン検索と一致すること"""
+    logger.info("=== 転置インデックス パリティテスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        corpus = build_synthetic_corpus()
+        for mc, documents in corpus.items():
+            assert vector_db.add_documents(documents, mc)
+        all_documents = [doc for documents in corpus.values() for doc in documents]
+        assert vector_db.search_similar_documents("GPIO 設定", k=5), "検索結果が空"
+        
+        queries = ["GPIO 設定", "uart baudrate 割り込み", "timer pwm prescaler",
+                   "stm32 nucleo ボード", "unknownword", "クロック"]
+        for query in queries:
+            for kwargs in [
+                {"k": 5},
+                {"k": 20, "score_threshold": 0.0},
+                {"k": 10, "microcontroller": "NUCLEO-F401RE", "score_threshold": 0.05},
+                {"k": 10, "category": "hardware"},
+                {"k": 1000, "score_threshold": 0.2},
+            ]:
+                expected = legacy_search(all_documents, query, **kwargs)
+                actual = vector_db.search_similar_documents(query, **kwargs)
+                assert_same_results(actual, expected)
+        
+        # 永続化データから再読み込みしても同じ結果になること
+        reloaded_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        for query in queries:
+            assert_same_results(reloaded_db.search_similar_documents(query, k=10),
+                                legacy_search(all_documents, query, k=10))
+        
+        logger.info("  ✓ 全クエリで従来実装と同一の結果")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_incremental_ingestion():
+    """追加時に新規チャンクのみトークン化されること"""
+    logger.info("=== 差分インデックス更新テスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        corpus = build_synthetic_corpus()
+        documents = [doc for docs in corpus.values() for doc in docs]
+        assert vector_db.add_documents(documents[:250])
+        
+        tokenized = []
+        original_encode = vector_db._encode
+        vector_db._encode = lambda text: tokenized.append(text) or original_encode(text)
+        assert vector_db.add_documents(documents[250:])
+        assert len(tokenized) == len(documents) - 250
+        
+        # 文書頻度カウンタが全件から数えた値と一致すること
+        expected_df = Counter()
+        for doc in documents:
+            expected_df.update(set(legacy_tokenize(doc.page_content)))
+        actual_df = {token: int(vector_db.document_frequencies[token_id])
+                     for token, token_id in vector_db.vocabulary.items()}
+        assert actual_df == dict(expected_df)
+        
+        for query in ["GPIO 設定", "timer pwm prescaler"]:
+            assert_same_results(vector_db.search_similar_documents(query, k=10),
+                                legacy_search(documents, query, k=10))
+        logger.info("  ✓ 新規チャンクのみ処理され、検索結果も一致")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_pruned_top_k_parity():
+    """上位k件の枝刈り検索が、枝刈りなしの全件順位付けの先頭k件と一致すること"""
+    logger.info("=== 上位k件 枝刈りパリティテスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        corpus = build_synthetic_corpus(num_docs=1000, seed=7)
+        for mc, documents in corpus.items():
+            assert vector_db.add_documents(documents[:300], mc)
+            assert vector_db.add_documents(documents[300:], mc)
+        for shard in vector_db.shards.values():
+            vector_db._tombstone_documents(shard, range(0, len(shard), 7))
+        
+        probed = []
+        for shard in vector_db.shards.values():
+            original_probe = shard.probe_postings
+            shard.probe_postings = (lambda original_probe: lambda token_id, doc_ids:
+                                    probed.append(len(doc_ids)) or original_probe(token_id, doc_ids))(original_probe)
+        
+        rng = random.Random(3)
+        shards = list(vector_db.shards.values())
+        for _ in range(100):
+            query = " ".join(rng.choices(EN_WORDS + JA_WORDS, k=rng.randint(1, 5)))
+            for k in [1, 3, 10]:
+                for score_threshold in [0.0, 0.1]:
+                    expected = vector_db._rank_documents(query, None, score_threshold, shards)
+                    actual = vector_db._rank_documents(query, k, score_threshold, shards)
+                    assert [(shard.name, doc_id, score) for shard, doc_id, score in actual] == \
+                        [(shard.name, doc_id, score) for shard, doc_id, score in expected[:k]], query
+        assert probed, "上限に届かないトークンのポスティングは飛ばし読みされる"
+        logger.info("  ✓ 枝刈りしても上位k件は同一")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_filter_bitmaps():
+    """メタデータフィルターのマスクで絞り込んだ検索が従来の逐次比較と一致すること"""
+    logger.info("=== メタデータフィルター テスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        corpus = build_synthetic_corpus(num_docs=400, seed=11)
+        for mc, documents in corpus.items():
+            for i, doc in enumerate(documents):
+                doc.metadata["file_type"] = [".pdf", ".md", ".txt"][i % 3]
+                doc.metadata["source"] = f"{mc}_{i % 5}.pdf"
+            assert vector_db.add_documents(documents, mc)
+        all_documents = [doc for documents in corpus.values() for doc in documents]
+        
+        filters = [
+            {"microcontroller": "NUCLEO-F401RE"},
+            {"microcontroller": "NUCLEO-F767ZI", "category": "hardware"},
+            {"category": "user_manual", "file_type": ".md"},
+            {"source": "NUCLEO-F767ZI_3.pdf"},
+            {"microcontroller": "NUCLEO-F401RE", "source": "NUCLEO-F767ZI_3.pdf"},
+            {"microcontroller": "UNKNOWN-BOARD"},
+        ]
+        
+        def assert_filtered_parity(db):
+            for query in ["GPIO 設定", "uart baudrate 割り込み", "クロック"]:
+                for kwargs in filters:
+                    for extra in [{"k": 5, "score_threshold": 0.05}, {"k": 300, "score_threshold": 0.0}]:
+                        assert_same_results(db.search_similar_documents(query, **kwargs, **extra),
+                                            legacy_search(all_documents, query, **kwargs, **extra))
+        
+        assert_filtered_parity(vector_db)
+        assert_filtered_parity(SimpleVectorDatabase(persist_directory=persist_directory))
+        
+        # 追加後はマスクが作り直されること
+        extra_doc = Document(page_content="GPIO 設定 GPIO 設定", metadata={"chunk_id": "extra", "source": "extra.pdf"})
+        assert vector_db.add_documents([extra_doc], "NUCLEO-F401RE")
+        results = vector_db.search_similar_documents("GPIO 設定", k=5, source="extra.pdf")
+        assert [doc.metadata["chunk_id"] for doc, _ in results] == ["extra"]
+        logger.info("  ✓ フィルター付き検索が従来実装と同一の結果")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def main():
+    """メインテスト関数"""
+    test_search_parity()
+    test_incremental_ingestion()
+    test_pruned_top_k_parity()
+    test_filter_bitmaps()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+共通OpenAIクライアントのテスト
+429/5xxはバックオフしながら再試行し、失敗が続くとサーキットブレーカーが開いて
+APIを呼ばずにテンプレート回答に切り替わり、待ち時間の後に回復することを確認する
+"""
+import os
+import sys
+import shutil
+import tempfile
+import logging
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+import httpx
+import openai
+from langchain.schema import Document
+from app.services.openai_client import (CircuitBreaker, CircuitOpenError, ResilientOpenAIClient,
+                                        get_shared_openai_client)
+from test_answer_cache import DOCUMENTS, FakeOpenAIClient, build_engine
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def api_error(status_code, headers=None):
+    """指定したステータスコードのOpenAI APIエラー"""
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status_code, headers=headers, request=request)
+    error_class = {429: openai.RateLimitError, 400: openai.BadRequestError}.get(status_code, openai.InternalServerError)
+    return error_class(f"HTTP {status_code}", response=response, body=None)
+
+class FakeClock:
+    """手動で進める時計"""
+    
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self):
+        return self.now
+
+class FlakyOpenAIClient(FakeOpenAIClient):
+    """errorsの例外を順に送出してから回答するOpenAIクライアントの代わり"""
+    
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = list(errors)
+        self.attempts = 0
+        create = self.completions.create
+        
+        def flaky_create(**kwargs):
+            self.attempts += 1
+            if self.errors:
+                raise self.errors.pop(0)
+            return create(**kwargs)
+        
+        self.chat = type("Chat", (), {"completions": type("Completions", (), {"create": staticmethod(flaky_create)})})
+
+def build_client(errors, failure_threshold=5, max_retries=3):
+    """（フェイク, 再試行付きクライアント, 待ち時間のリスト, 時計）"""
+    fake = FlakyOpenAIClient(errors)
+    clock = FakeClock()
+    sleeps = []
+    client = ResilientOpenAIClient(fake, CircuitBreaker(failure_threshold, 30, clock), max_retries=max_retries,
+                                   backoff_base=0.5, backoff_max=8.0, sleep=sleeps.append)
+    return fake, client, sleeps, clock
+
+def test_retry_with_backoff():
+    """429/5xxは上限付きの指数バックオフで再試行し、4xxは再試行しないこと"""
+    logger.info("=== 再試行テスト ===")
+    fake, client, sleeps, _ = build_client([api_error(429), api_error(503), api_error(500)])
+    response = client.chat.completions.create(model="gpt", messages=[])
+    assert response.choices[0].message.content == "回答1" and fake.attempts == 4
+    assert len(sleeps) == 3 and all(0 <= delay <= 0.5 * 2 ** i for i, delay in enumerate(sleeps)), sleeps
+    assert client.breaker.state == "closed" and client.breaker.consecutive_failures == 0
+    
+    # Retry-Afterがあればそれ以上待つ（上限まで）
+    _, client, sleeps, _ = build_client([api_error(429, {"retry-after": "3"}), api_error(429, {"retry-after": "60"})])
+    client.chat.completions.create(model="gpt", messages=[])
+    assert sleeps[0] >= 3 and sleeps[1] == 8.0, sleeps
+    
+    fake, client, sleeps, _ = build_client([api_error(400)])
+    try:
+        client.chat.completions.create(model="gpt", messages=[])
+        raise AssertionError("BadRequestErrorが送出されること")
+    except openai.BadRequestError:
+        pass
+    assert fake.attempts == 1 and sleeps == [] and client.breaker.consecutive_failures == 0
+    
+    fake, client, sleeps, _ = build_client([api_error(503)] * 3, max_retries=2)
+    try:
+        client.chat.completions.create(model="gpt", messages=[])
+        raise AssertionError("再試行を使い切ったら送出されること")
+    except openai.InternalServerError:
+        pass
+    assert fake.attempts == 3 and len(sleeps) == 2
+    logger.info("  ✓ 429/5xxのみバックオフして再試行")
+
+def test_circuit_breaker():
+    """失敗が続くとAPIを呼ばずに失敗し、待ち時間の後の試行が成功すれば回復すること"""
+    logger.info("=== サーキットブレーカーテスト ===")
+    fake, client, _, clock = build_client([api_error(503)] * 10, failure_threshold=3, max_retries=5)
+    try:
+        client.chat.completions.create(model="gpt", messages=[])
+        raise AssertionError("ブレーカーが開くこと")
+    except CircuitOpenError:
+        pass
+    assert fake.attempts == 3 and client.breaker.state == "open"
+    
+    for _ in range(5):
+        try:
+            client.chat.completions.create(model="gpt", messages=[])
+        except CircuitOpenError:
+            pass
+    assert fake.attempts == 3, "ブレーカーが開いている間はAPIを呼ばない"
+    
+    # 待ち時間の後は1件だけ試し、失敗すれば再び開く
+    clock.now = 30
+    try:
+        client.chat.completions.create(model="gpt", messages=[])
+    except CircuitOpenError:
+        pass
+    assert fake.attempts == 4 and client.breaker.state == "open"
+    
+    fake.errors = []
+    clock.now = 60
+    assert client.chat.completions.create(model="gpt", messages=[]).choices[0].message.content == "回答1"
+    assert client.breaker.state == "closed"
+    logger.info("  ✓ 劣化中はAPIを呼ばず、回復後は再び呼ぶ")
+
+def test_non_retryable_error_during_half_open():
+    """試行中の4xxでブレーカーが試行中のまま残らず、次の待ち時間の後に再び試すこと"""
+    logger.info("=== 試行中の4xxテスト ===")
+    fake, client, _, clock = build_client([api_error(500), api_error(500), api_error(400)],
+                                          failure_threshold=2, max_retries=1)
+    try:
+        client.chat.completions.create(model="gpt", messages=[])
+        raise AssertionError("ブレーカーが開くこと")
+    except openai.InternalServerError:
+        pass
+    assert client.breaker.state == "open"
+    
+    clock.now = 100
+    try:
+        client.chat.completions.create(model="gpt", messages=[])
+        raise AssertionError("BadRequestErrorが送出されること")
+    except openai.BadRequestError:
+        pass
+    assert client.breaker.state == "open", "試行中の4xxはopenに戻す"
+    
+    clock.now = 1e6
+    assert client.chat.completions.create(model="gpt", messages=[]).choices[0].message.content == "回答1"
+    assert client.breaker.state == "closed" and fake.attempts == 4
+    logger.info("  ✓ 試行中の4xxの後も回復する")
+
+def test_engine_falls_back_while_degraded():
+    """ブレーカーが開いている間、エンジンはAPIを待たずにテンプレート回答を返すこと"""
+    logger.info("=== エンジンのフォールバックテスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        fake, client, _, _ = build_client([api_error(503)] * 10, failure_threshold=2, max_retries=1)
+        engine = build_engine(persist_directory, client)
+        engine.vector_db.add_documents([
+            Document(page_content=text, metadata={"chunk_id": f"chunk_{i}"}) for i, text in enumerate(DOCUMENTS)
+        ])
+        question = "UARTの送信設定"
+        relevant_docs = engine._retrieve_documents(question, "NUCLEO-F767ZI", 5)
+        template_answer = engine._generate_template_answer(question, relevant_docs, "NUCLEO-F767ZI",
+                                                           engine._source_string(relevant_docs))
+        
+        assert engine.answer_question(question)["answer"] == template_answer and fake.attempts == 2
+        assert engine.answer_question(question)["answer"] == template_answer
+        events = list(engine.answer_question_stream(question))
+        assert [event["text"] for event in events[1:]] == [template_answer]
+        assert fake.attempts == 2, "ブレーカーが開いた後はAPIを呼ばない"
+        logger.info("  ✓ 劣化中はすぐにテンプレート回答")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_shared_client():
+    """同じAPIキーでは同じクライアント（接続プール）を使うこと"""
+    logger.info("=== 共通クライアントテスト ===")
+    client = get_shared_openai_client("sk-test-shared")
+    assert client is get_shared_openai_client("sk-test-shared")
+    assert client is not get_shared_openai_client("sk-test-other")
+    assert client.client.max_retries == 0, "再試行はSDKではなく共通クライアントで行う"
+    logger.info("  ✓ APIキーごとに1つのクライアント")
+
+def main():
+    """メインテスト関数"""
+    test_retry_with_backoff()
+    test_circuit_breaker()
+    test_non_retryable_error_during_half_open()
+    test_engine_falls_back_while_degraded()
+    test_shared_client()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()
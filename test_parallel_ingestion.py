@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+PDFの並列テキスト抽出のテスト
+プロセスプールでファイル・ページ範囲ごとに抽出しても、逐次処理と同じ順序・同じ内容の
+Documentが作られ、壊れたファイルは他のファイルの処理を妨げないことを確認する
+"""
+import os
+import sys
+import shutil
+import tempfile
+import logging
+
+import pytest
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+try:
+    from app.services.document_processor import Config, DocumentProcessor
+    PDF_AVAILABLE = True
+except ImportError as e:
+    logger.warning(f"pdfplumber / PyPDF2 が利用できないため、PDF抽出のテストをスキップします: {e}")
+    PDF_AVAILABLE = False
+
+# PDFライブラリがなければ（成功扱いにせず）スキップとして報告する
+requires_pdf = pytest.mark.skipif(not PDF_AVAILABLE, reason="pdfplumber / PyPDF2 が利用できません")
+
+def write_text_pdf(path, pages):
+    """ASCIIテキストだけのPDFを書き出す（pagesは各ページの行のリスト）"""
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages)))
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode("ascii"),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, lines in enumerate(pages):
+        escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines]
+        stream = ("BT /F1 10 Tf 12 TL 50 800 Td " + " ".join(f"({line}) Tj T*" for line in escaped) + " ET").encode("ascii")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode("ascii"))
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    with open(path, "wb") as f:
+        f.write(output)
+
+def write_manual(path, num_pages, lines_per_page=40):
+    """ページ番号・行番号入りのテスト用マニュアル"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    write_text_pdf(path, [
+        [f"{name} page {page} line {line}: HAL_GPIO_WritePin sets the output level of GPIO pin {line}."
+         for line in range(lines_per_page)]
+        for page in range(1, num_pages + 1)
+    ])
+
+@requires_pdf
+def test_parallel_matches_serial():
+    """並列抽出のDocumentが逐次処理と同じ順序・内容になること"""
+    logger.info("=== 並列抽出テスト ===")
+    directory = tempfile.mkdtemp()
+    try:
+        file_paths = []
+        for i, num_pages in enumerate([1, 5, 37, 3]):
+            path = os.path.join(directory, f"an{i:03d}.pdf")
+            write_manual(path, num_pages)
+            file_paths.append(path)
+        notes = os.path.join(directory, "notes.txt")
+        with open(notes, "w", encoding="utf-8") as f:
+            f.write("UARTの送信設定\n\n\n\nHAL_UART_Transmitで送信する")
+        file_paths.insert(2, notes)
+        
+        processor = DocumentProcessor()
+        serial = processor.create_documents(file_paths, workers=1)
+        parallel = processor.create_documents(file_paths, workers=3)
+        assert len(serial) > len(file_paths)
+        assert [(doc.page_content, doc.metadata) for doc in parallel] == \
+            [(doc.page_content, doc.metadata) for doc in serial]
+        
+        text = processor.extract_texts_parallel(file_paths[3:4], workers=2)[0]
+        assert text.count("--- Page") == 37 and text.index("--- Page 17 ---") < text.index("--- Page 18 ---")
+        logger.info(f"  ✓ {len(serial)}チャンクが逐次処理と一致")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+@requires_pdf
+def test_broken_file_is_skipped():
+    """壊れたPDFは空として扱い、他のファイルは処理されること"""
+    logger.info("=== 壊れたファイルのテスト ===")
+    directory = tempfile.mkdtemp()
+    try:
+        good = os.path.join(directory, "good.pdf")
+        broken = os.path.join(directory, "broken.pdf")
+        write_manual(good, 3)
+        with open(broken, "wb") as f:
+            f.write(b"%PDF-1.4\nnot really a pdf")
+        
+        processor = DocumentProcessor()
+        texts = processor.extract_texts_parallel([broken, good], workers=2)
+        assert texts[0] == "" and "good page 3 line 39" in texts[1]
+        documents = processor.create_documents([broken, good], workers=2)
+        assert documents and all(doc.metadata["filename"] == "good.pdf" for doc in documents)
+        logger.info("  ✓ 壊れたファイルを飛ばして処理")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+@requires_pdf
+def test_parallel_streaming_matches_serial():
+    """ストリーミングの抽出でもプロセスプールを使い、逐次処理と同じテキスト片・チャンクになること"""
+    logger.info("=== 並列ストリーミング抽出テスト ===")
+    directory = tempfile.mkdtemp()
+    original_pages_per_task = Config.PDF_PAGES_PER_TASK
+    try:
+        Config.PDF_PAGES_PER_TASK = 4
+        file_paths = []
+        for i, num_pages in enumerate([1, 13, 6]):
+            path = os.path.join(directory, f"an{i:03d}.pdf")
+            write_manual(path, num_pages)
+            file_paths.append(path)
+        notes = os.path.join(directory, "notes.txt")
+        broken = os.path.join(directory, "broken.pdf")
+        with open(notes, "w", encoding="utf-8") as f:
+            f.write("UARTの送信設定\n\nHAL_UART_Transmitで送信する")
+        with open(broken, "wb") as f:
+            f.write(b"%PDF-1.4\nnot really a pdf")
+        file_paths[1:1] = [notes, broken]
+        
+        processor = DocumentProcessor()
+        serial = list(processor.iter_text_pieces(file_paths, workers=1))
+        parallel = list(processor.iter_text_pieces(file_paths, workers=2))
+        assert parallel == serial and sum(1 for piece in serial if piece[1] == file_paths[3]) == 13
+        documents = list(processor.iter_documents(file_paths, workers=2))
+        assert [(doc.page_content, doc.metadata) for doc in documents] == \
+            [(doc.page_content, doc.metadata) for doc in processor.iter_documents(file_paths, workers=1)]
+        logger.info(f"  ✓ {len(serial)}個のテキスト片が逐次処理と一致")
+    finally:
+        Config.PDF_PAGES_PER_TASK = original_pages_per_task
+        shutil.rmtree(directory, ignore_errors=True)
+
+def main():
+    """メインテスト関数"""
+    if not PDF_AVAILABLE:
+        return
+    test_parallel_matches_serial()
+    test_broken_file_is_skipped()
+    test_parallel_streaming_matches_serial()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()
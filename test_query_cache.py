@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+検索結果キャッシュのテスト
+同じ質問の検索が省略され、ドキュメントの追加・削除・有効期限で無効化されることを確認する
+"""
+import os
+import sys
+import shutil
+import tempfile
+import logging
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+from langchain.schema import Document
+from app.models.simple_vector_db import SimpleVectorDatabase
+from app.models.simple_rag_engine import SimpleRAGEngine
+from test_inverted_index import build_synthetic_corpus, legacy_search, assert_same_results
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def count_rank_calls(vector_db, function):
+    """functionの実行中に実際の採点（_rank_documents）が行われた回数"""
+    calls = []
+    original_rank = vector_db._rank_documents
+    def counting_rank(*args, **kwargs):
+        calls.append(args)
+        return original_rank(*args, **kwargs)
+    vector_db._rank_documents = counting_rank
+    try:
+        function()
+    finally:
+        del vector_db._rank_documents
+    return len(calls)
+
+def test_repeated_queries_hit_cache():
+    """正規化後に同じクエリ・同じ条件なら採点を省略し、条件が違えば採点すること"""
+    logger.info("=== 検索結果キャッシュのヒットテスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        corpus = build_synthetic_corpus(num_docs=200)
+        documents = [doc for docs in corpus.values() for doc in docs]
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        for mc, docs in corpus.items():
+            assert vector_db.add_documents(docs, mc)
+        
+        first = vector_db.search_similar_documents("GPIO 設定", k=10)
+        assert_same_results(first, legacy_search(documents, "GPIO 設定", k=10))
+        
+        # 大文字小文字・記号・語順の違いは同じキャッシュエントリになる
+        assert count_rank_calls(vector_db, lambda: [
+            assert_same_results(vector_db.search_similar_documents(query, k=10), first)
+            for query in ["GPIO 設定", "gpio　設定！", "設定 GPIO"]
+        ]) == 0
+        
+        # 件数・フィルター・閾値・順位付け方式が違えば別のエントリ
+        assert count_rank_calls(vector_db, lambda: [
+            vector_db.search_similar_documents("GPIO 設定", k=5),
+            vector_db.search_similar_documents("GPIO 設定", k=10, microcontroller="NUCLEO-F401RE"),
+            vector_db.search_similar_documents("GPIO 設定", k=10, score_threshold=0.0),
+            vector_db.search_similar_documents("GPIO 設定", k=10, ranking="bm25"),
+        ]) == 4
+        stats = vector_db.query_cache.stats()
+        assert stats["hits"] == 3 and stats["misses"] == 5, stats
+        
+        status = SimpleRAGEngine(vector_db=vector_db, use_openai=False).get_system_status()
+        assert status["query_cache"]["hits"] == 3
+        logger.info("  ✓ 同じ質問は採点を省略し、ヒット・ミス数がシステム状態に出る")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_cache_invalidation():
+    """ドキュメントの追加・削除・有効期限切れで古い結果を返さないこと"""
+    logger.info("=== 検索結果キャッシュの無効化テスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        documents = build_synthetic_corpus(num_docs=60)["NUCLEO-F767ZI"]
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        assert vector_db.add_documents(documents, "NUCLEO-F767ZI")
+        vector_db.search_similar_documents("DMA 転送", k=10)
+        
+        new_documents = [Document(page_content="DMA 転送 完了 割り込み", metadata={"chunk_id": "dma_new"})]
+        assert vector_db.add_documents(new_documents, "NUCLEO-F767ZI")
+        all_documents = documents + new_documents
+        assert_same_results(vector_db.search_similar_documents("DMA 転送", k=10),
+                            legacy_search(all_documents, "DMA 転送", k=10))
+        
+        assert vector_db.delete_by_microcontroller("NUCLEO-F767ZI") == len(all_documents)
+        assert vector_db.search_similar_documents("DMA 転送", k=10) == []
+        
+        assert vector_db.add_documents(list(new_documents), "NUCLEO-F767ZI")
+        vector_db.search_similar_documents("DMA 転送", k=10)
+        vector_db.query_cache.ttl_seconds = -1
+        assert count_rank_calls(vector_db, lambda: vector_db.search_similar_documents("DMA 転送", k=10)) == 1
+        
+        # 件数上限を超えたら最も古く使われたエントリから破棄
+        vector_db.query_cache.ttl_seconds = 600
+        vector_db.query_cache.max_entries = 2
+        for query in ["DMA 転送", "割り込み", "DMA 転送", "完了"]:
+            vector_db.search_similar_documents(query, k=10)
+        assert count_rank_calls(vector_db, lambda: vector_db.search_similar_documents("DMA 転送", k=10)) == 0
+        assert count_rank_calls(vector_db, lambda: vector_db.search_similar_documents("割り込み", k=10)) == 1
+        logger.info("  ✓ 追加・削除・有効期限・件数上限で無効化")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_cached_results_are_copies():
+    """呼び出し元が結果のDocumentを書き換えても、以降のキャッシュヒットに影響しないこと"""
+    logger.info("=== キャッシュ結果の複製テスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        assert vector_db.add_documents([
+            Document(page_content="GPIO 出力 設定 HAL_GPIO_WritePin", metadata={"chunk_id": "gpio_0"}),
+            Document(page_content="UART 送信 設定 HAL_UART_Transmit", metadata={"chunk_id": "uart_0"}),
+        ])
+        for _ in range(2):  # 1回目はミス（登録した結果）、2回目はヒット（返した結果）を書き換える
+            results = vector_db.search_similar_documents("GPIO 設定", k=2)
+            results[0][0].metadata["chunk_id"] = "modified"
+            results[0][0].page_content = "modified"
+        
+        results = vector_db.search_similar_documents("GPIO 設定", k=2)
+        assert vector_db.query_cache.stats()["hits"] == 2
+        assert results[0][0].metadata["chunk_id"] == "gpio_0" and "GPIO" in results[0][0].page_content
+        logger.info("  ✓ 書き換えはキャッシュに残らない")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def main():
+    """メインテスト関数"""
+    test_repeated_queries_hit_cache()
+    test_cache_invalidation()
+    test_cached_results_are_copies()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+プロセス共通リソースのテスト
+全セッションで1つのリソースを共有し、自プロセスでの取り込みでは読み直さず、
+別プロセスがインデックスを更新した場合は読み直してエンジンを差し替えることを確認する
+"""
+import os
+import sys
+import shutil
+import tempfile
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+from langchain.schema import Document
+from app.models.simple_vector_db import SimpleVectorDatabase
+from app.services import shared_resources
+from app.services.shared_resources import AppResources
+from config import Config
+from models.index_shard import IndexShard
+from test_answer_cache import DOCUMENTS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def make_documents(prefix):
+    """テスト用のチャンク"""
+    return [Document(page_content=text, metadata={"chunk_id": f"{prefix}_{i}"}) for i, text in enumerate(DOCUMENTS)]
+
+def test_singleton():
+    """同時に取得しても作成は1回だけで、全員が同じリソースを受け取ること"""
+    logger.info("=== 共有リソースの作成テスト ===")
+    created = []
+    original_class, original_resources = shared_resources.AppResources, shared_resources._app_resources
+    barrier = threading.Barrier(8)
+    
+    def fake_resources():
+        created.append(object())
+        return created[-1]
+    
+    def get():
+        barrier.wait()
+        return shared_resources.get_app_resources()
+    
+    try:
+        shared_resources.AppResources = fake_resources
+        shared_resources._app_resources = None
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: get(), range(8)))
+        assert len(created) == 1 and all(result is created[0] for result in results)
+    finally:
+        shared_resources.AppResources, shared_resources._app_resources = original_class, original_resources
+    logger.info("  ✓ 作成は1回だけ")
+
+def test_reload_on_external_ingestion():
+    """自プロセスの取り込みでは読み直さず、別プロセスの更新では読み直すこと"""
+    logger.info("=== 読み直しテスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        resources = AppResources(persist_directory)
+        assert resources.reload_if_index_changed() is False
+        
+        # 自プロセスでの取り込み（メモリ上に反映済み）
+        engine = resources.rag_engine
+        with resources.ingestion() as vector_db:
+            assert vector_db.add_documents(make_documents("local"))
+        assert resources.reload_if_index_changed() is False and resources.rag_engine is engine
+        assert engine.vector_db.count_documents() == len(DOCUMENTS)
+        
+        # 別プロセスでの取り込み（別のインスタンスがディスクを更新）
+        SimpleVectorDatabase(persist_directory=persist_directory).add_documents(make_documents("external"))
+        assert resources.reload_if_index_changed() is True
+        assert resources.rag_engine is not engine, "新しいエンジンに差し替える"
+        assert resources.vector_db.count_documents() == 2 * len(DOCUMENTS)
+        assert engine.vector_db.search_similar_documents("GPIO 出力", k=3), "古いエンジンも使い続けられる"
+        assert resources.reload_if_index_changed() is False
+        
+        # 明示的な読み直し
+        resources.reload()
+        assert resources.vector_db.count_documents() == 2 * len(DOCUMENTS)
+        logger.info("  ✓ 別プロセスの更新だけを読み直す")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_concurrent_reads_during_ingestion():
+    """取り込み中も複数セッションから検索できること"""
+    logger.info("=== 同時アクセステスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        resources = AppResources(persist_directory)
+        with resources.ingestion() as vector_db:
+            vector_db.add_documents(make_documents("base"))
+        
+        def search(i):
+            return len(resources.rag_engine.vector_db.search_similar_documents("UART 送信", k=3))
+        
+        def ingest(i):
+            with resources.ingestion() as vector_db:
+                return vector_db.add_documents(make_documents(f"batch{i}"))
+        
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            searches = [executor.submit(search, i) for i in range(40)]
+            ingests = [executor.submit(ingest, i) for i in range(5)]
+            assert all(future.result() > 0 for future in searches)
+            assert all(future.result() for future in ingests)
+        assert resources.vector_db.count_documents() == 6 * len(DOCUMENTS)
+        assert resources.reload_if_index_changed() is False
+        logger.info("  ✓ 取り込みと検索を同時に実行")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_reload_waits_for_compaction():
+    """バックグラウンドコンパクション中の読み直しは、完了を待ってから統合後のインデックスを読むこと"""
+    logger.info("=== コンパクション中の読み直しテスト ===")
+    persist_directory = tempfile.mkdtemp()
+    original_max_segments, original_compact = Config.SIMPLE_INDEX_MAX_SEGMENTS, IndexShard.compact
+    started, release = threading.Event(), threading.Event()
+    
+    def slow_compact(shard, *args, **kwargs):
+        started.set()
+        release.wait(30)
+        return original_compact(shard, *args, **kwargs)
+    
+    try:
+        Config.SIMPLE_INDEX_MAX_SEGMENTS = 2
+        IndexShard.compact = slow_compact
+        resources = AppResources(persist_directory)
+        with resources.ingestion() as vector_db:
+            for document in make_documents("segment"):
+                vector_db.add_documents([document])
+        assert started.wait(30), "コンパクションが始まる"
+        
+        reloader = threading.Thread(target=resources.reload)
+        reloader.start()
+        time.sleep(0.2)
+        assert reloader.is_alive() and resources.vector_db is vector_db, "コンパクションの完了を待つ"
+        release.set()
+        reloader.join(30)
+        assert not reloader.is_alive() and resources.vector_db is not vector_db
+        assert len(resources.vector_db.shards["NUCLEO-F767ZI"].documents.segments) <= 2, "統合後のセグメントを読む"
+        assert resources.vector_db.count_documents() == len(DOCUMENTS)
+        assert resources.vector_db.search_similar_documents("GPIO 出力", k=3)
+        logger.info("  ✓ コンパクションの完了後に読み直す")
+    finally:
+        release.set()
+        IndexShard.compact = original_compact
+        Config.SIMPLE_INDEX_MAX_SEGMENTS = original_max_segments
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def main():
+    """メインテスト関数"""
+    test_singleton()
+    test_reload_on_external_ingestion()
+    test_concurrent_reads_during_ingestion()
+    test_reload_waits_for_compaction()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+同じ質問の同時実行をまとめるテスト
+同時に届いた同じ質問（通常・ストリーミング）はOpenAI APIを1回だけ呼び、
+全員が同じ結果を受け取り、途中から加わっても最初のイベントから受け取ることを確認する
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+from langchain.schema import Document
+from app.models.single_flight import SingleFlight
+from test_answer_cache import DOCUMENTS, FakeCompletions, FakeOpenAIClient, build_engine
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class SlowCompletions(FakeCompletions):
+    """一定の遅延で回答するchat.completionsの代わり（ストリーミングは1文字ごとに遅延）"""
+    
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+        self.closed_streams = 0
+    
+    def create(self, model, messages, stream=False, **kwargs):
+        if not stream:
+            time.sleep(self.latency)
+        return super().create(model, messages, stream=stream, **kwargs)
+    
+    def _stream(self, content):
+        try:
+            for chunk in super()._stream(content):
+                time.sleep(self.latency)
+                yield chunk
+        except GeneratorExit:
+            self.closed_streams += 1
+            raise
+
+def build_slow_engine(persist_directory, latency):
+    """遅いフェイククライアントを使うRAGエンジン（回答キャッシュなし）"""
+    client = FakeOpenAIClient()
+    client.completions = SlowCompletions(latency)
+    client.chat = type("Chat", (), {"completions": client.completions})
+    engine = build_engine(persist_directory, client)
+    engine.answer_cache.max_entries = 0
+    engine.vector_db.add_documents([
+        Document(page_content=text, metadata={"chunk_id": f"chunk_{i}", "filename": f"manual_{i}.pdf"})
+        for i, text in enumerate(DOCUMENTS)
+    ])
+    return engine, client.completions
+
+def test_concurrent_answers_share_one_call():
+    """同時に届いた同じ質問はAPIを1回だけ呼び、全員が同じ回答を受け取ること"""
+    logger.info("=== 同時質問の共有テスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        engine, completions = build_slow_engine(persist_directory, 0.3)
+        questions = ["GPIOの設定方法", "GPIOの設定方法？", "  gpioの設定方法 "] * 4
+        
+        with ThreadPoolExecutor(max_workers=len(questions)) as executor:
+            results = list(executor.map(engine.answer_question, questions))
+        assert completions.calls == 1, completions.calls
+        assert all(result == results[0] for result in results) and results[0]["answer"] == "回答1"
+        assert engine.get_system_status()["single_flight"] == {"executions": 1, "shared": len(questions) - 1}
+        
+        # 共有した結果は呼び出し元ごとのコピー
+        results[1]["sources"].clear()
+        assert results[0]["sources"]
+        
+        # 検索件数が違う質問・処理が終わった後の質問は新たに実行する
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(engine.answer_question, ["GPIOの設定方法"] * 2, ["NUCLEO-F767ZI"] * 2, [5, 3]))
+        assert completions.calls == 3
+        logger.info(f"  ✓ {len(questions)}件の同じ質問でAPI呼び出し1回")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_concurrent_streams_share_one_call():
+    """同じ質問のストリーミングは1つの応答を共有し、途中から加わっても全イベントを受け取ること"""
+    logger.info("=== ストリーミングの共有テスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        engine, completions = build_slow_engine(persist_directory, 0.05)
+        first_token = threading.Event()
+        
+        def consume(wait_for_token):
+            if wait_for_token:
+                first_token.wait()
+            events = []
+            for event in engine.answer_question_stream("UARTの送信設定"):
+                events.append(event)
+                if event["type"] == "token":
+                    first_token.set()
+            return events
+        
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            results = list(executor.map(consume, [False] * 3 + [True] * 3))
+        assert completions.calls == 1, completions.calls
+        assert all(events == results[0] for events in results)
+        assert [event["text"] for event in results[0][1:]] == ["回", "答", "1"]
+        
+        # 終わった後は新たに実行する
+        events = list(engine.answer_question_stream("UARTの送信設定"))
+        assert [event["text"] for event in events[1:]] == ["回", "答", "2"]
+        logger.info("  ✓ 6件の同じストリーミングでAPI呼び出し1回")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_abandoned_stream_is_closed():
+    """購読者が全員途中でやめたらAPIの応答を打ち切り、次の質問は新たに実行すること"""
+    logger.info("=== 中断したストリーミングのテスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        engine, completions = build_slow_engine(persist_directory, 0.0)
+        events = engine.answer_question_stream("ADCの変換")
+        assert next(events)["type"] == "metadata"
+        assert next(events)["text"] == "回"
+        events.close()
+        assert completions.closed_streams == 1
+        
+        events = list(engine.answer_question_stream("ADCの変換"))
+        assert [event["text"] for event in events[1:]] == ["回", "答", "2"]
+        logger.info("  ✓ 中断したストリーミングは打ち切り")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_unstarted_subscriber_is_not_counted():
+    """読み始めずに捨てた購読者は数えず、読んでいた購読者がやめたら元のイベント列を閉じること"""
+    logger.info("=== 読まずに捨てた購読者のテスト ===")
+    single_flight = SingleFlight()
+    closed = threading.Event()
+    
+    def tokens():
+        try:
+            for token in ["回", "答", "3"]:
+                yield token
+        finally:
+            closed.set()
+    
+    abandoned = single_flight.stream("key", tokens)
+    reader = single_flight.stream("key", tokens)
+    del abandoned
+    assert next(reader) == "回"
+    reader.close()
+    assert closed.is_set(), "読んでいた購読者がやめたら打ち切る"
+    assert list(single_flight.stream("key", tokens)) == ["回", "答", "3"], "打ち切った後は新たに実行する"
+    assert single_flight.stats == {"executions": 2, "shared": 1}
+    logger.info("  ✓ 読まずに捨てた購読者は数えない")
+
+def test_errors_are_shared():
+    """実行中の処理の例外は、結果を待っていた全員に伝わること"""
+    logger.info("=== 例外の共有テスト ===")
+    single_flight = SingleFlight()
+    started = threading.Event()
+    
+    def failing():
+        started.set()
+        time.sleep(0.2)
+        raise ValueError("boom")
+    
+    def call(key):
+        try:
+            single_flight.do(key, failing)
+        except ValueError as e:
+            return str(e)
+    
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        leader = executor.submit(call, "key")
+        started.wait()
+        followers = [executor.submit(call, "key") for _ in range(2)]
+        assert [future.result() for future in [leader] + followers] == ["boom"] * 3
+    assert single_flight.stats == {"executions": 1, "shared": 2}
+    assert single_flight.do("key", lambda: 1) == (1, False), "終わった後は新たに実行する"
+    logger.info("  ✓ 例外も共有")
+
+def main():
+    """メインテスト関数"""
+    test_concurrent_answers_share_one_call()
+    test_concurrent_streams_share_one_call()
+    test_abandoned_stream_is_closed()
+    test_unstarted_subscriber_is_not_counted()
+    test_errors_are_shared()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+ストリーミング回答のテスト
+参考資料・信頼度が最初に返り、回答の断片をつなげると通常の回答と一致し、
+OpenAIの失敗時はテンプレート回答・中断の通知になることを確認する
+"""
+import os
+import sys
+import shutil
+import tempfile
+import logging
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+from langchain.schema import Document
+from app.models.simple_rag_engine import NO_DOCUMENTS_ANSWER, INTERRUPTED_ANSWER_NOTE
+from test_answer_cache import DOCUMENTS, FakeOpenAIClient, build_engine
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def collect(events):
+    """（最初のイベント, 回答の断片のリスト）"""
+    events = list(events)
+    assert all(event["type"] == "token" for event in events[1:])
+    return events[0], [event["text"] for event in events[1:]]
+
+def test_stream_matches_answer_question():
+    """メタデータが先に返り、断片をつなげた回答が通常の回答と一致すること"""
+    logger.info("=== ストリーミング回答テスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        client = FakeOpenAIClient()
+        engine = build_engine(persist_directory, client)
+        engine.vector_db.add_documents([
+            Document(page_content=text, metadata={"chunk_id": f"chunk_{i}", "filename": f"manual_{i}.pdf"})
+            for i, text in enumerate(DOCUMENTS)
+        ])
+        
+        events = engine.answer_question_stream("GPIOの出力設定方法を教えてください")
+        metadata = next(events)
+        assert metadata["type"] == "metadata" and client.completions.calls == 0, "APIより先に参考資料を返す"
+        _, tokens = collect([metadata] + list(events))
+        assert tokens == ["回", "答", "1"]
+        
+        # ストリーミングで得た回答はキャッシュされ、通常の回答でも再利用される
+        result = engine.answer_question("GPIOの出力設定方法を教えてください")
+        assert result["answer"] == "回答1" and client.completions.calls == 1
+        for key in ("sources", "confidence", "num_sources", "microcontroller"):
+            assert metadata[key] == result[key], key
+        
+        # キャッシュ済みの回答は1つの断片で返す
+        _, tokens = collect(engine.answer_question_stream("GPIOの出力設定方法を教えてください"))
+        assert tokens == ["回答1"] and client.completions.calls == 1
+        
+        # テンプレート回答・関連資料なしの場合
+        engine.use_openai = False
+        metadata, tokens = collect(engine.answer_question_stream("UARTの送信設定"))
+        assert "".join(tokens) == engine.answer_question("UARTの送信設定")["answer"]
+        metadata, tokens = collect(engine.answer_question_stream("zzzz qqqq"))
+        assert metadata["sources"] == [] and tokens == [NO_DOCUMENTS_ANSWER]
+        logger.info("  ✓ 参考資料が先に返り、回答は通常版と一致")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_stream_failures():
+    """最初の断片より前の失敗はテンプレート回答、途中の失敗は中断を通知してキャッシュしないこと"""
+    logger.info("=== ストリーミング失敗時のテスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        client = FakeOpenAIClient()
+        engine = build_engine(persist_directory, client)
+        engine.vector_db.add_documents([
+            Document(page_content=text, metadata={"chunk_id": f"chunk_{i}"}) for i, text in enumerate(DOCUMENTS)
+        ])
+        question = "UARTの送信設定"
+        relevant_docs = engine._retrieve_documents(question, "NUCLEO-F767ZI", 5)
+        template_answer = engine._generate_template_answer(question, relevant_docs, "NUCLEO-F767ZI",
+                                                           engine._source_string(relevant_docs))
+        
+        client.completions.fail_after = 0
+        _, tokens = collect(engine.answer_question_stream(question))
+        assert tokens == [template_answer]
+        
+        client.completions.fail_after = 2
+        _, tokens = collect(engine.answer_question_stream(question))
+        assert tokens == ["回", "答", INTERRUPTED_ANSWER_NOTE]
+        assert engine.answer_cache.stats()["entries"] == 0, "途中で失敗した回答はキャッシュしない"
+        logger.info("  ✓ 失敗時はテンプレート回答・中断の通知")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def main():
+    """メインテスト関数"""
+    test_stream_matches_answer_question()
+    test_stream_failures()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+チャンク分割のテスト
+チャンクがサイズ内で隙間なく重なり合い、区切り文字の優先順位に従って切られ、
+ストリーミングでも一括処理と同じ位置・ページ番号になることを確認する
+"""
+import os
+import sys
+import random
+import logging
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+from app.services.text_chunker import TextChunker, TextSpan
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ALPHABET = ["GPIO", "設定", "。", ".", "\n", "\n\n", " ", "\t", "x" * 30, "VDD=3.3V", "--- Page 3 ---", "--- Page 12 ---"]
+
+def random_text(max_tokens: int = 40) -> str:
+    return "".join(random.choice(ALPHABET) for _ in range(random.randint(0, max_tokens))).strip()
+
+def random_pieces(text: str):
+    """textを任意の位置で片に分ける"""
+    cuts = sorted(random.sample(range(len(text) + 1), min(len(text) + 1, random.randint(0, 8))))
+    return [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+
+def test_chunks_cover_text():
+    """チャンクがサイズ内に収まり、前後の空白を含まず、隙間なく順に進むこと"""
+    logger.info("=== チャンクの範囲のテスト ===")
+    random.seed(0)
+    for chunk_size, chunk_overlap in [(10, 3), (20, 0), (50, 10), (7, 6), (100, 40)]:
+        chunker = TextChunker(chunk_size, chunk_overlap)
+        for _ in range(2000):
+            text = random_text()
+            covered, previous = 0, None
+            for span in chunker.split_spans(text):
+                chunk = text[span.start:span.end]
+                assert chunk and chunk == chunk.strip() and len(chunk) <= chunk_size, (text, span)
+                assert not text[covered:span.start].strip(), "前のチャンクとの間に抜けがない"
+                if previous is not None:
+                    assert span.start > previous.start and span.end > previous.end, "前のチャンクより先に進む"
+                    assert previous.end - span.start <= chunk_overlap, "重なりはchunk_overlap以内"
+                covered, previous = span.end, span
+            assert not text[covered:].strip()
+    logger.info("  ✓ サイズ内で隙間なく分割")
+
+def test_streaming_matches_bulk():
+    """テキスト片を順に分割しても、一括で分割した場合と同じ位置・ページ番号・文字列になること"""
+    logger.info("=== ストリーミングのテスト ===")
+    random.seed(1)
+    chunker = TextChunker(20, 6)
+    for _ in range(3000):
+        text = random_text(80)
+        chunks = list(chunker.iter_chunks(random_pieces(text)))
+        assert [span for span, _ in chunks] == chunker.split_spans(text), text
+        assert [chunk for _, chunk in chunks] == chunker.split_text(text)
+    logger.info("  ✓ 一括処理と同じチャンク")
+
+def test_separator_priority():
+    """範囲内の最も優先順位の高い区切り文字で切り、区切り文字はチャンクの末尾に残ること"""
+    logger.info("=== 区切り文字のテスト ===")
+    chunker = TextChunker(20, 8)
+    assert chunker.split_text("GPIOの設定。出力モード\n\nUARTの設定。送信") == ["GPIOの設定。出力モード", "UARTの設定。送信"]
+    assert chunker.split_text("GPIOの設定。出力モードを選ぶ。HAL_GPIO_WritePinで出力") == [
+        "GPIOの設定。出力モードを選ぶ。", "HAL_GPIO_WritePinで出力"]
+    # 単語で切った場合は単語の境界で重ねる
+    assert chunker.split_text("alpha beta gamma delta epsilon zeta") == [
+        "alpha beta gamma", "gamma delta epsilon", "epsilon zeta"]
+    # 区切り文字がなければchunk_size文字で切り、chunk_overlap文字重ねる
+    assert chunker.split_spans("x" * 50) == [TextSpan(0, 20), TextSpan(12, 32), TextSpan(24, 44), TextSpan(36, 50)]
+    logger.info("  ✓ 区切り文字の優先順位に従う")
+
+def test_page_numbers():
+    """ページ見出しからチャンクの先頭・末尾のページ番号を求めること（見出しのないテキストはNone）"""
+    logger.info("=== ページ番号のテスト ===")
+    chunker = TextChunker(40, 10)
+    text = "--- Page 1 ---\nGPIOの設定\n--- Page 2 ---\nUARTの設定。送信はHAL_UART_Transmitで行う\n--- Page 5 ---\nADC"
+    spans = chunker.split_spans(text)
+    assert [(span.page, span.page_end) for span in spans] == [(1, 1), (2, 2), (5, 5)], spans
+    assert all(span.page is None for span in chunker.split_spans("GPIOの設定\nUARTの設定"))
+    # 見出しが片の境界で分かれても同じ
+    for cut in range(len(text)):
+        assert [span for span, _ in chunker.iter_chunks([text[:cut], text[cut:]])] == spans, cut
+    logger.info("  ✓ ページ見出しからページ番号を付与")
+
+def main():
+    """メインテスト関数"""
+    test_chunks_cover_text()
+    test_streaming_matches_bulk()
+    test_separator_priority()
+    test_page_numbers()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+トークンキャッシュのテスト
+再起動後に同じ本文を取り込んでもトークン化が行われず、検索結果が変わらないこと、
+書きかけのキャッシュや語彙の作り直しで誤ったトークンIDを使わないことを確認する
+"""
+import os
+import sys
+import shutil
+import tempfile
+import logging
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+import numpy as np
+from langchain.schema import Document
+from app.models.simple_vector_db import SimpleVectorDatabase
+from app.models.token_cache import DATA_FILE, KEYS_FILE, RECORD_DTYPE
+from test_inverted_index import build_synthetic_corpus, legacy_search, assert_same_results
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def copy_documents(documents):
+    """同じ本文・メタデータのドキュメント（再取り込み用）"""
+    return [Document(page_content=doc.page_content, metadata=dict(doc.metadata)) for doc in documents]
+
+def count_encode_calls(vector_db, function):
+    """functionの実行中にトークナイザのencodeが呼ばれた回数"""
+    calls = []
+    tokenizer = vector_db.tokenizer
+    original_encode = tokenizer.encode
+    def counting_encode(text):
+        calls.append(text)
+        return original_encode(text)
+    tokenizer.encode = counting_encode
+    try:
+        function()
+    finally:
+        del tokenizer.encode
+    return len(calls)
+
+def test_reingestion_skips_tokenization():
+    """再起動後に同じ本文を取り込むとトークン化を行わないこと"""
+    logger.info("=== 再取り込み時のトークン化省略テスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        corpus = build_synthetic_corpus(num_docs=200)
+        all_documents = []
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        for mc, documents in corpus.items():
+            assert vector_db.add_documents(documents, mc)
+            all_documents.extend(documents)
+        
+        reopened_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        def reingest():
+            for mc, documents in corpus.items():
+                copies = copy_documents(documents)
+                assert reopened_db.add_documents(copies, mc)
+                all_documents.extend(copies)
+        assert count_encode_calls(reopened_db, reingest) == 0, "変更のない本文はトークン化しない"
+        assert reopened_db.token_cache.hits == len(all_documents) // 2
+        
+        # 新しい本文だけがトークン化されること
+        new_documents = [Document(page_content="新規 追加 DMA バースト転送", metadata={"chunk_id": "new_0"})]
+        assert count_encode_calls(reopened_db, lambda: reopened_db.add_documents(new_documents, "NUCLEO-F401RE")) == 1
+        all_documents.extend(new_documents)
+        
+        final_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        for query in ["GPIO 設定", "uart baudrate 割り込み", "DMA 転送"]:
+            for kwargs in [{"k": 10}, {"k": 800, "score_threshold": 0.0}]:
+                assert_same_results(final_db.search_similar_documents(query, **kwargs),
+                                    legacy_search(all_documents, query, **kwargs))
+        logger.info("  ✓ キャッシュ済みの本文はトークン化せず、結果も従来実装と一致")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def test_stale_cache_is_ignored():
+    """書きかけのレコードや語彙の異なるキャッシュを使わないこと"""
+    logger.info("=== 不整合なキャッシュの無視テスト ===")
+    persist_directory = tempfile.mkdtemp()
+    try:
+        documents = build_synthetic_corpus(num_docs=50)["NUCLEO-F767ZI"]
+        vector_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        assert vector_db.add_documents(copy_documents(documents), "NUCLEO-F767ZI")
+        num_entries = len(vector_db.token_cache)
+        
+        # データ末尾を超えるレコードと、レコード長に満たない末尾を追記
+        keys_path = os.path.join(vector_db.index_directory, KEYS_FILE)
+        torn_record = np.zeros(1, dtype=RECORD_DTYPE)
+        torn_record[0] = (b"\x00" * 16, 1 << 40, 8)
+        with open(keys_path, "ab") as f:
+            f.write(torn_record.tobytes() + b"\x01\x02\x03")
+        reopened_db = SimpleVectorDatabase(persist_directory=persist_directory)
+        assert len(reopened_db.token_cache) == num_entries
+        assert reopened_db.add_documents(copy_documents(documents), "NUCLEO-F767ZI")
+        assert_same_results(reopened_db.search_similar_documents("GPIO 設定", k=100, score_threshold=0.0),
+                            legacy_search(documents + documents, "GPIO 設定", k=100, score_threshold=0.0))
+        
+        # インデックスのないディレクトリに残ったキャッシュ（別の語彙）は破棄されること
+        fresh_directory = os.path.join(persist_directory, "fresh")
+        os.makedirs(os.path.join(fresh_directory, "simple_index"))
+        for name in (DATA_FILE, KEYS_FILE):
+            shutil.copy(os.path.join(reopened_db.index_directory, name), os.path.join(fresh_directory, "simple_index"))
+        fresh_db = SimpleVectorDatabase(persist_directory=fresh_directory)
+        assert len(fresh_db.token_cache) == 0
+        other_documents = [Document(page_content="ADC DMA 変換 " + doc.page_content, metadata=dict(doc.metadata))
+                           for doc in documents]
+        assert fresh_db.add_documents(copy_documents(other_documents + documents), "NUCLEO-F767ZI")
+        assert_same_results(fresh_db.search_similar_documents("GPIO 設定", k=100, score_threshold=0.0),
+                            legacy_search(other_documents + documents, "GPIO 設定", k=100, score_threshold=0.0))
+        logger.info("  ✓ 書きかけのレコード・古い語彙のキャッシュを使わない")
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+def main():
+    """メインテスト関数"""
+    test_reingestion_skips_tokenization()
+    test_stale_cache_is_ignored()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()
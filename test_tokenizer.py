@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+トークナイザのテスト
+1パスのトークナイザが従来の_tokenizeと同一のトークン列を返し、
+トークンIDが語彙と一致することを確認する
+"""
+import os
+import sys
+import random
+import logging
+
+# パス設定
+current_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(current_dir, "app")
+sys.path.insert(0, app_dir)
+sys.path.insert(0, current_dir)
+
+from app.models.tokenizer import Tokenizer, tokenize
+from test_inverted_index import legacy_tokenize
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 英数字・日本語・記号・全角文字・大文字変換で文字数が変わる文字などを混ぜる
+ALPHABET = (list("abcXYZ0129") + list("設定割り込みクロックタイマーのをはガギ") +
+            list(" \t\n　_-.,:;()[]{}/\\\"'#%&*+=<>!?") +
+            ["ＧＰＩＯ", "İ", "K", "ß", "ｶﾀｶﾅ", "①", "😀", "々", "ー"])
+
+def random_text(rng, length):
+    """ランダムな混在テキスト"""
+    return "".join(rng.choice(ALPHABET) for _ in range(length))
+
+def test_tokenize_matches_legacy():
+    """従来の_tokenizeと同一のトークン列を返すこと"""
+    logger.info("=== トークナイザ互換性テスト ===")
+    rng = random.Random(0)
+    samples = [
+        "",
+        "HAL_GPIO_WritePin(GPIOB, GPIO_PIN_0, GPIO_PIN_SET);",
+        "STM32F767ZIのGPIO設定：クロック有効化→初期化",
+        "UART baudrate 115200 bps, 8N1",
+        "--- Page 12 ---\nTimer3 Channel 1 (PWM出力)",
+    ]
+    samples += [random_text(rng, rng.randint(1, 80)) for _ in range(2000)]
+    for text in samples:
+        assert tokenize(text) == legacy_tokenize(text), repr(text)
+    logger.info("  ✓ 従来の_tokenizeと同一")
+
+def test_encode_interns_tokens():
+    """トークンIDが語彙に登録され、既存のIDは変わらないこと"""
+    logger.info("=== トークンIDインターンテスト ===")
+    rng = random.Random(1)
+    vocabulary = {"gpio": 0, "設定": 1}
+    tokenizer = Tokenizer(vocabulary)
+    id_to_token = {}
+    for _ in range(500):
+        text = random_text(rng, rng.randint(1, 60)) + " GPIO 設定"
+        token_ids = tokenizer.encode(text)
+        id_to_token.update((token_id, token) for token, token_id in vocabulary.items())
+        assert [id_to_token[token_id] for token_id in token_ids] == tokenize(text), repr(text)
+    assert vocabulary["gpio"] == 0 and vocabulary["設定"] == 1
+    assert sorted(vocabulary.values()) == list(range(len(vocabulary)))
+    logger.info("  ✓ 語彙IDの割り当てを確認")
+
+def main():
+    """メインテスト関数"""
+    test_tokenize_matches_legacy()
+    test_encode_interns_tokens()
+    logger.info("🎉 全てのテストが成功しました！")
+
+if __name__ == "__main__":
+    main()